@@ -8,42 +8,142 @@ from flask import (
     session,
     send_file,
     jsonify,
+    g,
+    Response,
+    stream_with_context,
 )
 import bcrypt
 import pandas as pd
 import os
-import json
+import secrets
+import time
+import logging
+import multiprocessing
 from werkzeug.utils import secure_filename
 from datetime import datetime
+from urllib.parse import quote
+from utils.logs import configure_logging
 from utils.db_mysql import (
     get_connection,
+    ensure_schema,
     save_job,
     get_user_jobs,
-    get_job_by_id,
+    get_user_job_stats,
+    get_top_users,
+    get_daily_usage,
     delete_job_by_id,
 )
-from utils.cleaning import (
-    impute_missing,
-    detect_outliers,
-    remove_outliers,
-    winsorize_values,
-    validate_rules,
+from utils.job_access import get_owned_job, invalidate_job
+from utils.metrics import REGISTRY, http_request_seconds, observe_job
+from utils.jobs import JobQueue, JobRunner, STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED
+from utils.pipeline import run_processing_job
+from utils.storage import (
+    processed_path,
+    find_processed,
+    delete_processed,
+    read_processed,
+    iter_csv,
+    export_xlsx,
+)
+from utils.summary import summary_path, delete_summary, ensure_summary, summary_table, histogram_columns
+from utils.violations import violations_path, delete_violations, ViolationIndex
+from utils.tables import render_table
+from utils.report import (
+    plot_summary_histograms,
+    histogram_dir,
+    histogram_data,
+    delete_histograms,
+    report_job,
+    report_key,
+    report_paths,
+    delete_reports,
+    run_report_job,
 )
-from utils.weights import apply_weights, compute_weighted_summary
-from utils.report import generate_report_html, generate_pdf_report, plot_histograms
 
 # ----------------------------------------------------------------------------- 
 # App setup
 # ----------------------------------------------------------------------------- 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "your_secret_key")
+app.jinja_env.filters["html_table"] = render_table
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER") or os.path.join(BASE_DIR, "uploads")
 ALLOWED_EXTENSIONS = {"csv", "xlsx", "xls"}
+PREVIEW_ROWS = 50  # rows shown by preview_file
+DASHBOARD_JOBS = 10  # recent jobs on the dashboard; analytics pages through the rest
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
+def _job_finished(kind, status, result):
+    observe_job(kind, status, result)
+    if result and result.get("job_id") is not None:
+        # The worker updated the job's row; drop this process's cached copy
+        invalidate_job(result["job_id"])
+
+
+# Background processing: uploads are queued in a SQLite-backed job table and
+# executed by a small local process pool, keeping the web workers free.
+job_queue = JobQueue(os.getenv("JOBS_DB") or os.path.join(UPLOAD_FOLDER, "jobs.sqlite3"))
+job_runner = JobRunner(
+    job_queue,
+    handlers={"process": run_processing_job, "report": run_report_job},
+    workers=int(os.getenv("JOB_WORKERS", "1")),
+    observer=_job_finished,
+)
+# Pool workers re-import this module under spawn; only real app processes poll
+# and migrate the database schema (once, instead of on every connection).
+if multiprocessing.parent_process() is None:
+    job_runner.start()
+    try:
+        ensure_schema()
+    except Exception as e:
+        logger.warning("Database schema check failed at startup: %s", e)
+
+
+# ----------------------------------------------------------------------------- 
+# Metrics
+# ----------------------------------------------------------------------------- 
+# view_details draws histograms in the browser from /api/jobs/<id>/histograms
+# ("client") or embeds rendered PNGs ("images"); ?charts= overrides per request.
+CHART_MODE = os.getenv("CHART_MODE", "client")
+CHART_MODES = ("client", "images")
+
+# Optional bearer token for /metrics; unset leaves it open to the scraper.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Web workers publish their series here so any one of them can serve the
+# totals of all of them on /metrics.
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(UPLOAD_FOLDER, "metrics"))
+if multiprocessing.parent_process() is None:
+    REGISTRY.share(METRICS_DIR)
+
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_latency(response):
+    started = getattr(g, "request_started", None)
+    if started is not None:
+        # Route templates, not paths, keep the label set bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        http_request_seconds.observe(
+            time.perf_counter() - started, method=request.method, route=route, status=response.status_code
+        )
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 
 # ----------------------------------------------------------------------------- 
 # Helpers
@@ -52,6 +152,23 @@ def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def _attachment(filename: str) -> str:
+    """Content-Disposition for a download, as send_file would set it."""
+    ascii_name = filename.encode("ascii", "ignore").decode("ascii").replace('"', "") or "download"
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+
+# Temporary job ids are random in [2**40, 2**53): far above database ids and
+# still exact as JavaScript numbers. The id keys the job queue entry and every
+# artifact, so two uploads must never share one.
+TEMP_JOB_ID_MIN = 1 << 40
+TEMP_JOB_ID_MAX = 1 << 53
+
+
+def _temp_job_id() -> int:
+    return TEMP_JOB_ID_MIN + secrets.randbelow(TEMP_JOB_ID_MAX - TEMP_JOB_ID_MIN)
+
+
 def _safe_close(cursor=None, conn=None):
     try:
         if cursor:
@@ -205,13 +322,15 @@ def dashboard():
         flash("Please log in first.", "warning")
         return redirect(url_for("login"))
 
+    more_jobs = False
     try:
-        recent_jobs = get_user_jobs(session["user"]["username"])
+        recent_jobs, next_cursor = get_user_jobs(session["user"]["username"], limit=DASHBOARD_JOBS)
+        more_jobs = next_cursor is not None
     except Exception as e:
         recent_jobs = []
         flash(f"Error loading recent jobs: {str(e)}", "danger")
 
-    return render_template("dashboard.html", user=session["user"], recent=recent_jobs)
+    return render_template("dashboard.html", user=session["user"], recent=recent_jobs, more_jobs=more_jobs)
 
 
 # -------------------------- Upload + Process form ----------------------------
@@ -263,118 +382,80 @@ def process_form():
         flash("No file uploaded or file not found.", "danger")
         return redirect(url_for("dashboard"))
 
-    # Now process file
+    # Queue the file for background processing
     try:
-        # Read data
-        if filepath.lower().endswith(".csv"):
-            df = pd.read_csv(filepath)
-        else:
-            df = pd.read_excel(filepath)
-
-        # Coerce numeric-like columns to numeric to avoid downstream errors
-        for column_name in df.columns:
-            if df[column_name].dtype == object:
-                df[column_name] = pd.to_numeric(df[column_name], errors="ignore")
-
-        rows_before = len(df)
-        workflow_logs = [f"Data loaded: {rows_before} rows, {len(df.columns)} columns"]
-
-        # Params
-        impute_method = request.form.get("impute_method", "Mean")
-        outlier_method = request.form.get("outlier_method", "IQR")
-        weight_col = request.form.get("weight_col", "").strip()
-        rules_json = request.form.get("rules_json", "{}")
-
-        # Imputation
-        if impute_method and impute_method != "None":
-            df = impute_missing(df, impute_method)
-            workflow_logs.append(f"Applied {impute_method} imputation")
-
-        # Outliers detection & handling
-        if outlier_method and outlier_method != "None":
-            outliers = detect_outliers(df, outlier_method)
+        params = {
+            "impute_method": request.form.get("impute_method", "Mean"),
+            "outlier_method": request.form.get("outlier_method", "IQR"),
+            "outlier_action": request.form.get("outlier_action", "winsorize"),
+            "weight_col": request.form.get("weight_col", "").strip(),
+            "rules_json": request.form.get("rules_json", "{}"),
+            "weight_method": request.form.get("weight_method", "column"),
+            "rake_margins": request.form.get("rake_margins", "").strip(),
+            "trim_lower": request.form.get("trim_lower", "").strip(),
+            "trim_upper": request.form.get("trim_upper", "").strip(),
+            "variance_method": request.form.get("variance_method", "Naive"),
+            "strata_col": request.form.get("strata_col", "").strip(),
+            "cluster_col": request.form.get("cluster_col", "").strip(),
+            "replicates": request.form.get("replicates", "").strip(),
+        }
 
-            # compute outlier_count robustly
-            outlier_count = 0
-            try:
-                if isinstance(outliers, pd.Series):
-                    outlier_count = int(outliers.sum())
-                elif isinstance(outliers, pd.DataFrame):
-                    # Row-level flagging: any True in the row means the row is an outlier
-                    outlier_count = int(outliers.any(axis=1).sum())
-                elif hasattr(outliers, "sum"):
-                    outlier_count = int(outliers.sum())
-            except Exception:
-                outlier_count = 0
-
-            if outlier_count > 0:
-                action = request.form.get("outlier_action", "winsorize")
-                if action == "remove":
-                    df = remove_outliers(df, outliers)
-                    workflow_logs.append(f"Removed {outlier_count} outliers using {outlier_method}")
-                else:
-                    df = winsorize_values(df)
-                    workflow_logs.append(f"Winsorized {outlier_count} outliers using {outlier_method}")
-
-        # Weights
-        if weight_col and weight_col in df.columns:
-            df = apply_weights(df, weight_col)
-            workflow_logs.append(f"Applied weights from column: {weight_col}")
-
-        # Rules validation
-        try:
-            rules = json.loads(rules_json) if rules_json else {}
-            if rules:
-                violations = validate_rules(df, rules)
-                if isinstance(violations, list):
-                    workflow_logs.extend(violations)
-                else:
-                    workflow_logs.append(str(violations))
-        except json.JSONDecodeError:
-            workflow_logs.append("Warning: Invalid JSON in rules configuration")
-
-        rows_after = len(df)
-        workflow_logs.append(f"Final dataset: {rows_after} rows")
-
-        # Save job record to DB with safe fallback
-        violations_count = len([log for log in workflow_logs if "violation" in log.lower()])
+        # Save job record to DB with safe fallback. Row counts are filled in
+        # by the worker once processing finishes.
         job_id = None
+        persisted = True
         try:
             job_id = save_job(
                 username=session["user"]["username"],
                 uploaded_filename=os.path.basename(filepath),
-                rows_before=rows_before,
-                rows_after=rows_after,
-                impute_method=impute_method,
-                outlier_method=outlier_method,
-                weight_col=weight_col,
-                violations_count=violations_count,
+                rows_before=0,
+                rows_after=0,
+                impute_method=params["impute_method"],
+                outlier_method=params["outlier_method"],
+                weight_col=params["weight_col"],
+                violations_count=0,
+                bytes_uploaded=os.path.getsize(filepath),
             )
         except Exception as db_err:
             # Fallback: create a temporary session-backed job id
-            job_id = int(datetime.now().timestamp())
+            persisted = False
+            job_id = _temp_job_id()
             temp_jobs = session.get("temp_jobs", {})
             temp_jobs[str(job_id)] = {
                 "id": job_id,
                 "username": session["user"]["username"],
                 "uploaded_filename": os.path.basename(filepath),
-                "rows_before": rows_before,
-                "rows_after": rows_after,
-                "impute_method": impute_method,
-                "outlier_method": outlier_method,
-                "weight_col": weight_col,
-                "violations_count": violations_count,
+                "rows_before": 0,
+                "rows_after": 0,
+                "impute_method": params["impute_method"],
+                "outlier_method": params["outlier_method"],
+                "weight_col": params["weight_col"],
+                "violations_count": 0,
                 "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "is_saved": False,
             }
             session["temp_jobs"] = temp_jobs
             flash("Database unavailable. Proceeded with a temporary job.", "warning")
 
-        # Persist processed data
-        processed_filepath = os.path.join(app.config["UPLOAD_FOLDER"], f"processed_{job_id}.csv")
-        df.to_csv(processed_filepath, index=False)
+        processed_filepath = processed_path(app.config["UPLOAD_FOLDER"], job_id)
+        job_queue.enqueue(
+            "process",
+            job_id,
+            {
+                "job_id": job_id,
+                "filepath": filepath,
+                "output_path": processed_filepath,
+                "summary_path": summary_path(app.config["UPLOAD_FOLDER"], job_id),
+                "violations_path": violations_path(app.config["UPLOAD_FOLDER"], job_id),
+                "params": params,
+                "persisted": persisted,
+            },
+            job_id=job_id,
+            username=session["user"]["username"],
+        )
+        job_runner.notify()
 
-        flash("Data processed successfully!", "success")
+        flash("Processing started. Results will appear here when ready.", "info")
         return redirect(url_for("view_details", job_id=job_id))
 
     except Exception as e:
@@ -382,6 +463,127 @@ def process_form():
         return redirect(request.url)
 
 
+# ------------------------------- Job Status ----------------------------------
+def _merge_job_result(job, queued):
+    """Overlay results from the background queue onto a job record.
+    Needed for session-backed temp jobs, which the worker cannot update.
+    """
+    if queued and queued.get("result"):
+        job = dict(job)
+        for key in ("rows_before", "rows_after", "violations_count", "metrics"):
+            job[key] = queued["result"].get(key, job.get(key))
+    return job
+
+
+@app.route("/jobs/<int:job_id>/status")
+def job_status(job_id: int):
+    if "user" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    username = session["user"]["username"]
+    queued = job_queue.get("process", job_id)
+    processed_filepath = find_processed(app.config["UPLOAD_FOLDER"], job_id)
+
+    if queued:
+        if queued.get("username") != username:
+            return jsonify({"error": "Job not found"}), 404
+        status = queued["status"]
+    elif processed_filepath:
+        # Jobs processed before the queue existed
+        if not get_owned_job(job_id, username):
+            return jsonify({"error": "Job not found"}), 404
+        status = STATUS_DONE
+    else:
+        return jsonify({"error": "Job not found"}), 404
+
+    result = (queued or {}).get("result") or {}
+    return jsonify(
+        {
+            "job_id": job_id,
+            "status": status,
+            "error": (queued or {}).get("error"),
+            "rows_before": result.get("rows_before"),
+            "rows_after": result.get("rows_after"),
+            "violations_count": result.get("violations_count"),
+        }
+    )
+
+
+# ----------------------------- Violations -----------------------------------
+def _owns_job(job_id: int, username: str) -> bool:
+    queued = job_queue.get("process", job_id)
+    if queued:
+        return queued.get("username") == username
+    return get_owned_job(job_id, username, session.get("temp_jobs")) is not None
+
+
+def _user_job(job_id: int):
+    """The logged-in user's job (database or session temp job), or None."""
+    return get_owned_job(job_id, session["user"]["username"], session.get("temp_jobs"))
+
+
+@app.route("/jobs/<int:job_id>/violations")
+def job_violations(job_id: int):
+    """Page through the rows failing a rule (`rule` = check id, omitted for
+    any rule), read from the processed output via the job's violation index.
+    """
+    if "user" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    if not _owns_job(job_id, session["user"]["username"]):
+        return jsonify({"error": "Job not found"}), 404
+
+    index = ViolationIndex.load(violations_path(app.config["UPLOAD_FOLDER"], job_id))
+    processed_filepath = find_processed(app.config["UPLOAD_FOLDER"], job_id)
+    if index is None or not processed_filepath:
+        return jsonify({"error": "No violation index for this job"}), 404
+
+    rule = request.args.get("rule", type=int)
+    page = request.args.get("page", 1, type=int)
+    per_page = min(max(request.args.get("per_page", 50, type=int), 1), 500)
+    try:
+        result = index.page(processed_filepath, rule, page, per_page)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    result.update(
+        total_violations=index.meta["total"],
+        failing_rows=index.meta["failing_rows"],
+        rules=index.checks,
+    )
+    return jsonify(result)
+
+
+# ----------------------------- Histograms -----------------------------------
+@app.route("/api/jobs/<int:job_id>/histograms")
+def job_histograms(job_id: int):
+    """Bin edges and counts of every numeric column (`columns` = comma-separated
+    subset), plus KDE points when `kde` is given, for client-side charts.
+    """
+    if "user" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    if not _owns_job(job_id, session["user"]["username"]):
+        return jsonify({"error": "Job not found"}), 404
+
+    processed_filepath = find_processed(app.config["UPLOAD_FOLDER"], job_id)
+    if not processed_filepath:
+        return jsonify({"error": "Processed data not found"}), 404
+
+    columns = request.args.get("columns")
+    kde_points = min(max(request.args.get("kde", 0, type=int), 0), 256)
+    summary = ensure_summary(app.config["UPLOAD_FOLDER"], job_id, processed_filepath)
+    response = jsonify(
+        {
+            "job_id": job_id,
+            "rows": summary["rows"],
+            "columns": histogram_data(summary, columns.split(",") if columns else None, kde_points),
+        }
+    )
+    # The summary only changes when the job is reprocessed
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+
 # ------------------------------ AJAX Preview ---------------------------------
 @app.route("/preview-data", methods=["POST"])
 def preview_data():
@@ -439,70 +641,49 @@ def view_details(job_id: int):
         return redirect(url_for("login"))
 
     try:
-        job = get_job_by_id(job_id)
+        job = _user_job(job_id)
         if not job:
-            # Try session temp job fallback
-            temp = session.get("temp_jobs", {}).get(str(job_id))
-            if temp and temp.get("username") == session["user"]["username"]:
-                job = temp
-            else:
-                flash("Job not found or access denied.", "danger")
-                return redirect(url_for("dashboard"))
-        elif job["username"] != session["user"]["username"]:
             flash("Job not found or access denied.", "danger")
             return redirect(url_for("dashboard"))
 
-        processed_filepath = os.path.join(app.config["UPLOAD_FOLDER"], f"processed_{job_id}.csv")
-        if os.path.exists(processed_filepath):
-            df = pd.read_csv(processed_filepath)
-
-            # Ensure numeric-only selection is robust by coercing numeric-like columns
-            for column_name in df.columns:
-                if df[column_name].dtype == object:
-                    df[column_name] = pd.to_numeric(df[column_name], errors="ignore")
-
-            numeric_cols = df.select_dtypes(include=["number"]).columns
-            summary_data = []
-
-            for col in numeric_cols:
-                if col == "weight":
-                    continue
-                if "weight" in df.columns:
-                    try:
-                        weighted_stats = compute_weighted_summary(df, col, "weight")
-                        summary_data.append(
-                            {
-                                "Variable": col,
-                                "Weighted Mean": weighted_stats["weighted_mean"],
-                                "Margin of Error (95% CI)": weighted_stats["margin_of_error"],
-                            }
-                        )
-                    except Exception:
-                        # fallback to unweighted
-                        summary_data.append(
-                            {
-                                "Variable": col,
-                                "Weighted Mean": float(df[col].mean()),
-                                "Margin of Error (95% CI)": float(df[col].std() * 1.96 / max(len(df), 1)),
-                            }
-                        )
-                else:
-                    summary_data.append(
-                        {
-                            "Variable": col,
-                            "Weighted Mean": float(df[col].mean()),
-                            "Margin of Error (95% CI)": float(df[col].std() * 1.96 / max(len(df), 1)),
-                        }
-                    )
-
-            summary_df = pd.DataFrame(summary_data)
-            hist_images = plot_histograms(df, numeric_cols[:5])  # list of image paths/urls
+        queued = job_queue.get("process", job_id)
+        job = _merge_job_result(job, queued)
+        if queued and queued["status"] in (STATUS_QUEUED, STATUS_RUNNING):
+            # Still being processed by a background worker; the page polls job_status
+            return render_template(
+                "view_details.html",
+                job=job,
+                status=STATUS_RUNNING,
+                summary_df=None,
+                hist_images={},
+                user=session["user"],
+            )
+        if queued and queued["status"] == STATUS_FAILED:
+            flash(f"Error processing file: {queued.get('error')}", "danger")
+            return redirect(url_for("dashboard"))
+
+        processed_filepath = find_processed(app.config["UPLOAD_FOLDER"], job_id)
+        if processed_filepath:
+            # Rendered from the job's summary artifact; the dataset is not loaded
+            summary = ensure_summary(app.config["UPLOAD_FOLDER"], job_id, processed_filepath)
+            summary_df = summary_table(summary)
+            chart_mode = request.args.get("charts", CHART_MODE)
+            if chart_mode not in CHART_MODES:
+                chart_mode = CHART_MODE
+            if chart_mode == "client":
+                hist_images = {}
+            else:
+                hist_images = plot_summary_histograms(
+                    summary, histogram_columns(summary), cache_dir=histogram_dir(app.config["UPLOAD_FOLDER"], job_id)
+                )
 
             return render_template(
                 "view_details.html",
                 job=job,
+                status=STATUS_DONE,
                 summary_df=summary_df,
                 hist_images=hist_images,
+                chart_mode=chart_mode,
                 user=session["user"],
             )
         else:
@@ -540,6 +721,7 @@ def save_job_route():
             (display_name, job_id, session["user"]["username"]),
         )
         conn.commit()
+        invalidate_job(job_id)
         flash("Job saved successfully!", "success")
     except Exception as e:
         flash(f"Error saving job: {str(e)}", "danger")
@@ -557,9 +739,16 @@ def delete_job(job_id: int):
 
     try:
         delete_job_by_id(job_id, session["user"]["username"])
-        processed_filepath = os.path.join(app.config["UPLOAD_FOLDER"], f"processed_{job_id}.csv")
-        if os.path.exists(processed_filepath):
-            os.remove(processed_filepath)
+        invalidate_job(job_id)
+        for kind in ("process", "report"):
+            queued = job_queue.get(kind, job_id)
+            if queued and queued.get("username") == session["user"]["username"]:
+                job_queue.delete(kind, job_id)
+        delete_processed(app.config["UPLOAD_FOLDER"], job_id)
+        delete_summary(app.config["UPLOAD_FOLDER"], job_id)
+        delete_violations(app.config["UPLOAD_FOLDER"], job_id)
+        delete_histograms(app.config["UPLOAD_FOLDER"], job_id)
+        delete_reports(app.config["UPLOAD_FOLDER"], job_id)
 
         flash("Job deleted successfully!", "success")
     except Exception as e:
@@ -576,34 +765,27 @@ def analytics():
         return redirect(url_for("login"))
 
     try:
-        all_jobs = get_user_jobs(session["user"]["username"])
-        total_runs = len(all_jobs)
-        total_rows_after = sum(job.get("rows_after", 0) for job in all_jobs)
+        username = session["user"]["username"]
+        stats = get_user_job_stats(username)
+        try:
+            rows, next_cursor = get_user_jobs(username, after=request.args.get("after"))
+        except ValueError:
+            # Malformed cursor: start from the newest job
+            rows, next_cursor = get_user_jobs(username)
 
-        # Admin-only top users
-        top_users = []
+        # Admin-only usage, read from the materialized aggregates (utils.usage)
+        top_users, daily_usage = [], []
         if session["user"].get("role") == "admin":
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute(
-                """
-                SELECT username, COUNT(*) AS runs
-                FROM processing_jobs
-                GROUP BY username
-                ORDER BY runs DESC
-                LIMIT 10
-                """
-            )
-            top_users = cursor.fetchall()
-            _safe_close(cursor, conn)
-
-        stats = {"total_runs": total_runs, "total_rows_after": total_rows_after}
+            top_users = get_top_users(10)
+            daily_usage = get_daily_usage(14)
 
         return render_template(
             "analytics_dashboard.html",
             stats=stats,
-            rows=all_jobs,
+            rows=rows,
+            next_cursor=next_cursor,
             top_users=top_users,
+            daily_usage=daily_usage,
             user=session["user"],
         )
     except Exception as e:
@@ -612,7 +794,9 @@ def analytics():
             "analytics_dashboard.html",
             stats={"total_runs": 0, "total_rows_after": 0},
             rows=[],
+            next_cursor=None,
             top_users=[],
+            daily_usage=[],
             user=session.get("user"),
         )
 
@@ -625,15 +809,85 @@ def profile():
         return redirect(url_for("login"))
 
     try:
-        recent_jobs = get_user_jobs(session["user"]["username"])
-        saved_jobs = [job for job in recent_jobs if job.get("is_saved")]
-        return render_template("profile.html", recent_jobs=recent_jobs, saved_jobs=saved_jobs, user=session["user"])
+        username = session["user"]["username"]
+        stats = get_user_job_stats(username)
+        try:
+            recent_jobs, next_cursor = get_user_jobs(username, after=request.args.get("after"))
+        except ValueError:
+            recent_jobs, next_cursor = get_user_jobs(username)
+        saved_jobs, more_saved = get_user_jobs(username, saved_only=True)
+        return render_template(
+            "profile.html",
+            stats=stats,
+            recent_jobs=recent_jobs,
+            next_cursor=next_cursor,
+            saved_jobs=saved_jobs,
+            more_saved=more_saved is not None,
+            user=session["user"],
+        )
     except Exception as e:
         flash(f"Error loading profile: {str(e)}", "danger")
-        return render_template("profile.html", recent_jobs=[], saved_jobs=[], user=session["user"])
+        return render_template(
+            "profile.html", stats={}, recent_jobs=[], next_cursor=None, saved_jobs=[], more_saved=False,
+            user=session["user"],
+        )
 
 
 # ------------------------------- Report Gen ---------------------------------- 
+def _report_build(job, job_id: int, processed_filepath: str, retry: bool = False):
+    """State of the current user's report for a job. Reports are built by the
+    job runner and their files named by content hash, so an unchanged job
+    reuses the last build; a missing build is queued here (a failed one only
+    with `retry`).
+    """
+    username = session["user"]["username"]
+    key = report_key(job, username, processed_filepath)
+    html_path, pdf_path = report_paths(app.config["UPLOAD_FOLDER"], job_id, key)
+    queued = job_queue.get("report", job_id)
+    current = bool(queued) and (queued.get("payload") or {}).get("key") == key
+
+    if current and queued["status"] in (STATUS_QUEUED, STATUS_RUNNING):
+        status = queued["status"]
+    elif os.path.exists(html_path):
+        status = STATUS_DONE
+    elif current and queued["status"] == STATUS_FAILED and not retry:
+        status = STATUS_FAILED
+    else:
+        job_queue.enqueue(
+            "report",
+            job_id,
+            {
+                "job": report_job(job),
+                "prepared_by": username,
+                "upload_folder": app.config["UPLOAD_FOLDER"],
+                "processed_path": processed_filepath,
+                "key": key,
+            },
+            job_id=job_id,
+            username=username,
+        )
+        job_runner.notify()
+        status, current = STATUS_QUEUED, False
+
+    return {
+        "status": status,
+        "error": queued.get("error") if current and status == STATUS_FAILED else None,
+        "html_path": html_path if os.path.exists(html_path) else None,
+        "pdf_path": pdf_path if os.path.exists(pdf_path) else None,
+    }
+
+
+def _report_progress(job_id: int, build):
+    """JSON status of a report build; html/pdf tell which files are ready."""
+    return {
+        "job_id": job_id,
+        "status": build["status"],
+        "error": build["error"],
+        "html": build["html_path"] is not None,
+        "pdf": build["pdf_path"] is not None,
+    }
+
+
 @app.route("/generate-report/<int:job_id>")
 def generate_report(job_id: int):
     if "user" not in session:
@@ -641,141 +895,86 @@ def generate_report(job_id: int):
         return redirect(url_for("login"))
 
     try:
-        job = get_job_by_id(job_id)
+        job = _user_job(job_id)
         if not job:
-            temp = session.get("temp_jobs", {}).get(str(job_id))
-            if temp and temp.get("username") == session["user"]["username"]:
-                job = temp
-            else:
-                flash("Job not found or access denied.", "danger")
-                return redirect(url_for("dashboard"))
-        elif job["username"] != session["user"]["username"]:
             flash("Job not found or access denied.", "danger")
             return redirect(url_for("dashboard"))
 
-        processed_filepath = os.path.join(app.config["UPLOAD_FOLDER"], f"processed_{job_id}.csv")
-        if not os.path.exists(processed_filepath):
+        job = _merge_job_result(job, job_queue.get("process", job_id))
+
+        processed_filepath = find_processed(app.config["UPLOAD_FOLDER"], job_id)
+        if not processed_filepath:
             flash("Processed data not found.", "danger")
             return redirect(url_for("dashboard"))
 
-        df = pd.read_csv(processed_filepath)
-
-        numeric_cols = df.select_dtypes(include=["number"]).columns
-        summary_data = []
-
-        for col in numeric_cols:
-            if col == "weight":
-                continue
-            if "weight" in df.columns:
-                try:
-                    weighted_stats = compute_weighted_summary(df, col, "weight")
-                    summary_data.append(
-                        {
-                            "Variable": col,
-                            "Weighted Mean": weighted_stats["weighted_mean"],
-                            "Margin of Error (95% CI)": weighted_stats["margin_of_error"],
-                        }
-                    )
-                except Exception:
-                    summary_data.append(
-                        {
-                            "Variable": col,
-                            "Weighted Mean": float(df[col].mean()),
-                            "Margin of Error (95% CI)": float(df[col].std() * 1.96 / max(len(df), 1)),
-                        }
-                    )
-            else:
-                summary_data.append(
-                    {
-                        "Variable": col,
-                        "Weighted Mean": float(df[col].mean()),
-                        "Margin of Error (95% CI)": float(df[col].std() * 1.96 / max(len(df), 1)),
-                    }
-                )
-
-        summary_df = pd.DataFrame(summary_data)
-        hist_images = plot_histograms(df, numeric_cols[:5])
-
-        metadata = {
-            "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "prepared_by": session["user"]["username"],
-            "rows_before": job["rows_before"],
-            "rows_after": job["rows_after"],
-            "violations_count": job.get("violations_count"),
-            "params": {
-                "impute_method": job.get("impute_method"),
-                "outlier_method": job.get("outlier_method"),
-                "weight_col": job.get("weight_col"),
-            },
-        }
-
-        workflow_logs = [
-            f"Data loaded: {job['rows_before']} rows, {len(df.columns)} columns",
-            f"Applied {job['impute_method']} imputation" if job.get("impute_method") != "None" else "No imputation applied",
-            f"Applied {job['outlier_method']} outlier detection" if job.get("outlier_method") != "None" else "No outlier detection applied",
-            f"Applied weights from column: {job.get('weight_col')}" if job.get("weight_col") else "No weights applied",
-            f"Final dataset: {job['rows_after']} rows",
-            f"Data quality violations: {job.get('violations_count') or 0}",
-        ]
-
-        report_title = f"Survey Data Processing Report - {job['uploaded_filename']}"
-        html_path, _html_content = generate_report_html(
-            summary_df=summary_df,
-            hist_images=hist_images,
-            workflow_logs=workflow_logs,
-            output_path=os.path.join(app.config["UPLOAD_FOLDER"], f"report_{job_id}.html"),
-            report_title=report_title,
-            metadata=metadata,
-        )
-
-        pdf_path = generate_pdf_report(html_path, os.path.join(app.config["UPLOAD_FOLDER"], f"report_{job_id}.pdf"))
-
-        flash("Report generated successfully!", "success")
-        return render_template(
-            "report_generated.html", job=job, html_path=html_path, pdf_path=pdf_path, user=session["user"]
-        )
+        build = _report_build(job, job_id, processed_filepath, retry=True)
+        return render_template("report_generated.html", job=job, report=build, user=session["user"])
 
     except Exception as e:
         flash(f"Error generating report: {str(e)}", "danger")
         return redirect(url_for("dashboard"))
 
 
+@app.route("/jobs/<int:job_id>/report")
+def report_status(job_id: int):
+    if "user" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    try:
+        job = _user_job(job_id)
+        processed_filepath = find_processed(app.config["UPLOAD_FOLDER"], job_id)
+        if not job or not processed_filepath:
+            return jsonify({"error": "Job not found"}), 404
+        job = _merge_job_result(job, job_queue.get("process", job_id))
+        return jsonify(_report_progress(job_id, _report_build(job, job_id, processed_filepath)))
+    except Exception as e:
+        # The page keeps polling; a failed poll is retried
+        logger.warning("Report status for job %s unavailable: %s", job_id, e)
+        return jsonify({"error": f"Report status unavailable: {e}"}), 503
+
+
 # ------------------------------ Download Report ------------------------------ 
 @app.route("/download-report/<int:job_id>/<format>")
 def download_report(job_id: int, format: str):
+    """Send the job's current report, or 202 with the build's progress while
+    it is being built.
+    """
     if "user" not in session:
         flash("Please log in first.", "warning")
         return redirect(url_for("login"))
 
     try:
-        job = get_job_by_id(job_id)
+        job = _user_job(job_id)
         if not job:
-            temp = session.get("temp_jobs", {}).get(str(job_id))
-            if temp and temp.get("username") == session["user"]["username"]:
-                job = temp
-            else:
-                flash("Job not found or access denied.", "danger")
-                return redirect(url_for("dashboard"))
-        elif job["username"] != session["user"]["username"]:
             flash("Job not found or access denied.", "danger")
             return redirect(url_for("dashboard"))
 
         if format == "html":
-            file_path = os.path.join(app.config["UPLOAD_FOLDER"], f"report_{job_id}.html")
             mime_type = "text/html"
-            filename = f"{job['uploaded_filename']}_report.html"
         elif format == "pdf":
-            file_path = os.path.join(app.config["UPLOAD_FOLDER"], f"report_{job_id}.pdf")
             mime_type = "application/pdf"
-            filename = f"{job['uploaded_filename']}_report.pdf"
         else:
             flash("Invalid format specified.", "danger")
             return redirect(url_for("dashboard"))
 
-        if not os.path.exists(file_path):
-            flash("Report file not found. Please generate the report first.", "danger")
+        processed_filepath = find_processed(app.config["UPLOAD_FOLDER"], job_id)
+        if not processed_filepath:
+            flash("Processed data not found.", "danger")
             return redirect(url_for("dashboard"))
 
+        job = _merge_job_result(job, job_queue.get("process", job_id))
+        build = _report_build(job, job_id, processed_filepath)
+        if build["status"] in (STATUS_QUEUED, STATUS_RUNNING):
+            return jsonify(_report_progress(job_id, build)), 202, {"Retry-After": "2"}
+
+        file_path = build[f"{format}_path"]
+        if not file_path:
+            if build["status"] == STATUS_FAILED:
+                flash(f"Report generation failed: {build['error']}", "danger")
+            else:
+                flash("PDF export is not available on this server; download the HTML report instead.", "warning")
+            return redirect(url_for("generate_report", job_id=job_id))
+
+        filename = f"{job['uploaded_filename']}_report.{format}"
         return send_file(file_path, as_attachment=True, download_name=filename, mimetype=mime_type)
 
     except Exception as e:
@@ -798,14 +997,17 @@ def preview_file(filename):
         flash("File not found.", "danger")
         return redirect(url_for("dashboard"))
     try:
+        # Only the rows shown are read from CSV/Excel uploads
         if filename.lower().endswith(".csv"):
-            df = pd.read_csv(path)
+            df = pd.read_csv(path, nrows=PREVIEW_ROWS)
+        elif filename.lower().endswith(".arrow"):
+            df = read_processed(path).head(PREVIEW_ROWS)
         else:
-            df = pd.read_excel(path)
+            df = pd.read_excel(path, nrows=PREVIEW_ROWS)
         # The template 'preview.html' expects `tables` (list of HTML) and `titles`
         return render_template(
             "preview.html",
-            tables=[df.head(50).to_html(classes="data table", header=True, index=False)],
+            tables=[render_table(df, classes="data table")],
             titles=df.columns.values,
         )
     except Exception as e:
@@ -831,20 +1033,13 @@ def _download_processed(job_id: int, format: str = "csv"):
         return redirect(url_for("login"))
 
     try:
-        job = get_job_by_id(job_id)
+        job = _user_job(job_id)
         if not job:
-            temp = session.get("temp_jobs", {}).get(str(job_id))
-            if temp and temp.get("username") == session["user"]["username"]:
-                job = temp
-            else:
-                flash("Job not found or access denied.", "danger")
-                return redirect(url_for("dashboard"))
-        elif job["username"] != session["user"]["username"]:
             flash("Job not found or access denied.", "danger")
             return redirect(url_for("dashboard"))
 
-        processed_filepath = os.path.join(app.config["UPLOAD_FOLDER"], f"processed_{job_id}.csv")
-        if not os.path.exists(processed_filepath):
+        processed_filepath = find_processed(app.config["UPLOAD_FOLDER"], job_id)
+        if not processed_filepath:
             flash("Processed data not found. Please run processing again.", "danger")
             return redirect(url_for("view_details", job_id=job_id))
 
@@ -852,13 +1047,12 @@ def _download_processed(job_id: int, format: str = "csv"):
 
         fmt = (format or "csv").lower()
         if fmt == "xlsx":
-            # Load CSV and write as Excel to a temp file
-            df = pd.read_csv(processed_filepath)
+            # Convert the stored output to Excel in a temp file
             from tempfile import NamedTemporaryFile
             with NamedTemporaryFile(suffix=".xlsx", delete=False) as tmp:
                 temp_path = tmp.name
             try:
-                df.to_excel(temp_path, index=False, engine="openpyxl")
+                export_xlsx(processed_filepath, temp_path)
                 filename = f"{base_name}_processed.xlsx"
                 mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 return send_file(temp_path, as_attachment=True, download_name=filename, mimetype=mime)
@@ -868,15 +1062,13 @@ def _download_processed(job_id: int, format: str = "csv"):
                 except Exception:
                     pass
         else:
-            # Ensure CSV opens nicely in Excel by prepending UTF-8 BOM
-            from io import BytesIO
-            with open(processed_filepath, "rb") as f:
-                content = f.read()
-            if not content.startswith(b"\xef\xbb\xbf"):
-                content = b"\xef\xbb\xbf" + content
-            mem = BytesIO(content)
+            # Streamed batch by batch; the UTF-8 BOM makes Excel open it nicely
             filename = f"{base_name}_processed.csv"
-            return send_file(mem, as_attachment=True, download_name=filename, mimetype="text/csv; charset=utf-8")
+            return Response(
+                stream_with_context(iter_csv(processed_filepath, bom=True)),
+                content_type="text/csv; charset=utf-8",
+                headers={"Content-Disposition": _attachment(filename)},
+            )
 
     except Exception as e:
         flash(f"Error downloading processed data: {str(e)}", "danger")
@@ -25,11 +25,12 @@ def user_exists(username: str, email: str) -> bool:
 	try:
 		conn = get_connection()
 		cursor = conn.cursor()
-		cursor.execute("SELECT 1 FROM users WHERE username=%s OR email=%s", (username, email))
-		exists = cursor.fetchone() is not None
-		cursor.close()
-		conn.close()
-		return exists
+		try:
+			cursor.execute("SELECT 1 FROM users WHERE username=%s OR email=%s", (username, email))
+			return cursor.fetchone() is not None
+		finally:
+			cursor.close()
+			conn.close()
 	except Error as e:
 		st.sidebar.error(f"Error checking user: {e}")
 		return True
@@ -40,10 +41,12 @@ def save_user(username: str, email: str, password: str):
 	try:
 		conn = get_connection()
 		cursor = conn.cursor()
-		cursor.execute("INSERT INTO users (username, email, password, role) VALUES (%s, %s, %s, %s)", (username, email, hashed_pw, 'user'))
-		conn.commit()
-		cursor.close()
-		conn.close()
+		try:
+			cursor.execute("INSERT INTO users (username, email, password, role) VALUES (%s, %s, %s, %s)", (username, email, hashed_pw, 'user'))
+			conn.commit()
+		finally:
+			cursor.close()
+			conn.close()
 	except Error as e:
 		st.sidebar.error(f"Error saving user: {e}")
 
@@ -52,10 +55,12 @@ def authenticate_user(username: str, password: str) -> bool:
 	try:
 		conn = get_connection()
 		cursor = conn.cursor()
-		cursor.execute("SELECT password FROM users WHERE username=%s", (username,))
-		result = cursor.fetchone()
-		cursor.close()
-		conn.close()
+		try:
+			cursor.execute("SELECT password FROM users WHERE username=%s", (username,))
+			result = cursor.fetchone()
+		finally:
+			cursor.close()
+			conn.close()
 		if result:
 			stored_hash = result[0]
 			return check_password(password, stored_hash)
@@ -0,0 +1,75 @@
+"""Compare two benchmark result files written by benchmarks.run.
+
+    python -m benchmarks.compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+
+Stages are matched on the dataset configuration and stage name. Each pair
+is printed with the new/old ratio of the fastest run and of peak RSS.
+Ratios above --threshold are marked as regressions; with --fail the exit
+status is 1 if there are any.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Tuple
+
+KEY_FIELDS = ("rows", "numeric", "categorical", "missing", "outliers", "seed", "stage")
+
+
+def load(path: str) -> Tuple[Dict, Dict[Tuple, Dict]]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get("environment", {}), {tuple(r.get(k) for k in KEY_FIELDS): r for r in data["results"]}
+
+
+def _ratio(new, old):
+    if new is None or old is None or old <= 0:
+        return None
+    return new / old
+
+
+def _label(env: Dict) -> str:
+    commit = env.get("commit") or "?"
+    return commit + ("+dirty" if env.get("dirty") else "")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=1.10, help="ratio above which a stage has regressed")
+    parser.add_argument("--memory", action="store_true", help="also flag peak-RSS regressions")
+    parser.add_argument("--fail", action="store_true", help="exit with status 1 on regressions")
+    args = parser.parse_args(argv)
+
+    old_env, old = load(args.old)
+    new_env, new = load(args.new)
+    print(f"old: {_label(old_env)}  new: {_label(new_env)}")
+    print(f"{'rows':>10} {'stage':<30} {'old s':>9} {'new s':>9} {'ratio':>7} {'old MB':>8} {'new MB':>8} {'ratio':>7}")
+
+    regressions = 0
+    for key in sorted(set(old) & set(new), key=lambda k: tuple(str(v) for v in k)):
+        o, n = old[key], new[key]
+        rows, stage = key[0], key[-1]
+        if "error" in o or "error" in n:
+            print(f"{rows:>10} {stage:<30} {n.get('error') or o.get('error')}")
+            continue
+        t_ratio = _ratio(n["seconds_min"], o["seconds_min"])
+        m_ratio = _ratio(n.get("peak_rss_mb"), o.get("peak_rss_mb"))
+        slower = t_ratio is not None and t_ratio > args.threshold
+        bigger = args.memory and m_ratio is not None and m_ratio > args.threshold
+        regressions += slower or bigger
+        print(
+            f"{rows:>10} {stage:<30} {o['seconds_min']:>9.3f} {n['seconds_min']:>9.3f} "
+            f"{t_ratio or 0:>7.2f} {o.get('peak_rss_mb') or 0:>8.0f} {n.get('peak_rss_mb') or 0:>8.0f} "
+            f"{m_ratio or 0:>7.2f}" + ("  REGRESSION" if slower or bigger else "")
+        )
+    for label, only in (("old", set(old) - set(new)), ("new", set(new) - set(old))):
+        for key in only:
+            print(f"{key[0]:>10} {key[-1]:<30} only in {label}")
+
+    print(f"{regressions} regression(s) above {args.threshold:.2f}x")
+    return 1 if args.fail and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
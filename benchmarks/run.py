@@ -0,0 +1,435 @@
+"""Benchmark harness for the cleaning, weighting and reporting pipeline.
+
+Generates synthetic surveys (benchmarks.synthetic), times each pipeline
+stage and the end-to-end /process-form path through the Flask test client,
+records peak RSS and writes the results as JSON to benchmarks/results/,
+named after the commit. Compare two result files with benchmarks.compare.
+
+    python -m benchmarks.run --rows 10000,100000 --numeric 20 --categorical 4
+    python -m benchmarks.run --rows 1000000 --stages plan_run,summarize --repeat 1
+
+Peak RSS is the process high-water mark, reset before each stage on Linux
+(/proc/self/clear_refs). Elsewhere it is the lifetime maximum. For the
+end-to-end stage the peak of the background job workers is reported too.
+The e2e stage needs the app importable. Without a reachable MySQL it runs
+as a temporary (session) job. The app is imported with UPLOAD_FOLDER,
+JOBS_DB and METRICS_DIR in a temporary directory, so a run never touches a
+deployment's uploads, job queue or metrics.
+"""
+import argparse
+import atexit
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import make_survey, survey_params, survey_rules  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+ENV_SETTINGS = (
+    "JOB_WORKERS", "STREAM_THRESHOLD_MB", "STREAM_CHUNK_ROWS", "COLSTATS_MODE", "COLSTATS_EPSILON",
+    "VARIANCE_WORKERS", "KNN_JOBS", "KNN_BLOCK_MB", "CLEAN_WORKERS", "PARALLEL_MIN_CELLS",
+)
+
+
+# -- memory -----------------------------------------------------------------
+
+def _status_mb(field: str, pid="self") -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak(pid="self") -> bool:
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(pid="self") -> float:
+    peak = _status_mb("VmHWM", pid)
+    if peak is None and pid == "self":
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    return peak
+
+
+def _child_pids() -> List[int]:
+    """Descendants of this process (Linux /proc only)."""
+    parents: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [os.getpid()]
+    while stack:
+        for child in parents.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+# -- stages -----------------------------------------------------------------
+
+class Context:
+    """Inputs shared by the stages of one dataset size."""
+
+    def __init__(self, df: pd.DataFrame, workdir: str):
+        self.df = df
+        self.workdir = workdir
+        self.numeric = list(df.select_dtypes(include=np.number).columns)
+        self.params = survey_params(df)
+        self.rules = survey_rules(df)
+        self.csv_path = os.path.join(workdir, "survey.csv")
+        self.processed_path = os.path.join(workdir, "processed.arrow")
+        self._summary = None
+
+    def summary(self):
+        if self._summary is None:
+            from utils.summary import summarize_dataframe
+
+            self._summary = summarize_dataframe(self.df)
+        return self._summary
+
+
+def _impute(method):
+    def stage(ctx):
+        from utils.cleaning import impute_missing
+
+        return lambda: impute_missing(ctx.df, method)
+    return stage
+
+
+def _outliers(method):
+    def stage(ctx):
+        from utils.cleaning import detect_outliers
+
+        return lambda: detect_outliers(ctx.df, method)
+    return stage
+
+
+def _winsorize(ctx):
+    from utils.cleaning import winsorize_values
+
+    return lambda: winsorize_values(ctx.df)
+
+
+def _validate_rules(ctx):
+    from utils.cleaning import validate_rules
+
+    return lambda: validate_rules(ctx.df, ctx.rules)
+
+
+def _plan_run(ctx):
+    from utils.plan import CleaningPlan
+
+    return lambda: CleaningPlan.from_params(ctx.params).run(ctx.df.copy())
+
+
+def _weighted_per_column(ctx):
+    from utils.weights import compute_weighted_summary
+
+    columns = [c for c in ctx.numeric if c != "weight"]
+    return lambda: [compute_weighted_summary(ctx.df, col) for col in columns]
+
+
+def _weighted_batched(ctx):
+    from utils.weights import compute_weighted_summaries
+
+    columns = [c for c in ctx.numeric if c != "weight"]
+    return lambda: compute_weighted_summaries(
+        ctx.df[columns].to_numpy(dtype=np.float64), ctx.df["weight"].to_numpy(dtype=np.float64), columns
+    )
+
+
+def _summarize(ctx):
+    from utils.summary import summarize_dataframe
+
+    return lambda: summarize_dataframe(ctx.df)
+
+
+def _plot_histograms(ctx):
+    from utils.report import plot_histograms
+
+    return lambda: plot_histograms(ctx.df, ctx.numeric[:5])
+
+
+def _plot_summary_histograms(ctx):
+    from utils.report import plot_summary_histograms
+    from utils.summary import histogram_columns
+
+    summary = ctx.summary()
+    return lambda: plot_summary_histograms(summary, histogram_columns(summary))
+
+
+def _plot_summary_histograms_cached(ctx):
+    from utils.report import plot_summary_histograms
+    from utils.summary import histogram_columns
+
+    summary = ctx.summary()
+    cache_dir = os.path.join(ctx.workdir, "histograms")
+    plot_summary_histograms(summary, histogram_columns(summary), cache_dir=cache_dir)
+    return lambda: plot_summary_histograms(summary, histogram_columns(summary), cache_dir=cache_dir)
+
+
+def _write_processed(ctx):
+    from utils.storage import write_processed
+
+    return lambda: write_processed(ctx.df, ctx.processed_path)
+
+
+def _export_csv(ctx):
+    from utils.storage import export_csv, write_processed
+
+    if not os.path.exists(ctx.processed_path):
+        write_processed(ctx.df, ctx.processed_path)
+    return lambda: export_csv(ctx.processed_path, io.BytesIO())
+
+
+def _streaming(ctx):
+    from utils.streaming import process_csv_streaming
+
+    if not os.path.exists(ctx.csv_path):
+        ctx.df.to_csv(ctx.csv_path, index=False)
+    output = os.path.join(ctx.workdir, "streamed.arrow")
+    chunk = max(len(ctx.df) // 4, 1000)
+    return lambda: process_csv_streaming(ctx.csv_path, output, ctx.params, chunksize=chunk)
+
+
+def _isolated_app():
+    """The app module, imported against a private uploads directory (removed
+    at exit). Set before the import: the app and its spawned job workers read
+    these when the module loads.
+    """
+    if "app" not in sys.modules:
+        root = tempfile.mkdtemp(prefix="survey-bench-app-")
+        atexit.register(shutil.rmtree, root, True)
+        os.environ["UPLOAD_FOLDER"] = os.path.join(root, "uploads")
+        os.environ["JOBS_DB"] = os.path.join(root, "jobs.sqlite3")
+        os.environ["METRICS_DIR"] = os.path.join(root, "metrics")
+    import app as appmod
+
+    return appmod
+
+
+def _e2e_process_form(ctx):
+    """POST /process-form and poll /jobs/<id>/status until the job is done."""
+    appmod = _isolated_app()
+    from utils.storage import delete_processed
+    from utils.summary import delete_summary
+    from utils.violations import delete_violations
+
+    if not os.path.exists(ctx.csv_path):
+        ctx.df.to_csv(ctx.csv_path, index=False)
+    client = appmod.app.test_client()
+    with client.session_transaction() as sess:
+        sess["user"] = {"username": "benchmark", "role": "user", "email": "benchmark@example.com"}
+    upload_folder = appmod.app.config["UPLOAD_FOLDER"]
+
+    def run():
+        with open(ctx.csv_path, "rb") as f:
+            data = dict(ctx.params, data_file=(f, "survey.csv"))
+            resp = client.post("/process-form", data=data, content_type="multipart/form-data")
+        location = resp.headers.get("Location", "")
+        if resp.status_code != 302 or "/view-details/" not in location:
+            raise RuntimeError(f"process-form did not queue a job (HTTP {resp.status_code})")
+        job_id = int(location.rsplit("/", 1)[1])
+        try:
+            while True:
+                status = client.get(f"/jobs/{job_id}/status").get_json()
+                if status["status"] == "failed":
+                    raise RuntimeError(f"job failed: {status.get('error')}")
+                if status["status"] == "done":
+                    return status
+                time.sleep(0.05)
+        finally:
+            appmod.job_queue.delete("process", job_id)
+            delete_processed(upload_folder, job_id)
+            delete_summary(upload_folder, job_id)
+            delete_violations(upload_folder, job_id)
+            with client.session_transaction() as sess:
+                uploaded = sess.pop("uploaded_file", None)
+            if uploaded and os.path.exists(uploaded):
+                os.remove(uploaded)
+    return run
+
+
+STAGES: Dict[str, Callable] = {
+    "impute_mean": _impute("Mean"),
+    "impute_median": _impute("Median"),
+    "impute_knn": _impute("KNN"),
+    "detect_outliers_iqr": _outliers("IQR"),
+    "detect_outliers_zscore": _outliers("Z-score"),
+    "detect_outliers_winsorize": _outliers("Winsorize"),
+    "winsorize_values": _winsorize,
+    "validate_rules": _validate_rules,
+    "plan_run": _plan_run,
+    "weighted_summary_per_column": _weighted_per_column,
+    "weighted_summaries_batched": _weighted_batched,
+    "summarize": _summarize,
+    "plot_histograms": _plot_histograms,
+    "plot_summary_histograms": _plot_summary_histograms,
+    "plot_summary_histograms_cached": _plot_summary_histograms_cached,
+    "write_processed": _write_processed,
+    "export_csv": _export_csv,
+    "streaming": _streaming,
+    "e2e_process_form": _e2e_process_form,
+}
+
+
+def time_stage(name: str, ctx: Context, repeat: int) -> Dict:
+    record = {"stage": name, "repeats": repeat}
+    try:
+        func = STAGES[name](ctx)
+        timings, peaks, deltas, worker_peaks = [], [], [], []
+        for _ in range(repeat):
+            e2e = name.startswith("e2e_")
+            workers = _child_pids() if e2e else []
+            for pid in workers:
+                _reset_peak(pid)
+            _reset_peak()
+            baseline = _status_mb("VmRSS")
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+            peak = peak_rss_mb()
+            peaks.append(peak)
+            if baseline is not None and peak is not None:
+                deltas.append(peak - baseline)
+            if e2e:
+                worker_peaks.extend(p for p in (peak_rss_mb(pid) for pid in _child_pids()) if p)
+        record.update(
+            seconds_min=min(timings),
+            seconds_median=statistics.median(timings),
+            peak_rss_mb=max(peaks) if all(p is not None for p in peaks) else None,
+            rss_delta_mb=max(deltas) if deltas else None,
+        )
+        if worker_peaks:
+            record["worker_peak_rss_mb"] = max(worker_peaks)
+    except Exception as e:  # keep going: one broken stage should not lose the run
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+
+# -- run --------------------------------------------------------------------
+
+def _git(*args) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def environment() -> Dict:
+    import matplotlib
+
+    commit = _git("rev-parse", "--short", "HEAD")
+    return {
+        "commit": commit,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "matplotlib": matplotlib.__version__,
+        "settings": {key: os.environ[key] for key in ENV_SETTINGS if key in os.environ},
+        "peak_rss_resettable": _reset_peak(),
+    }
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(float(part)) for part in text.split(",") if part.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", default="10000,100000", help="comma-separated dataset sizes")
+    parser.add_argument("--numeric", type=int, default=10, help="numeric columns (incl. age, income)")
+    parser.add_argument("--categorical", type=int, default=3, help="categorical columns")
+    parser.add_argument("--missing", type=float, default=0.05, help="missing-value rate of numeric cells")
+    parser.add_argument("--outliers", type=float, default=0.01, help="gross-outlier rate of numeric cells")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage")
+    parser.add_argument("--stages", default="", help="comma-separated stages to run (default: all)")
+    parser.add_argument("--skip", default="", help="comma-separated stages to skip")
+    parser.add_argument("--output", default="", help="result file (default: benchmarks/results/<time>_<commit>.json)")
+    parser.add_argument("--list", action="store_true", help="list the stages and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(STAGES))
+        return 0
+    stages = [s for s in (args.stages.split(",") if args.stages else STAGES) if s]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+    skip = set(filter(None, args.skip.split(",")))
+    stages = [s for s in stages if s not in skip]
+
+    env = environment()
+    results = []
+    for rows in _int_list(args.rows):
+        dataset = {
+            "rows": rows, "numeric": args.numeric, "categorical": args.categorical,
+            "missing": args.missing, "outliers": args.outliers, "seed": args.seed,
+        }
+        df = make_survey(rows, args.numeric, args.categorical, args.missing, args.outliers, args.seed)
+        workdir = tempfile.mkdtemp(prefix="survey-bench-")
+        try:
+            ctx = Context(df, workdir)
+            for name in stages:
+                record = dict(dataset, **time_stage(name, ctx, args.repeat))
+                results.append(record)
+                if "error" in record:
+                    print(f"{rows:>10} {name:<30} ERROR {record['error']}", flush=True)
+                else:
+                    print(f"{rows:>10} {name:<30} {record['seconds_min']:>9.3f}s "
+                          f"peak {record['peak_rss_mb'] or 0:>8.0f} MB", flush=True)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}_{env['commit'] or 'nogit'}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"environment": env, "config": vars(args), "results": results}, f, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
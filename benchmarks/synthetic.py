@@ -0,0 +1,81 @@
+"""Synthetic survey data for the benchmarks.
+
+make_survey builds a frame shaped like the uploads the app processes: an
+`age` and an `income` column, further numeric answer columns, categorical
+columns (region, has_tv/tv_brand skip pattern, ...) and a positive `weight`.
+Missing values and gross outliers are injected at the given rates. The same
+arguments and seed always give the same frame.
+"""
+import json
+import numpy as np
+import pandas as pd
+from typing import Dict
+
+REGIONS = ["North", "South", "East", "West"]
+
+
+def make_survey(rows: int, numeric: int = 10, categorical: int = 3, missing: float = 0.05,
+                outliers: float = 0.01, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = {
+        "age": rng.integers(18, 90, rows).astype(np.float64),
+        "income": rng.lognormal(10.5, 0.6, rows),
+    }
+    for i in range(max(numeric - 2, 0)):
+        # Likert-ish, score-ish and skewed answers
+        kind = i % 3
+        if kind == 0:
+            data[f"q{i + 1}"] = rng.integers(1, 6, rows).astype(np.float64)
+        elif kind == 1:
+            data[f"q{i + 1}"] = rng.normal(50, 12, rows)
+        else:
+            data[f"q{i + 1}"] = rng.gamma(2.0, 3.0, rows)
+    for name, values in data.items():
+        if outliers:
+            hit = rng.random(rows) < outliers
+            values[hit] = values[hit] * rng.choice([-8.0, 12.0], hit.sum())
+        if missing:
+            values[rng.random(rows) < missing] = np.nan
+    df = pd.DataFrame(data)
+
+    if categorical >= 1:
+        df["region"] = rng.choice(REGIONS, rows, p=[0.3, 0.3, 0.2, 0.2])
+    if categorical >= 2:
+        has_tv = rng.random(rows) < 0.8
+        df["has_tv"] = has_tv.astype(np.int64)
+        brand = rng.choice(["a", "b", "c"], rows).astype(object)
+        # Mostly respects the skip pattern, with a few violations
+        brand[~has_tv & (rng.random(rows) < 0.9)] = None
+        df["tv_brand"] = brand
+    for i in range(max(categorical - 2, 0)):
+        df[f"cat{i + 1}"] = rng.choice([f"level_{k}" for k in range(5 + i)], rows)
+
+    df["weight"] = rng.gamma(4.0, 0.25, rows)
+    return df
+
+
+def survey_rules(df: pd.DataFrame) -> Dict:
+    """Validation rules exercising range, skip and compound checks."""
+    rules: Dict = {"age": {"min": 18, "max": 99}, "income": {"min": 0}}
+    for col in df.columns:
+        if col.startswith("q"):
+            rules[col] = {"min": 0}
+    if "tv_brand" in df.columns:
+        rules["skip_if"] = [{"if": {"has_tv": 0}, "then_blank": ["tv_brand"]}]
+    if "region" in df.columns:
+        rules["region"] = {"in": REGIONS}
+        rules["checks"] = [{"if": {"region": ["North"]}, "then": {"age": {"max": 85}}}]
+    return rules
+
+
+def survey_params(df: pd.DataFrame, **overrides) -> Dict:
+    """Process-form parameters for a benchmark run."""
+    params = {
+        "impute_method": "Mean",
+        "outlier_method": "IQR",
+        "outlier_action": "winsorize",
+        "weight_col": "weight",
+        "rules_json": json.dumps(survey_rules(df)),
+    }
+    params.update(overrides)
+    return params
@@ -1,76 +1,17 @@
-import os
-import mysql.connector
-from mysql.connector import errorcode
-from mysql.connector.pooling import MySQLConnectionPool
-from mysql.connector import errors as mysql_errors
-import bcrypt
-
-from config import DB_HOST, DB_USER, DB_PASS, DB_NAME, ADMIN_USERNAME, ADMIN_EMAIL, ADMIN_PASSWORD
-
-
-_POOL = None
-_POOL_NAME = "survey_pool"
-_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "25"))
-
-
-def _init_pool():
-	global _POOL
-	_POOL = MySQLConnectionPool(
-		pool_name=_POOL_NAME,
-		pool_size=_POOL_SIZE,
-		host=DB_HOST,
-		user=DB_USER,
-		password=DB_PASS,
-		database=DB_NAME,
-		pool_reset_session=True,
-		connection_timeout=10
-	)
-
-
-def _direct_connect():
-    return mysql.connector.connect(
-        host=DB_HOST,
-        user=DB_USER,
-        password=DB_PASS,
-        database=DB_NAME,
-        connection_timeout=10
-    )
+import logging
 
+import bcrypt
 
-def get_connection(create_db_if_missing: bool = True) -> mysql.connector.MySQLConnection:
-    global _POOL
-    # Optional escape hatch to disable pooling via env
-    if os.environ.get("DB_POOL_DISABLED", "1") == "1":
-        return _direct_connect()
+from config import ADMIN_USERNAME, ADMIN_EMAIL, ADMIN_PASSWORD
+from utils.db_mysql import get_connection as _shared_get_connection
 
-    try:
-        if _POOL is None:
-            _init_pool()
-        return _POOL.get_connection()
-    except Exception as err:
-        # If pool is exhausted/closed or any pooling issue, retry by reinitializing
-        message = str(err).lower()
-        if isinstance(err, (mysql_errors.PoolError,)) or "pool" in message:
-            try:
-                _init_pool()
-                return _POOL.get_connection()
-            except Exception:
-                return _direct_connect()
-        # Handle missing DB
-        if isinstance(err, mysql.connector.Error) and getattr(err, "errno", None) == errorcode.ER_BAD_DB_ERROR and create_db_if_missing:
-            _create_database()
-            return get_connection(create_db_if_missing=False)
-        raise
+logger = logging.getLogger(__name__)
 
 
-def _create_database():
-	conn = mysql.connector.connect(host=DB_HOST, user=DB_USER, password=DB_PASS)
-	cursor = conn.cursor()
-	cursor.execute(f"CREATE DATABASE IF NOT EXISTS {DB_NAME}")
-	conn.commit()
-	cursor.close()
-	conn.close()
-	create_tables()
+def get_connection(create_db_if_missing: bool = True):
+	"""Pooled connection from the app's shared pool (utils.db_mysql), which
+	connects with config.py's DB_* settings unless DATABASE_URL is set."""
+	return _shared_get_connection(create_db_if_missing)
 
 
 def _column_exists(cursor, table: str, column: str) -> bool:
@@ -126,40 +67,40 @@ def create_tables():
 		result = cursor.fetchone()
 		if not result:
 			cursor.execute("ALTER TABLE audit_logs ADD COLUMN display_name VARCHAR(255)")
-			print("Added display_name column to audit_logs table")
+			logger.info("Added display_name column to audit_logs table")
 		
 		# Check if is_saved column exists, add if missing
 		cursor.execute("SHOW COLUMNS FROM audit_logs LIKE 'is_saved'")
 		result = cursor.fetchone()
 		if not result:
 			cursor.execute("ALTER TABLE audit_logs ADD COLUMN is_saved BOOLEAN DEFAULT FALSE")
-			print("Added is_saved column to audit_logs table")
+			logger.info("Added is_saved column to audit_logs table")
 		
 		# Create indexes for better performance
 		cursor.execute("SHOW INDEX FROM audit_logs WHERE Key_name = 'idx_audit_user_time'")
 		result = cursor.fetchone()
 		if not result:
 			cursor.execute("CREATE INDEX idx_audit_user_time ON audit_logs(username, created_at)")
-			print("Created index idx_audit_user_time")
+			logger.info("Created index idx_audit_user_time")
 		
 		cursor.execute("SHOW INDEX FROM audit_logs WHERE Key_name = 'idx_audit_time'")
 		result = cursor.fetchone()
 		if not result:
 			cursor.execute("CREATE INDEX idx_audit_time ON audit_logs(created_at)")
-			print("Created index idx_audit_time")
+			logger.info("Created index idx_audit_time")
 		
 		cursor.execute("SHOW INDEX FROM audit_logs WHERE Key_name = 'idx_audit_saved'")
 		result = cursor.fetchone()
 		if not result:
 			cursor.execute("CREATE INDEX idx_audit_saved ON audit_logs(is_saved)")
-			print("Created index idx_audit_saved")
+			logger.info("Created index idx_audit_saved")
 		
 		conn.commit()
-		print("Tables created/updated successfully")
+		logger.info("Tables created/updated successfully")
 		return True
 		
 	except Exception as e:
-		print(f"Error creating tables: {e}")
+		logger.exception("Error creating tables: %s", e)
 		return False
 	finally:
 		try:
@@ -190,11 +131,11 @@ def bootstrap_admin():
 				(ADMIN_USERNAME, ADMIN_EMAIL, hashed, 'admin')
 			)
 			conn.commit()
-			print(f"Created admin user: {ADMIN_USERNAME}")
+			logger.info("Created admin user: %s", ADMIN_USERNAME)
 		else:
-			print(f"Admin user {ADMIN_USERNAME} already exists")
+			logger.info("Admin user %s already exists", ADMIN_USERNAME)
 	except Exception as e:
-		print(f"Error bootstrapping admin: {e}")
+		logger.exception("Error bootstrapping admin: %s", e)
 	finally:
 		try:
 			if cursor:
@@ -1,56 +1,41 @@
-import mysql.connector
+"""Create the database if needed and apply pending schema migrations.
 
-def get_connection(db=None):
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="@tojo1234",  # Change this!
-        database=db if db else None
-    )
+    python setup_db.py
+    python setup_db.py --backfill-usage   # also rebuild the usage aggregates
 
-# Step 1: Connect without database and create the database if it doesn't exist
-conn = get_connection()
-cursor = conn.cursor()
-cursor.execute("CREATE DATABASE IF NOT EXISTS survey_app")
-cursor.close()
-conn.close()
+Uses the same connection settings as the app (DATABASE_URL or DB_*). The
+app also migrates on boot unless DB_MIGRATE_ON_BOOT=0.
+"""
+import argparse
+import logging
+from utils.logs import configure_logging
+from utils.db_mysql import DB_NAME, backfill_usage, get_connection
+from utils.migrations import LATEST_VERSION, current_version, migrate
 
-# Step 2: Connect to the new database and create the tables
-conn = get_connection(db="survey_app")
-cursor = conn.cursor()
+logger = logging.getLogger("setup_db")
 
-# Create users table
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INT AUTO_INCREMENT PRIMARY KEY,
-    username VARCHAR(100) UNIQUE,
-    email VARCHAR(255) UNIQUE,
-    password VARCHAR(255),
-    role ENUM('user','admin') DEFAULT 'user',
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-)
-""")
 
-# Create processing_jobs table for survey data processing
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS processing_jobs (
-    id INT AUTO_INCREMENT PRIMARY KEY,
-    username VARCHAR(100),
-    uploaded_filename VARCHAR(255),
-    rows_before INT,
-    rows_after INT,
-    impute_method VARCHAR(50),
-    outlier_method VARCHAR(50),
-    weight_col VARCHAR(100),
-    violations_count INT DEFAULT 0,
-    display_name VARCHAR(255),
-    is_saved BOOLEAN DEFAULT FALSE,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (username) REFERENCES users(username) ON DELETE CASCADE
-)
-""")
+def main():
+    parser = argparse.ArgumentParser(description="Create the database and apply schema migrations.")
+    parser.add_argument("--backfill-usage", action="store_true",
+                        help="rebuild usage_daily/usage_users from processing_jobs")
+    args = parser.parse_args()
+    configure_logging()
+    # get_connection creates the database if it is missing
+    conn = get_connection()
+    try:
+        applied = migrate(conn)
+        version = current_version(conn)
+    finally:
+        conn.close()
+    if applied:
+        logger.info("Applied migrations %s to %s", applied, DB_NAME)
+    else:
+        logger.info("Schema of %s is up to date", DB_NAME)
+    logger.info("Schema version %s (latest %s)", version, LATEST_VERSION)
+    if args.backfill_usage:
+        backfill_usage()
 
-conn.commit()
-cursor.close()
-conn.close()
-print("✅ Database and tables setup complete!")
\ No newline at end of file
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Design-based variance estimators in utils.weights against hand-computed
+values and direct textbook formulas.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.weights import compute_weighted_summary, design_summaries
+
+# Two strata of two single-row PSUs, unit weights: strata means 2 and 6 with
+# within-stratum variance 2, so var(mean) = (2/2 + 2/2) / 2**2 = 0.5. For this
+# linear design linearization, the jackknife and full-balance BRR all agree.
+SMALL_Y = np.array([1.0, 3.0, 5.0, 7.0])
+SMALL_STRATA = np.array([1, 1, 2, 2])
+SMALL_PSU = np.array(["a", "b", "c", "d"])
+
+
+@pytest.mark.parametrize("method", ["Linearization", "Jackknife", "BRR"])
+def test_small_design_by_hand(method):
+    est = design_summaries(SMALL_Y, strata=SMALL_STRATA, psu=SMALL_PSU, method=method)
+    assert est.loc[0, "mean"] == pytest.approx(4.0)
+    assert est.loc[0, "var"] == pytest.approx(0.5)
+    assert est.loc[0, "se"] == pytest.approx(np.sqrt(0.5))
+    assert est.loc[0, "margin_of_error"] == pytest.approx(1.96 * np.sqrt(0.5))
+
+
+def _stratified_cluster_sample(seed=1, n_strata=5, psus=(2, 3, 4), rows=(3, 9)):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for h in range(n_strata):
+        for c in range(psus[h % len(psus)]):
+            n = rng.integers(*rows)
+            frames.append(pd.DataFrame({
+                "stratum": h,
+                "psu": f"{h}-{c}",
+                "w": rng.uniform(0.5, 3.0, n),
+                "y": rng.normal(10 + h, 2, n) + rng.normal(0, 1),
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _ratio_mean(df, w):
+    return (w * df["y"]).sum() / w.sum()
+
+
+def test_linearization_matches_residual_formula():
+    df = _stratified_cluster_sample()
+    theta = _ratio_mean(df, df["w"])
+    # Linearized residuals, totalled per PSU, then the with-replacement
+    # between-PSU variance within each stratum
+    df["z"] = df["w"] * (df["y"] - theta) / df["w"].sum()
+    expected = 0.0
+    for _, stratum in df.groupby("stratum"):
+        z = stratum.groupby("psu")["z"].sum()
+        n = len(z)
+        expected += n / (n - 1) * ((z - z.mean()) ** 2).sum()
+
+    est = design_summaries(df[["y"]], df["w"], df["stratum"].to_numpy(), df["psu"].to_numpy(),
+                           method="Linearization")
+    assert est.loc["y", "mean"] == pytest.approx(theta)
+    assert est.loc["y", "var"] == pytest.approx(expected, rel=1e-9)
+
+
+def test_jackknife_matches_delete_one_psu():
+    df = _stratified_cluster_sample()
+    theta = _ratio_mean(df, df["w"])
+    expected = 0.0
+    for h, stratum in df.groupby("stratum"):
+        psus = stratum["psu"].unique()
+        n = len(psus)
+        for dropped in psus:
+            w = df["w"].where(df["psu"] != dropped, 0.0)
+            w = w.where(~((df["stratum"] == h) & (df["psu"] != dropped)), w * n / (n - 1))
+            expected += (n - 1) / n * (_ratio_mean(df, w) - theta) ** 2
+
+    est = design_summaries(df[["y"]], df["w"], df["stratum"].to_numpy(), df["psu"].to_numpy(),
+                           method="Jackknife")
+    assert est.loc["y", "var"] == pytest.approx(expected, rel=1e-9)
+
+
+def _paired_design(seed=2, n_strata=5):
+    """Two PSUs per stratum with equal weight totals, so the weighted mean is
+    linear in the PSU totals A = sum(w * y).
+    """
+    df = _stratified_cluster_sample(seed, n_strata, psus=(2,), rows=(4, 5))
+    df["w"] = 1.0
+    return df
+
+
+@pytest.mark.parametrize("method", ["Linearization", "Jackknife", "BRR"])
+def test_two_psu_design_matches_paired_differences(method):
+    # With equal PSU weights in each stratum every estimator reduces to
+    # var = sum_h (A_h1 - A_h2)^2 / W^2
+    df = _paired_design()
+    totals = (df["w"] * df["y"]).groupby([df["stratum"], df["psu"]]).sum()
+    diffs = totals.groupby(level=0).agg(lambda t: t.iloc[0] - t.iloc[1])
+    expected = (diffs ** 2).sum() / df["w"].sum() ** 2
+
+    est = design_summaries(df[["y"]], df["w"], df["stratum"].to_numpy(), df["psu"].to_numpy(), method=method)
+    assert est.loc["y", "mean"] == pytest.approx(_ratio_mean(df, df["w"]))
+    assert est.loc["y", "var"] == pytest.approx(expected, rel=1e-9)
+
+
+def test_brr_needs_two_psus_per_stratum():
+    df = _stratified_cluster_sample()
+    with pytest.raises(ValueError):
+        design_summaries(df[["y"]], df["w"], df["stratum"].to_numpy(), df["psu"].to_numpy(), method="BRR")
+
+
+def test_bootstrap_is_seeded_and_close_to_linearization():
+    df = _stratified_cluster_sample(seed=3, n_strata=8, psus=(6, 8))
+    args = (df[["y"]], df["w"], df["stratum"].to_numpy(), df["psu"].to_numpy())
+    boot = design_summaries(*args, method="Bootstrap", replicates=2000, seed=7)
+    again = design_summaries(*args, method="Bootstrap", replicates=2000, seed=7)
+    lin = design_summaries(*args, method="Linearization")
+    assert boot.loc["y", "se"] == again.loc["y", "se"]
+    assert boot.loc["y", "mean"] == pytest.approx(lin.loc["y", "mean"])
+    assert boot.loc["y", "se"] == pytest.approx(lin.loc["y", "se"], rel=0.15)
+
+
+def test_unclustered_equal_weights_match_weighted_summary():
+    rng = np.random.default_rng(4)
+    df = pd.DataFrame({"y": rng.normal(50, 5, 400), "weight": 1.0})
+    df.loc[::17, "y"] = np.nan
+    n = len(df)
+    reference = compute_weighted_summary(df, "y")
+
+    est = design_summaries(df[["y"]], df["weight"], method="Linearization")
+    assert est.loc["y", "mean"] == pytest.approx(reference["weighted_mean"])
+    # The design SE uses the sample variance (n - 1), compute_weighted_summary
+    # the population variance. Rows missing y stay in the design with zero
+    # residuals (the survey package's domain estimate), so n counts every row.
+    assert est.loc["y", "margin_of_error"] == pytest.approx(
+        reference["margin_of_error"] * np.sqrt(n / (n - 1)), rel=1e-9
+    )
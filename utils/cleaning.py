@@ -1,30 +1,42 @@
 import pandas as pd
 import numpy as np
-from sklearn.impute import KNNImputer
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+from utils.colstats import column_quantiles
+from utils.knn import knn_impute_frame
+from utils.rules import compile_rules
 
-def impute_missing(df, method="Mean"):
+def impute_missing(df, method="Mean", stats=None):
+    """Fill missing numeric values. `stats` (colstats.compute_column_stats on
+    the same frame) lets callers reuse already computed means/medians.
+    """
     df_copy = df.copy()
     numeric_cols = df_copy.select_dtypes(include=np.number).columns
 
     if method == "Mean":
         for col in numeric_cols:
-            mean_val = df_copy[col].mean()
+            mean_val = stats[col].mean if stats and col in stats else df_copy[col].mean()
             df_copy[col] = df_copy[col].fillna(mean_val)
     elif method == "Median":
         for col in numeric_cols:
-            median_val = df_copy[col].median()
+            if stats and col in stats:
+                median_val = stats[col].quantiles([0.5])[0.5]
+            else:
+                median_val = df_copy[col].median()
             df_copy[col] = df_copy[col].fillna(median_val)
     elif method == "KNN":
-        imputer = KNNImputer(n_neighbors=3)
-        df_copy[numeric_cols] = imputer.fit_transform(df_copy[numeric_cols])
+        knn_impute_frame(df_copy, numeric_cols)
     return df_copy
 
-def detect_outliers(df, method="IQR"):
+def detect_outliers(df, method="IQR", quantiles: Optional[pd.DataFrame] = None):
+    """Flag rows with an outlying numeric value. `quantiles` is an optional
+    precomputed table (rows 0.01/0.25/0.75/0.99, see colstats.quantile_table).
+    """
     df_num = df.select_dtypes(include=np.number)
     if method == "IQR":
-        Q1 = df_num.quantile(0.25)
-        Q3 = df_num.quantile(0.75)
+        if quantiles is None:
+            quantiles = column_quantiles(df_num, (0.25, 0.75))
+        Q1 = quantiles.loc[0.25, df_num.columns]
+        Q3 = quantiles.loc[0.75, df_num.columns]
         IQR = Q3 - Q1
         outliers = ((df_num < (Q1 - 1.5 * IQR)) | (df_num > (Q3 + 1.5 * IQR)))
         return outliers.any(axis=1)
@@ -34,8 +46,10 @@ def detect_outliers(df, method="IQR"):
         return (z_scores > 3).any(axis=1)
     elif method == "Winsorize":
         # Mark rows where any numeric col is beyond 1st/99th percentile
-        lower = df_num.quantile(0.01)
-        upper = df_num.quantile(0.99)
+        if quantiles is None:
+            quantiles = column_quantiles(df_num, (0.01, 0.99))
+        lower = quantiles.loc[0.01, df_num.columns]
+        upper = quantiles.loc[0.99, df_num.columns]
         mask_lower = (df_num.lt(lower, axis=1)).any(axis=1)
         mask_upper = (df_num.gt(upper, axis=1)).any(axis=1)
         return mask_lower | mask_upper
@@ -46,19 +60,30 @@ def remove_outliers(df, outliers):
     return df.loc[~outliers]
 
 
-def winsorize_values(df, limits: Tuple[float, float] = (0.01, 0.99)):
+def winsorize_values(df, limits: Tuple[float, float] = (0.01, 0.99), quantiles: Optional[pd.DataFrame] = None):
     """Clamp numeric values to given lower/upper quantiles.
+    `quantiles` is an optional precomputed table containing both limits.
     Returns a new DataFrame.
     """
     df_copy = df.copy()
     num_cols = df_copy.select_dtypes(include=np.number).columns
-    lowers = df_copy[num_cols].quantile(limits[0])
-    uppers = df_copy[num_cols].quantile(limits[1])
+    if quantiles is None:
+        quantiles = column_quantiles(df_copy[num_cols], limits)
+    lowers = quantiles.loc[limits[0], num_cols]
+    uppers = quantiles.loc[limits[1], num_cols]
     for c in num_cols:
         df_copy[c] = df_copy[c].clip(lower=lowers[c], upper=uppers[c])
     return df_copy
 
 
+def rule_violation_counts(df, rules: Dict[str, Dict]) -> List[Tuple[str, int, str]]:
+    """Evaluate `rules` (see validate_rules) and return (column, count, description)
+    for every check, including those with zero violations. Counts from several
+    chunks of the same dataset can be summed check by check.
+    """
+    return compile_rules(rules).evaluate(df, bitmap=False).count_list()
+
+
 def validate_rules(df, rules: Dict[str, Dict]) -> List[str]:
     """Apply simple rule-based validation.
     rules format example:
@@ -67,34 +92,7 @@ def validate_rules(df, rules: Dict[str, Dict]) -> List[str]:
       "income": {"min": 0},
       "skip_if": [{"if": {"has_tv": 0}, "then_blank": ["tv_brand"]}]
     }
+    See utils.rules for set, cross-column and compound if/then rules.
     Returns list of violation messages.
     """
-    logs: List[str] = []
-    # range checks
-    for col, spec in rules.items():
-        if col in df.columns:
-            if isinstance(spec, dict):
-                if 'min' in spec:
-                    bad = df[col].dropna() < spec['min']
-                    count = int(bad.sum())
-                    if count:
-                        logs.append(f"{col}: {count} values below {spec['min']}")
-                if 'max' in spec:
-                    bad = df[col].dropna() > spec['max']
-                    count = int(bad.sum())
-                    if count:
-                        logs.append(f"{col}: {count} values above {spec['max']}")
-    # skip pattern checks
-    for spec in rules.get('skip_if', []):
-        cond = spec.get('if', {})
-        then_blank = spec.get('then_blank', [])
-        if cond and then_blank:
-            col, val = next(iter(cond.items()))
-            if col in df.columns:
-                mask = df[col] == val
-                for target in then_blank:
-                    if target in df.columns:
-                        violations = df.loc[mask, target].notna().sum()
-                        if violations:
-                            logs.append(f"{target}: {violations} should be blank when {col} == {val}")
-    return logs
+    return [f"{col}: {count} {text}" for col, count, text in rule_violation_counts(df, rules) if count]
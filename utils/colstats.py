@@ -0,0 +1,274 @@
+"""Per-column statistics shared by the cleaning stages.
+
+All quantiles a job needs (imputation median, IQR fences, winsorize limits)
+are computed in one pass per column, either exactly or from a mergeable KLL
+sketch. Sketches from separate chunks or worker processes combine with
+`merge`, so the same code serves in-memory, streaming and parallel runs.
+
+Select the mode with COLSTATS_MODE=exact|approx. In approx mode the target
+normalised rank error is COLSTATS_EPSILON (sketch size k is about 1.7 / eps);
+COLSTATS_SKETCH_K sets k directly.
+"""
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Tuple
+
+QUANTILES = (0.01, 0.25, 0.5, 0.75, 0.99)
+STATS_MODE = os.getenv("COLSTATS_MODE", "exact").lower()
+
+
+def sketch_k_for_error(epsilon: float) -> int:
+    """Smallest KLL `k` whose expected normalised rank error is <= epsilon."""
+    return max(8, int(np.ceil(1.7 / epsilon)))
+
+
+SKETCH_K = int(os.getenv("COLSTATS_SKETCH_K", "0")) or sketch_k_for_error(float(os.getenv("COLSTATS_EPSILON", "0.001")))
+
+
+class KLLSketch:
+    """KLL quantile sketch (Karnin, Lang & Liberty 2016).
+
+    Items live in levels of compactors; an item at level h stands for 2**h
+    observations. When a level outgrows its capacity it is sorted and every
+    other item (random offset) is promoted, so memory stays O(k log(n / k)).
+    """
+
+    _C = 2.0 / 3.0
+
+    def __init__(self, k: int = SKETCH_K, seed: Optional[int] = None):
+        self.k = int(k)
+        self.n = 0
+        self._levels: List[np.ndarray] = [np.empty(0, dtype=np.float64)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self._levels) - level - 1
+        return max(2, int(np.ceil(self.k * self._C ** depth)))
+
+    def update(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        self.n += len(values)
+        self._compress()
+
+    def merge(self, other: "KLLSketch"):
+        """Fold `other` into this sketch (both must use the same k)."""
+        while len(self._levels) < len(other._levels):
+            self._levels.append(np.empty(0, dtype=np.float64))
+        for h, items in enumerate(other._levels):
+            if len(items):
+                self._levels[h] = np.concatenate([self._levels[h], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def _compress(self):
+        h = 0
+        while h < len(self._levels):
+            items = self._levels[h]
+            if len(items) > self._capacity(h):
+                if h + 1 == len(self._levels):
+                    self._levels.append(np.empty(0, dtype=np.float64))
+                items = np.sort(items)
+                # Keep one item behind when the count is odd so weight is preserved
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                paired = items[: len(items) - len(keep)]
+                promoted = paired[int(self._rng.integers(2))::2]
+                self._levels[h] = keep
+                self._levels[h + 1] = np.concatenate([self._levels[h + 1], promoted])
+            h += 1
+
+    def weighted_items(self) -> Tuple[np.ndarray, np.ndarray]:
+        values = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(items), float(2 ** h)) for h, items in enumerate(self._levels)])
+        return values, weights
+
+    def quantiles(self, qs: Iterable[float], fill_value: Optional[float] = None, fill_count: int = 0) -> List[float]:
+        values, weights = self.weighted_items()
+        return weighted_quantiles(values, weights, qs, fill_value, fill_count)
+
+
+def weighted_quantiles(values: np.ndarray, weights: np.ndarray, qs, fill_value: Optional[float] = None,
+                       fill_count: int = 0) -> List[float]:
+    """Quantiles of weighted items, each standing for `weight` observations,
+    plus an optional point mass of `fill_count` copies of `fill_value`.
+
+    An item covers the ranks [C, C + w - 1] (C = weight before it) and the
+    query rank q * (N - 1) is interpolated linearly, which reduces to pandas'
+    default 'linear' quantile when every weight is 1.
+    """
+    if fill_value is not None and fill_count:
+        values = np.append(values, fill_value)
+        weights = np.append(weights, float(fill_count))
+    if not len(values):
+        return [np.nan for _ in qs]
+    order = np.argsort(values, kind="stable")
+    values, weights = values[order], weights[order]
+    start = np.cumsum(weights) - weights
+    ranks = np.column_stack([start, start + np.maximum(weights - 1, 0)]).ravel()
+    total = float(weights.sum())
+    return [float(v) for v in np.interp(np.asarray(qs) * max(total - 1, 0), ranks, np.repeat(values, 2))]
+
+
+class ColumnStats:
+    """Running statistics for one numeric column: moments, min/max, missing
+    count and quantiles (sorted values in exact mode, a KLLSketch otherwise).
+    """
+
+    def __init__(self, mode: str = STATS_MODE, k: int = SKETCH_K, seed: Optional[int] = None):
+        self.mode = mode
+        self.count = 0
+        self.missing = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.is_integer = True
+        self._parts: List[np.ndarray] = []
+        self._sorted: Optional[np.ndarray] = None
+        self.sketch = KLLSketch(k, seed) if mode == "approx" else None
+
+    def update(self, series):
+        if isinstance(series, pd.Series):
+            if not pd.api.types.is_integer_dtype(series.dtype):
+                self.is_integer = False
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            values = np.asarray(series, dtype=np.float64)
+            self.is_integer = False
+        observed = values[~np.isnan(values)]
+        self.missing += len(values) - len(observed)
+        if not len(observed):
+            return self
+        self.count += len(observed)
+        self.total += float(observed.sum())
+        self.total_sq += float(np.dot(observed, observed))
+        self.min = min(self.min, float(observed.min()))
+        self.max = max(self.max, float(observed.max()))
+        if self.sketch is not None:
+            self.sketch.update(observed)
+        else:
+            self._parts.append(observed)
+            self._sorted = None
+        return self
+
+    def merge(self, other: "ColumnStats"):
+        self.count += other.count
+        self.missing += other.missing
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.is_integer = self.is_integer and other.is_integer
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        else:
+            self._parts.extend(other._parts)
+            self._sorted = None
+        return self
+
+    def filled(self, fill_value: Optional[float] = None) -> Tuple[int, float, float]:
+        """(count, mean, population std) after filling missing values with `fill_value`."""
+        count, total, total_sq = self.count, self.total, self.total_sq
+        if fill_value is not None and self.missing:
+            count += self.missing
+            total += fill_value * self.missing
+            total_sq += fill_value * fill_value * self.missing
+        if not count:
+            return 0, np.nan, np.nan
+        mean = total / count
+        var = max(total_sq / count - mean * mean, 0.0)
+        return count, mean, float(np.sqrt(var))
+
+    @property
+    def mean(self) -> float:
+        return self.filled(None)[1]
+
+    def quantiles(self, qs: Iterable[float] = QUANTILES, fill_value: Optional[float] = None) -> Dict[float, float]:
+        """Quantiles of the column, optionally with missing values counted as
+        `fill_value` (i.e. the distribution after imputation).
+        """
+        qs = list(qs)
+        fill_count = self.missing if fill_value is not None else 0
+        if self.sketch is not None:
+            return dict(zip(qs, self.sketch.quantiles(qs, fill_value, fill_count)))
+        return dict(zip(qs, sorted_quantiles(self.sorted_values(), qs, fill_value, fill_count)))
+
+    def sorted_values(self) -> np.ndarray:
+        """Observed values in ascending order (exact mode)."""
+        if self._sorted is None or len(self._parts) > 1:
+            # Exact mode sorts each column once; every later query is a lookup
+            self._sorted = np.sort(np.concatenate(self._parts)) if self._parts else np.empty(0)
+            self._parts = [self._sorted]
+        return self._sorted
+
+    def set_sorted(self, sorted_values: np.ndarray):
+        """Replace the stored values with an already sorted array (exact
+        mode), e.g. one a worker process sorted into shared memory.
+        """
+        self._sorted = sorted_values
+        self._parts = [sorted_values]
+        return self
+
+
+def sorted_quantiles(sorted_values: np.ndarray, qs, fill_value: Optional[float] = None,
+                     fill_count: int = 0) -> List[float]:
+    """Exact 'linear' quantiles of a sorted array, optionally with `fill_count`
+    copies of `fill_value` merged in (without materialising them).
+    """
+    n = len(sorted_values)
+    m = int(fill_count) if fill_value is not None else 0
+    total = n + m
+    if not total:
+        return [np.nan for _ in qs]
+    if not n:
+        return [float(fill_value) for _ in qs]
+    split = int(np.searchsorted(sorted_values, fill_value)) if m else n
+
+    def at(idx):
+        below = sorted_values[np.minimum(idx, n - 1)]
+        above = sorted_values[np.clip(idx - m, 0, n - 1)]
+        return np.where(idx < split, below, np.where(idx < split + m, fill_value, above))
+
+    pos = np.asarray(qs, dtype=np.float64) * (total - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, total - 1)
+    t = pos - lo
+    a, b = at(lo), at(hi)
+    # Same lerp as numpy.quantile so exact mode matches DataFrame.quantile
+    diff = b - a
+    out = np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+    return [float(v) for v in out]
+
+
+def compute_column_stats(df: pd.DataFrame, columns=None, mode: str = STATS_MODE) -> Dict[str, ColumnStats]:
+    """ColumnStats for each numeric column of `df` (or the given columns)."""
+    if columns is None:
+        columns = df.select_dtypes(include=np.number).columns
+    return {col: ColumnStats(mode).update(df[col]) for col in columns}
+
+
+def quantile_table(stats: Dict[str, ColumnStats], qs: Iterable[float] = QUANTILES,
+                   fills: Optional[Dict[str, float]] = None) -> pd.DataFrame:
+    """Quantiles for every column in the layout of DataFrame.quantile(list):
+    one row per quantile level, one column per variable. `fills` gives the
+    per-column imputation value so the table describes the imputed data.
+    """
+    qs = list(qs)
+    fills = fills or {}
+    table = {}
+    for col, st in stats.items():
+        fill = fills.get(col)
+        if fill is not None and np.isnan(fill):
+            fill = None
+        table[col] = pd.Series(st.quantiles(qs, fill), dtype=np.float64)
+    return pd.DataFrame(table, index=qs, columns=list(stats))
+
+
+def column_quantiles(df: pd.DataFrame, qs: Iterable[float] = QUANTILES, mode: str = STATS_MODE) -> pd.DataFrame:
+    """All requested quantiles of every numeric column in a single pass."""
+    return quantile_table(compute_column_stats(df, mode=mode), qs)
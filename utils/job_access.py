@@ -0,0 +1,106 @@
+"""Job lookup with the ownership check shared by the job pages.
+
+get_owned_job() returns a job record if the user owns it: the database row
+or, for jobs created while the database was unavailable, the session's
+temp job. Database rows are kept in a small per-process LRU cache keyed by
+(job id, username), so following details -> report -> download reads the
+row once. Entries expire after JOB_CACHE_TTL seconds and are invalidated by
+this process when a job is saved/renamed, deleted or finishes processing.
+Changes made by other web workers are picked up when the TTL runs out; the
+fields a processing run updates are also overlaid from the job queue.
+
+Settings: JOB_CACHE_SIZE (default 256 entries, 0 disables the cache) and
+JOB_CACHE_TTL (default 30 seconds).
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from mysql.connector import Error
+
+from utils.db_mysql import get_job_by_id
+
+logger = logging.getLogger(__name__)
+
+JOB_CACHE_SIZE = int(os.getenv("JOB_CACHE_SIZE", "256"))
+JOB_CACHE_TTL = float(os.getenv("JOB_CACHE_TTL", "30"))
+
+
+class JobCache:
+    def __init__(self, maxsize: int = JOB_CACHE_SIZE, ttl: float = JOB_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_id: int, username: str) -> Optional[Dict]:
+        key = (int(job_id), username)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, job = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return job
+
+    def put(self, job_id: int, username: str, job: Dict):
+        if self.maxsize <= 0:
+            return
+        key = (int(job_id), username)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, job)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, job_id: int):
+        job_id = int(job_id)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == job_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+job_cache = JobCache()
+
+
+def get_owned_job(job_id: int, username: str, temp_jobs: Optional[Dict] = None) -> Optional[Dict]:
+    """The job record if `username` owns it, else None. `temp_jobs` is the
+    session's temp_jobs mapping, consulted when the database has no such job
+    or cannot be reached. The record is a copy; callers may modify it.
+    """
+    job = job_cache.get(job_id, username)
+    if job is None:
+        try:
+            job = get_job_by_id(job_id)
+        except Error as e:
+            # Temp jobs are created exactly when the database is down
+            logger.warning("Job %s lookup failed, checking session temp jobs: %s", job_id, e)
+            job = None
+        if job:
+            if job["username"] != username:
+                return None
+            job_cache.put(job_id, username, job)
+    if job:
+        return dict(job)
+    temp = (temp_jobs or {}).get(str(job_id))
+    if temp and temp.get("username") == username:
+        return dict(temp)
+    return None
+
+
+def invalidate_job(job_id) -> None:
+    """Drop a job from this process's cache after it changed."""
+    try:
+        job_cache.invalidate(int(job_id))
+    except (TypeError, ValueError):
+        pass
@@ -0,0 +1,305 @@
+import os
+import json
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+MAX_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _task_id(kind, key):
+    return f"{kind}:{key}"
+
+
+class JobQueue:
+    """Persistent job queue and status table stored in a local SQLite file.
+
+    Every web worker on the host shares the same file; claims are made inside
+    an IMMEDIATE transaction so a job is only ever picked up once.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    task_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    job_id INTEGER,
+                    username TEXT,
+                    status TEXT NOT NULL,
+                    payload TEXT,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    claimed_by TEXT,
+                    claim TEXT,
+                    created_at TEXT,
+                    started_at TEXT,
+                    finished_at TEXT
+                )
+                """
+            )
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "claim" not in columns:  # queue files created before claims were tokened
+                conn.execute("ALTER TABLE jobs ADD COLUMN claim TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ("payload", "result"):
+            job[key] = json.loads(job[key]) if job.get(key) else None
+        return job
+
+    def enqueue(self, kind, key, payload, job_id=None, username=None):
+        """Queue a task, replacing any previous entry with the same kind/key."""
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO jobs
+                (task_id, kind, job_id, username, status, payload, attempts, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, 0, ?)
+                """,
+                (_task_id(kind, key), kind, job_id, username, STATUS_QUEUED, json.dumps(payload), _now()),
+            )
+        finally:
+            conn.close()
+        return _task_id(kind, key)
+
+    def claim_next(self, worker_name):
+        """Atomically move the oldest queued task to running and return it."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at, rowid LIMIT 1",
+                (STATUS_QUEUED,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            claim = uuid.uuid4().hex
+            conn.execute(
+                """
+                UPDATE jobs SET status = ?, claimed_by = ?, claim = ?, started_at = ?, attempts = attempts + 1
+                WHERE task_id = ?
+                """,
+                (STATUS_RUNNING, worker_name, claim, _now(), row["task_id"]),
+            )
+            conn.execute("COMMIT")
+            task = self._to_dict(row)
+            task.update(status=STATUS_RUNNING, claimed_by=worker_name, claim=claim)
+            return task
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def mark_done(self, task, result):
+        self._finish(task, STATUS_DONE, result=result)
+
+    def mark_failed(self, task, error):
+        self._finish(task, STATUS_FAILED, error=error)
+
+    def _finish(self, task, status, result=None, error=None):
+        """Record the outcome of a claimed task (as returned by claim_next).
+        Only the entry that was claimed is updated: if the task was replaced
+        by enqueue() while it ran, the newer entry keeps its own state.
+        """
+        conn = self._connect()
+        try:
+            updated = conn.execute(
+                """
+                UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?
+                WHERE task_id = ? AND status = ? AND claim = ?
+                """,
+                (status, json.dumps(result) if result is not None else None, error, _now(),
+                 task["task_id"], STATUS_RUNNING, task["claim"]),
+            ).rowcount
+        finally:
+            conn.close()
+        if not updated:
+            logger.info("Task %s was replaced while it ran; dropping its %s outcome", task["task_id"], status)
+
+    def get(self, kind, key):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE task_id = ?", (_task_id(kind, key),)).fetchone()
+        finally:
+            conn.close()
+        return self._to_dict(row)
+
+    def delete(self, kind, key):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM jobs WHERE task_id = ?", (_task_id(kind, key),))
+        finally:
+            conn.close()
+
+    def requeue_stale(self, host):
+        """Requeue tasks left running by dead processes on this host.
+        Tasks that already used up MAX_ATTEMPTS are marked failed instead.
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT task_id, claimed_by, attempts FROM jobs WHERE status = ?", (STATUS_RUNNING,)
+            ).fetchall()
+            for row in rows:
+                owner_host, _, pid = (row["claimed_by"] or "").rpartition(":")
+                if owner_host != host or not pid.isdigit() or _pid_alive(int(pid)):
+                    continue
+                if row["attempts"] >= MAX_ATTEMPTS:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE task_id = ?",
+                        (STATUS_FAILED, "Worker exited before the job finished", _now(), row["task_id"]),
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, claimed_by = NULL WHERE task_id = ?",
+                        (STATUS_QUEUED, row["task_id"]),
+                    )
+        finally:
+            conn.close()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobRunner:
+    """Polls a JobQueue and executes tasks on a local process pool.
+
+    `handlers` maps a task kind to a picklable callable taking the payload and
+    returning a JSON-serialisable result dict. `observer`, if given, is called
+    in this process as observer(kind, status, result) when a task finishes.
+    """
+
+    def __init__(self, queue, handlers, workers=1, poll_interval=1.0, observer=None):
+        self.queue = queue
+        self.handlers = handlers
+        self.observer = observer
+        self.workers = max(1, int(workers))
+        self.poll_interval = poll_interval
+        self.host = socket.gethostname()
+        self._pool = None
+        self._thread = None
+        self._slots = threading.Semaphore(self.workers)
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def worker_name(self):
+        return f"{self.host}:{os.getpid()}"
+
+    def start(self):
+        """Start the polling thread (idempotent, safe to call per process)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self.queue.requeue_stale(self.host)
+            self._pool = self._new_pool()
+            self._thread = threading.Thread(target=self._poll_loop, name="job-runner", daemon=True)
+            self._thread.start()
+
+    def _new_pool(self):
+        # spawn keeps the pool independent of the web worker's threads/locks
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def notify(self):
+        """Wake the poller immediately, e.g. right after enqueueing a task."""
+        self._wakeup.set()
+
+    def _poll_loop(self):
+        while True:
+            self._slots.acquire()
+            try:
+                task = self.queue.claim_next(self.worker_name)
+            except Exception:
+                task = None
+                logger.exception("Could not claim the next job")
+            if task is None:
+                self._slots.release()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._dispatch(task)
+
+    def _dispatch(self, task):
+        handler = self.handlers.get(task["kind"])
+        if handler is None:
+            self.queue.mark_failed(task, f"No handler for task kind '{task['kind']}'")
+            self._slots.release()
+            return
+        try:
+            try:
+                future = self._pool.submit(handler, task["payload"])
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM kill); replace the pool and retry once
+                self._pool = self._new_pool()
+                future = self._pool.submit(handler, task["payload"])
+        except Exception as e:
+            self.queue.mark_failed(task, str(e))
+            self._slots.release()
+            return
+        future.add_done_callback(lambda fut, task=task: self._on_done(task, fut))
+
+    def _on_done(self, task, future):
+        try:
+            error = future.exception()
+            if error is None:
+                result = future.result()
+                self.queue.mark_done(task, result)
+                self._observe(task["kind"], STATUS_DONE, result)
+            else:
+                self.queue.mark_failed(task, str(error) or error.__class__.__name__)
+                self._observe(task["kind"], STATUS_FAILED, None)
+        finally:
+            self._slots.release()
+
+    def _observe(self, kind, status, result):
+        if self.observer is None:
+            return
+        try:
+            self.observer(kind, status, result)
+        except Exception:
+            logger.exception("Job observer failed")
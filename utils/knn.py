@@ -0,0 +1,246 @@
+"""Scalable KNN imputation.
+
+Replaces the brute-force all-pairs distance matrix of sklearn's KNNImputer.
+Rows with missing values are grouped by missing pattern. For each frequent
+pattern (at least TREE_MIN_ROWS rows), neighbours are searched among the
+complete rows using only the pattern's observed columns: a cKDTree for
+low-dimensional patterns, otherwise a blocked Euclidean distance
+computation. Rows with rare patterns, which dominate under random
+missingness, are pooled and searched together with blocked nan-Euclidean
+distances (KNNImputer's metric) over the complete rows; on complete donors
+this ranks neighbours exactly as the projected search does. If there are
+not enough complete rows, each column falls back to nan-Euclidean distances
+over the rows that observe it. Receiver rows are processed in batches,
+optionally on several joblib threads, and kd-tree queries likewise
+KNN_BATCH_ROWS at a time. Distance blocks are sized so that a block and the
+temporaries computed from it stay within about KNN_BLOCK_MB per thread.
+Beyond the input, the imputed copy and the donor pool (and its projection
+for the pattern being searched), working memory therefore does not grow
+with the row count. Beyond KNN_MAX_DONORS complete rows, a fixed random
+sample of them serves as the donor pool.
+
+Settings: KNN_JOBS (threads, default 1), KNN_BATCH_ROWS (default 2048),
+KNN_BLOCK_MB (default 64) and KNN_MAX_DONORS (default 100000).
+"""
+import os
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, Tuple
+
+try:
+    from scipy.spatial import cKDTree  # type: ignore
+except Exception:  # pragma: no cover
+    cKDTree = None
+try:
+    from joblib import Parallel, delayed  # type: ignore
+except Exception:  # pragma: no cover
+    Parallel = None
+
+KNN_NEIGHBORS = 3
+KNN_JOBS = int(os.getenv("KNN_JOBS", "1"))
+KNN_BATCH_ROWS = int(os.getenv("KNN_BATCH_ROWS", "2048"))
+KNN_BLOCK_MB = int(os.getenv("KNN_BLOCK_MB", "64"))
+KNN_MAX_DONORS = int(os.getenv("KNN_MAX_DONORS", "100000"))
+# kd-trees stop paying off in higher dimensions; use blocked distances there
+TREE_MAX_DIMS = 16
+# Patterns with few receivers are cheaper to brute-force than to build a tree for
+TREE_MIN_ROWS = 16
+# Live (queries x block) arrays per distance block, counting _merge_topk's
+# candidates, and (block x columns) arrays per donor block
+BLOCK_TEMPS = 6
+NAN_BLOCK_TEMPS = 9
+NAN_DONOR_TEMPS = 3
+
+
+def _merge_topk(best_d, best_i, dist, offset, k):
+    """Fold a (batch x block) distance block into the running k best."""
+    idx = np.broadcast_to(np.arange(offset, offset + dist.shape[1]), dist.shape)
+    cand_d = np.concatenate([best_d, dist], axis=1)
+    cand_i = np.concatenate([best_i, idx], axis=1)
+    keep = np.argpartition(cand_d, k - 1, axis=1)[:, :k] if cand_d.shape[1] > k else np.argsort(cand_d, axis=1)
+    rows = np.arange(len(cand_d))[:, None]
+    return cand_d[rows, keep], cand_i[rows, keep]
+
+
+def _blocked_topk(queries, donors, k, block_elems, nan_aware=False):
+    """k nearest donors per query by blocked distance computation. With
+    `nan_aware` the distance is KNNImputer's nan-Euclidean (coordinates
+    present in both rows, rescaled by the share present).
+    """
+    k = min(k, len(donors))
+    best_d = np.full((len(queries), 0), np.inf)
+    best_i = np.zeros((len(queries), 0), dtype=np.int64)
+    per_donor = len(queries) * (NAN_BLOCK_TEMPS if nan_aware else BLOCK_TEMPS)
+    per_donor += donors.shape[1] * (NAN_DONOR_TEMPS if nan_aware else 1)
+    step = max(1, block_elems // max(per_donor, 1))
+    if nan_aware:
+        q_mask = ~np.isnan(queries)
+        q0 = np.where(q_mask, queries, 0.0)
+    else:
+        q_sq = (queries * queries).sum(axis=1)[:, None]
+    for start in range(0, len(donors), step):
+        block = donors[start:start + step]
+        if nan_aware:
+            d_mask = ~np.isnan(block)
+            d0 = np.where(d_mask, block, 0.0)
+            present = q_mask.astype(np.float64) @ d_mask.T
+            sq = (q0 * q0) @ d_mask.T + q_mask @ (d0 * d0).T - 2.0 * (q0 @ d0.T)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                dist = np.where(present > 0, np.maximum(sq, 0.0) * queries.shape[1] / present, np.inf)
+        else:
+            dist = q_sq + (block * block).sum(axis=1)[None, :] - 2.0 * (queries @ block.T)
+        best_d, best_i = _merge_topk(best_d, best_i, dist, start, k)
+    return best_d, best_i
+
+
+def _neighbours(queries, donors, k, block_elems, tree=None, workers=1):
+    if tree is not None:
+        _, idx = tree.query(queries, k=k, workers=workers)
+        return idx.reshape(len(queries), -1)
+    return _blocked_topk(queries, donors, k, block_elems)[1]
+
+
+def _run_batches(func, n_rows, batch_rows, n_jobs):
+    batches = [slice(s, s + batch_rows) for s in range(0, n_rows, batch_rows)]
+    if n_jobs > 1 and Parallel is not None and len(batches) > 1:
+        # Threads share the donor arrays; NumPy/BLAS and cKDTree release the GIL
+        return Parallel(n_jobs=n_jobs, prefer="threads")(delayed(func)(b) for b in batches)
+    return [func(b) for b in batches]
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    except Exception:  # pragma: no cover
+        return None
+
+
+def knn_impute(X: np.ndarray, k: int = KNN_NEIGHBORS, n_jobs: int = KNN_JOBS,
+               batch_rows: int = KNN_BATCH_ROWS, block_mb: int = KNN_BLOCK_MB,
+               max_donors: int = KNN_MAX_DONORS) -> Tuple[np.ndarray, Dict]:
+    """Impute NaNs in the float matrix `X` with the mean of each row's `k`
+    nearest neighbours. Returns (imputed copy, info) where info reports
+    rows, values and patterns imputed, donors, seconds, the working-memory
+    bound and the process peak RSS.
+    """
+    started = time.perf_counter()
+    X = np.array(X, dtype=np.float64)
+    missing = np.isnan(X)
+    n, p = X.shape
+    block_elems = max(1, block_mb * 1024 * 1024 // 8)
+    with np.errstate(invalid="ignore"):
+        col_means = np.where(missing.all(axis=0), np.nan, np.nanmean(np.where(missing.all(axis=0), 0.0, X), axis=0))
+
+    receivers = np.flatnonzero(missing.any(axis=1))
+    complete = np.flatnonzero(~missing.any(axis=1))
+    if max_donors and len(complete) > max_donors:
+        complete = np.sort(np.random.default_rng(0).choice(complete, max_donors, replace=False))
+    out = X.copy()
+    info = {"rows": int(len(receivers)), "values": int(missing.sum()), "patterns": 0, "trees": 0,
+            "donors": int(len(complete))}
+    if len(receivers):
+        keys = np.packbits(missing[receivers], axis=1)
+        _, pattern_of = np.unique(keys, axis=0, return_inverse=True)
+        pattern_of = pattern_of.ravel()
+        counts = np.bincount(pattern_of)
+        info["patterns"] = int(len(counts))
+        groups = np.split(receivers[np.argsort(pattern_of, kind="stable")], np.cumsum(counts)[:-1])
+        enough_donors = len(complete) >= k
+        X_complete = X[complete] if enough_donors else None
+        rare = []
+        for rows in groups:
+            miss_cols = np.flatnonzero(missing[rows[0]])
+            obs_cols = np.flatnonzero(~missing[rows[0]])
+            if not len(obs_cols):
+                out[np.ix_(rows, miss_cols)] = col_means[miss_cols]
+                continue
+            if enough_donors and len(rows) < TREE_MIN_ROWS:
+                rare.append(rows)
+                continue
+            if enough_donors:
+                donors = X_complete[:, obs_cols]
+                tree = None
+                if cKDTree is not None and len(obs_cols) <= TREE_MAX_DIMS:
+                    tree = cKDTree(donors)
+                    info["trees"] += 1
+                donor_values = X_complete[:, miss_cols]
+
+                def fill(batch, rows=rows, obs_cols=obs_cols, donors=donors, donor_values=donor_values):
+                    idx = _neighbours(X[np.ix_(rows[batch], obs_cols)], donors, k, block_elems)
+                    return batch, donor_values[idx].mean(axis=1)
+
+                if tree is not None:
+                    # cKDTree parallelises its own queries
+                    for start in range(0, len(rows), batch_rows):
+                        part = rows[start:start + batch_rows]
+                        idx = _neighbours(X[np.ix_(part, obs_cols)], donors, k, block_elems, tree,
+                                          workers=max(1, n_jobs))
+                        out[np.ix_(part, miss_cols)] = donor_values[idx].mean(axis=1)
+                    continue
+                for batch, values in _run_batches(fill, len(rows), batch_rows, n_jobs):
+                    out[np.ix_(rows[batch], miss_cols)] = values
+                continue
+            # Too few complete rows: per column, nan-Euclidean over rows observing it
+            for col in miss_cols:
+                donor_rows = np.flatnonzero(~missing[:, col])
+                if not len(donor_rows):
+                    continue
+                donors = X[donor_rows]
+
+                def fill_col(batch, rows=rows, donors=donors, donor_rows=donor_rows, col=col):
+                    dist, idx = _blocked_topk(X[rows[batch]], donors, k, block_elems, nan_aware=True)
+                    values = X[donor_rows[idx], col]
+                    values = np.where(np.isfinite(dist), values, np.nan)
+                    with np.errstate(invalid="ignore"):
+                        filled = np.nanmean(np.where(np.isnan(values), np.nan, values), axis=1) if values.size else values
+                    return batch, np.where(np.isnan(filled), col_means[col], filled)
+
+                for batch, values in _run_batches(fill_col, len(rows), batch_rows, n_jobs):
+                    out[rows[batch], col] = values
+
+        if rare:
+            # Rare patterns share one search over the complete rows: the
+            # nan-Euclidean distance only uses each receiver's observed columns
+            rare_rows = np.concatenate(rare)
+
+            def fill_rare(batch):
+                rows = rare_rows[batch]
+                idx = _blocked_topk(X[rows], X_complete, k, block_elems, nan_aware=True)[1]
+                return rows, X_complete[idx].mean(axis=1)
+
+            for rows, values in _run_batches(fill_rare, len(rare_rows), batch_rows, n_jobs):
+                out[rows] = np.where(missing[rows], values, X[rows])
+
+    info["seconds"] = time.perf_counter() - started
+    info["memory_bound_mb"] = block_mb * max(1, n_jobs)
+    info["peak_rss_mb"] = _peak_rss_mb()
+    return out, info
+
+
+def knn_impute_frame(df: pd.DataFrame, columns=None, k: int = KNN_NEIGHBORS) -> Dict:
+    """KNN-impute the numeric `columns` of `df` in place. Returns the info
+    dict from knn_impute.
+    """
+    if columns is None:
+        columns = df.select_dtypes(include=np.number).columns
+    columns = [col for col in columns if df[col].notna().any()]
+    if not columns:
+        return {"rows": 0, "values": 0, "patterns": 0, "trees": 0, "donors": 0, "seconds": 0.0,
+                "memory_bound_mb": 0, "peak_rss_mb": _peak_rss_mb()}
+    imputed, info = knn_impute(df[columns].to_numpy(dtype=np.float64, na_value=np.nan), k=k)
+    for i, col in enumerate(columns):
+        if df[col].isna().any():
+            df[col] = imputed[:, i]
+    return info
+
+
+def knn_log(info: Dict) -> str:
+    rss = f", peak RSS {info['peak_rss_mb']:.0f} MB" if info.get("peak_rss_mb") else ""
+    return (
+        f"KNN imputation: {info['values']} values in {info['rows']} rows "
+        f"({info['patterns']} missing patterns, {info['donors']} donors) in {info['seconds']:.2f}s, "
+        f"working memory <= {info['memory_bound_mb']} MB{rss}"
+    )
@@ -0,0 +1,381 @@
+"""Stage instrumentation and Prometheus-style metrics.
+
+A Trace records one span per pipeline stage:
+
+    trace = Trace()
+    with trace.span("read_input") as span:
+        df = read_input(filepath)
+        span.rows_out = len(df)
+
+Each span has wall and CPU time, rows in/out and the RSS change over the
+stage. The peak RSS is the process high-water mark, reset at the start of
+each span on Linux. CPU time covers this process and its threads but not
+the cleaning pool's processes (utils.parallel). Spans are stored with the
+job (processing_jobs.metrics_json and the queue result) and rendered in
+the report.
+
+The registry holds counters and histograms: request latency per route, and
+job/stage durations fed from finished job results. render() gives the
+Prometheus text format served on /metrics. With several web workers a scrape
+only reaches one of them, so the app shares the registry through a directory
+(Registry.share, METRICS_DIR): every process writes a snapshot of its series
+there at most every METRICS_FLUSH_SECONDS, and render() sums the snapshots of
+all processes, including exited ones, so counters never go backwards. Clear
+the directory when deploying to start the series from zero.
+"""
+import atexit
+import glob
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "1"))
+
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0) if hasattr(os, "sysconf") else 0.0
+
+
+# -- memory -----------------------------------------------------------------
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss_mb() -> float:
+    """High-water mark of this process (since the last reset_peak_rss)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS; never reset
+    scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+# -- spans ------------------------------------------------------------------
+
+class Span:
+    def __init__(self, name: str, rows_in: Optional[int] = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out: Optional[int] = None
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.rss_delta_mb: Optional[float] = None
+        self.peak_rss_mb: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def as_dict(self) -> Dict:
+        return {
+            "stage": self.name,
+            "seconds": round(self.seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rss_delta_mb": None if self.rss_delta_mb is None else round(self.rss_delta_mb, 2),
+            "peak_rss_mb": None if self.peak_rss_mb is None else round(self.peak_rss_mb, 2),
+            "error": self.error,
+        }
+
+
+class _SpanContext:
+    def __init__(self, trace: "Trace", span: Span):
+        self.trace, self.span = trace, span
+
+    def __enter__(self) -> Span:
+        reset_peak_rss()
+        self._rss = rss_mb()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self.span
+        span.seconds = time.perf_counter() - self._wall
+        span.cpu_seconds = time.process_time() - self._cpu
+        rss = rss_mb()
+        if rss is not None and self._rss is not None:
+            span.rss_delta_mb = rss - self._rss
+        span.peak_rss_mb = peak_rss_mb()
+        if exc_type is not None:
+            span.error = exc_type.__name__
+        self.trace.spans.append(span)
+        return False
+
+
+class Trace:
+    """Ordered spans of one job. Spans do not nest."""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+
+    def span(self, name: str, rows_in: Optional[int] = None) -> _SpanContext:
+        return _SpanContext(self, Span(name, rows_in))
+
+    def as_list(self) -> List[Dict]:
+        return [span.as_dict() for span in self.spans]
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_list())
+
+
+def job_spans(job: Dict) -> List[Dict]:
+    """Spans of a job record: the queue result ("metrics") or the stored
+    metrics_json column.
+    """
+    spans = job.get("metrics")
+    if spans is None and job.get("metrics_json"):
+        try:
+            spans = json.loads(job["metrics_json"])
+        except (TypeError, ValueError):
+            spans = None
+    return spans or []
+
+
+# -- registry ---------------------------------------------------------------
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _no_change():
+    pass
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+        self._changed = _no_change
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        self._changed()
+
+    def state(self) -> Dict[Tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(into: Dict, key: Tuple, value) -> None:
+        into[key] = into.get(key, 0.0) + value
+
+    def render(self, state: Optional[Dict] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        items = sorted((self.state() if state is None else state).items())
+        lines.extend(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = HTTP_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+        self._changed = _no_change
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+        self._changed()
+
+    def state(self) -> Dict[Tuple, Tuple[List[int], float]]:
+        """Per label set: (bucket counts with +Inf last, sum)."""
+        with self._lock:
+            return {key: (list(counts), total[0]) for key, (counts, total) in self._series.items()}
+
+    @staticmethod
+    def merge(into: Dict, key: Tuple, value) -> None:
+        counts, total = value
+        if key in into:
+            have, have_total = into[key]
+            if len(have) != len(counts):  # buckets changed between deploys
+                return
+            counts = [a + b for a, b in zip(have, counts)]
+            total += have_total
+        into[key] = (list(counts), total)
+
+    def render(self, state: Optional[Dict] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        items = sorted((key, counts, total) for key, (counts, total)
+                       in (self.state() if state is None else state).items())
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List = []
+        self.directory: Optional[str] = None
+        self.flush_seconds = METRICS_FLUSH_SECONDS
+        self._dirty = threading.Event()
+        self._flusher_pid: Optional[int] = None
+        self._file: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        metric._changed = self._changed
+        self.metrics.append(metric)
+        return metric
+
+    def share(self, directory: str, flush_seconds: float = METRICS_FLUSH_SECONDS):
+        """Aggregate this registry with every other process sharing `directory`."""
+        os.makedirs(directory, exist_ok=True)
+        self.directory, self.flush_seconds = directory, flush_seconds
+        atexit.register(self.flush)
+
+    def _changed(self):
+        if self.directory is None:
+            return
+        self._dirty.set()
+        if self._flusher_pid != os.getpid():
+            with self._lock:
+                if self._flusher_pid != os.getpid():
+                    self._flusher_pid = os.getpid()
+                    threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def _path(self) -> str:
+        # One file per process lifetime: a reused pid must not overwrite the
+        # totals of the process that exited
+        if self._file is None or not self._file.startswith(f"{os.getpid()}-"):
+            self._file = f"{os.getpid()}-{time.time_ns()}.json"
+        return os.path.join(self.directory, self._file)
+
+    def flush(self):
+        """Write this process's snapshot to the shared directory."""
+        if self.directory is None:
+            return
+        with self._lock:
+            self._dirty.clear()
+            snapshot = {
+                metric.name: [[list(key), value] for key, value in metric.state().items()]
+                for metric in self.metrics
+            }
+            path = self._path()
+            tmp = f"{path}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp, path)
+            except OSError:
+                pass
+
+    def _merged(self) -> Dict[str, Dict]:
+        self.flush()
+        by_name = {metric.name: metric for metric in self.metrics}
+        merged: Dict[str, Dict] = {name: {} for name in by_name}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, series in snapshot.items():
+                metric = by_name.get(name)
+                if metric is None:
+                    continue
+                for key, value in series:
+                    if isinstance(value, list):
+                        value = (value[0], value[1])
+                    metric.merge(merged[name], tuple(key), value)
+        return merged
+
+    def render(self) -> str:
+        merged = self._merged() if self.directory is not None else {}
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render(merged.get(metric.name)))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+http_request_seconds = REGISTRY.register(Histogram(
+    "survey_http_request_duration_seconds", "Request latency by route.", ("method", "route", "status")
+))
+jobs_total = REGISTRY.register(Counter("survey_jobs_total", "Finished background jobs.", ("kind", "status")))
+job_stage_seconds = REGISTRY.register(Histogram(
+    "survey_job_stage_duration_seconds", "Wall time of processing stages.", ("stage",), STAGE_BUCKETS
+))
+job_stage_cpu_seconds = REGISTRY.register(Counter(
+    "survey_job_stage_cpu_seconds_total", "CPU time of processing stages (job process only).", ("stage",)
+))
+job_stage_rows = REGISTRY.register(Counter(
+    "survey_job_stage_rows_total", "Rows entering processing stages.", ("stage",)
+))
+job_peak_rss_bytes = REGISTRY.register(Histogram(
+    "survey_job_peak_rss_bytes", "Peak RSS of the job process over a job.", ("kind",),
+    tuple(mb * 1024 * 1024 for mb in (64, 128, 256, 512, 1024, 2048, 4096, 8192)),
+))
+
+
+def observe_job(kind: str, status: str, result: Optional[Dict] = None):
+    """Record a finished job (JobRunner observer) and its spans."""
+    jobs_total.inc(kind=kind, status=status)
+    spans = (result or {}).get("metrics") or []
+    for span in spans:
+        job_stage_seconds.observe(span["seconds"], stage=span["stage"])
+        job_stage_cpu_seconds.inc(span["cpu_seconds"], stage=span["stage"])
+        if span.get("rows_in") is not None:
+            job_stage_rows.inc(span["rows_in"], stage=span["stage"])
+    peaks = [span["peak_rss_mb"] for span in spans if span.get("peak_rss_mb") is not None]
+    if peaks:
+        job_peak_rss_bytes.observe(max(peaks) * 1024 * 1024, kind=kind)
@@ -0,0 +1,172 @@
+"""Versioned schema migrations for the MySQL database.
+
+MIGRATIONS is an append-only list of (version, description, steps). A step
+is an SQL statement or a callable taking a cursor, for changes MySQL cannot
+express idempotently (ADD COLUMN/INDEX IF NOT EXISTS). Applied versions are
+recorded in schema_migrations. migrate() runs the pending ones in order
+under a named lock, so concurrently booting workers apply each version
+once. It is run by setup_db.py and, unless DB_MIGRATE_ON_BOOT=0, when the
+app starts.
+
+Never edit a released migration; add a new version instead.
+"""
+import logging
+from typing import Callable, List, Sequence, Tuple, Union
+from utils.usage import rebuild_usage
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = "survey_app_schema_migrations"
+LOCK_TIMEOUT = 60
+
+Step = Union[str, Callable]
+
+
+def add_column(table: str, column: str, definition: str) -> Callable:
+    def step(cursor):
+        cursor.execute(
+            "SELECT 1 FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+            (table, column),
+        )
+        if not cursor.fetchall():
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+def add_index(table: str, name: str, columns: str) -> Callable:
+    def step(cursor):
+        cursor.execute(
+            "SELECT 1 FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+            (table, name),
+        )
+        if not cursor.fetchall():
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+    return step
+
+
+MIGRATIONS: List[Tuple[int, str, Sequence[Step]]] = [
+    (1, "users and processing_jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(100) UNIQUE,
+            email VARCHAR(255) UNIQUE,
+            password VARCHAR(255),
+            role ENUM('user','admin') DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS processing_jobs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(100),
+            uploaded_filename VARCHAR(255),
+            rows_before INT,
+            rows_after INT,
+            impute_method VARCHAR(50),
+            outlier_method VARCHAR(50),
+            weight_col VARCHAR(100),
+            violations_count INT DEFAULT 0,
+            display_name VARCHAR(255),
+            is_saved BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (username) REFERENCES users(username) ON DELETE CASCADE
+        )
+        """,
+    ]),
+    (2, "processing_jobs.metrics_json (stage spans)", [
+        add_column("processing_jobs", "metrics_json", "TEXT AFTER violations_count"),
+    ]),
+    (3, "processing_jobs (username, created_at) index for job listings", [
+        add_index("processing_jobs", "idx_jobs_user_created", "username, created_at"),
+    ]),
+    (4, "usage_daily and usage_users aggregates (utils.usage)", [
+        add_column("processing_jobs", "bytes_uploaded", "BIGINT DEFAULT 0 AFTER violations_count"),
+        """
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            username VARCHAR(100) NOT NULL,
+            day DATE NOT NULL,
+            runs INT NOT NULL DEFAULT 0,
+            rows_processed BIGINT NOT NULL DEFAULT 0,
+            violations BIGINT NOT NULL DEFAULT 0,
+            bytes_uploaded BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, day),
+            INDEX idx_usage_daily_day (day)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS usage_users (
+            username VARCHAR(100) NOT NULL PRIMARY KEY,
+            runs INT NOT NULL DEFAULT 0,
+            rows_processed BIGINT NOT NULL DEFAULT 0,
+            violations BIGINT NOT NULL DEFAULT 0,
+            bytes_uploaded BIGINT NOT NULL DEFAULT 0,
+            INDEX idx_usage_users_runs (runs)
+        )
+        """,
+        rebuild_usage,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def current_version(conn) -> int:
+    """Highest applied version (0 for a database without migrations)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'schema_migrations'"
+        )
+        if not cursor.fetchall():
+            return 0
+        cursor.execute("SELECT MAX(version) FROM schema_migrations")
+        return int(cursor.fetchall()[0][0] or 0)
+    finally:
+        cursor.close()
+
+
+def migrate(conn) -> List[int]:
+    """Apply pending migrations in order; returns the versions applied."""
+    cursor = conn.cursor()
+    applied: List[int] = []
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+        if cursor.fetchall()[0][0] != 1:
+            raise RuntimeError("Timed out waiting for the schema migration lock")
+        try:
+            _ensure_table(cursor)
+            cursor.execute("SELECT version FROM schema_migrations")
+            done = {row[0] for row in cursor.fetchall()}
+            for version, description, steps in MIGRATIONS:
+                if version in done:
+                    continue
+                logger.info("Applying schema migration %s: %s", version, description)
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)", (version, description)
+                )
+                conn.commit()
+                applied.append(version)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+    return applied
@@ -0,0 +1,237 @@
+"""Process-parallel execution of the per-column cleaning steps.
+
+The numeric columns are copied once into a column-major float64 matrix in
+shared memory. Worker processes attach to it by name and handle a shard of
+columns each, so column data is never pickled:
+- column_stats computes ColumnStats. In exact mode each worker sorts its
+  columns into a second shared buffer.
+- clean_columns imputes and clips in place and ORs its outlier flags into a
+  shared per-shard mask.
+Small frames, and CLEAN_WORKERS=1 (the default), run serially in the
+calling process, where pool start-up and copying would dominate.
+
+Settings: CLEAN_WORKERS (processes, default 1) and PARALLEL_MIN_CELLS (rows x
+columns below which the serial path is used, default 2000000).
+"""
+import multiprocessing
+import multiprocessing.util
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+from utils.colstats import ColumnStats, STATS_MODE
+
+CLEAN_WORKERS = int(os.getenv("CLEAN_WORKERS", "1"))
+PARALLEL_MIN_CELLS = int(os.getenv("PARALLEL_MIN_CELLS", "2000000"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool reused across jobs of this process, so its start-up is
+    paid once.
+    """
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        # spawn, like utils.jobs: workers do not inherit the caller's threads/locks
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _pool_workers = workers
+    return _pool
+
+
+def _shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+
+
+# A Finalize rather than atexit: job workers are multiprocessing children,
+# which skip atexit handlers but would wait forever on this pool's idle
+# workers. It must run before the pool's own queue finalizers (priority 10).
+multiprocessing.util.Finalize(None, _shutdown_pool, exitpriority=100)
+
+
+def use_parallel(df: pd.DataFrame, columns, workers: int = CLEAN_WORKERS) -> bool:
+    return workers > 1 and len(columns) > 1 and len(df) * len(columns) >= PARALLEL_MIN_CELLS
+
+
+class SharedMatrix:
+    """A float64 (or other dtype) array in shared memory, described to
+    workers by a picklable spec.
+    """
+
+    def __init__(self, shape, dtype=np.float64, order="F", spec=None):
+        self.shape, self.dtype, self.order = tuple(shape), np.dtype(dtype), order
+        nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        if spec is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=spec[0])
+            self.owner = False
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf, order=self.order)
+
+    @property
+    def spec(self):
+        return (self.shm.name, self.shape, self.dtype.str, self.order)
+
+    @classmethod
+    def attach(cls, spec) -> "SharedMatrix":
+        return cls(spec[1], spec[2], spec[3], spec=spec)
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _shards(n_columns: int, workers: int) -> List[List[int]]:
+    return [shard for shard in np.array_split(np.arange(n_columns), min(workers, n_columns)) if len(shard)]
+
+
+# -- worker tasks (top level so they can be pickled) ------------------------
+
+def _stats_task(spec, shard, mode, sorted_spec):
+    data = SharedMatrix.attach(spec)
+    out = SharedMatrix.attach(sorted_spec) if sorted_spec else None
+    try:
+        results = []
+        for j in shard:
+            st = ColumnStats(mode).update(data.array[:, j])
+            if out is not None:
+                values = st.sorted_values()
+                out.array[:len(values), j] = values
+                st.set_sorted(np.empty(0))  # returned through shared memory
+            results.append((j, st))
+        return results
+    finally:
+        data.close()
+        if out is not None:
+            out.close()
+
+
+def _clean_task(spec, shard, fills, bounds, clip_limits, mask_spec, mask_col):
+    data = SharedMatrix.attach(spec)
+    mask = SharedMatrix.attach(mask_spec) if mask_spec else None
+    try:
+        changed = []
+        for j in shard:
+            values = data.array[:, j]
+            touched = False
+            if j in fills:
+                missing = np.isnan(values)
+                if missing.any():
+                    values[missing] = fills[j]
+                    touched = True
+            if mask is not None and j in bounds:
+                lower, upper = bounds[j]
+                flags = mask.array[:, mask_col]
+                with np.errstate(invalid="ignore"):
+                    flags |= (values < lower) | (values > upper)
+            if j in clip_limits:
+                np.clip(values, clip_limits[j][0], clip_limits[j][1], out=values)
+                touched = True
+            if touched:
+                changed.append(j)
+        return changed
+    finally:
+        data.close()
+        if mask is not None:
+            mask.close()
+
+
+# -- caller side ------------------------------------------------------------
+
+class ParallelColumns:
+    """Numeric columns of `df` in shared memory, processed by `workers`
+    processes. Use as a context manager; write_back() copies modified
+    columns into the frame.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns, workers: int = CLEAN_WORKERS):
+        self.columns = list(columns)
+        self.workers = workers
+        self.data = SharedMatrix((len(df), len(self.columns)))
+        for j, col in enumerate(self.columns):
+            self.data.array[:, j] = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        self.changed: set = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.data.close()
+
+    def _map(self, task, *args):
+        pool = _get_pool(self.workers)
+        futures = [pool.submit(task, self.data.spec, list(map(int, shard)), *args)
+                   for shard in _shards(len(self.columns), self.workers)]
+        return [f.result() for f in futures]
+
+    def column_stats(self, df: pd.DataFrame, mode: str = STATS_MODE) -> Dict[str, ColumnStats]:
+        """Same result as colstats.compute_column_stats(df, columns, mode)."""
+        exact = mode != "approx"
+        with SharedMatrix(self.data.shape) if exact else _NullContext() as out:
+            results = self._map(_stats_task, mode, out.spec if exact else None)
+            sorted_values = np.array(out.array, order="F") if exact else None
+        stats = {}
+        for j, st in sorted((item for part in results for item in part), key=lambda item: item[0]):
+            col = self.columns[j]
+            st.is_integer = pd.api.types.is_integer_dtype(df[col].dtype)
+            if exact:
+                st.set_sorted(sorted_values[:st.count, j])
+            stats[col] = st
+        return stats
+
+    def clean(self, fills: Dict[str, float], bounds: Dict[str, Tuple[float, float]],
+              clip_limits: Dict[str, Tuple[float, float]], flag_outliers: bool) -> Optional[np.ndarray]:
+        """Impute `fills`, flag rows outside `bounds` (before clipping) and
+        clip to `clip_limits`, all in shared memory. Returns the outlier row
+        mask if `flag_outliers`.
+        """
+        index = {col: j for j, col in enumerate(self.columns)}
+        fills = {index[c]: v for c, v in fills.items() if c in index}
+        bounds = {index[c]: v for c, v in bounds.items() if c in index}
+        clip_limits = {index[c]: v for c, v in clip_limits.items() if c in index}
+        shards = _shards(len(self.columns), self.workers)
+        pool = _get_pool(self.workers)
+        with SharedMatrix((len(self.data.array), len(shards)), np.bool_) if flag_outliers else _NullContext() as mask:
+            if flag_outliers:
+                mask.array[:] = False
+            futures = [
+                pool.submit(_clean_task, self.data.spec, list(map(int, shard)), fills, bounds, clip_limits,
+                            mask.spec if flag_outliers else None, k)
+                for k, shard in enumerate(shards)
+            ]
+            for f in futures:
+                self.changed.update(f.result())
+            return mask.array.any(axis=1) if flag_outliers else None
+
+    def write_back(self, df: pd.DataFrame, columns=None) -> pd.DataFrame:
+        """Copy modified columns (restricted to `columns`) back into df."""
+        for j in sorted(self.changed):
+            col = self.columns[j]
+            if columns is None or col in columns:
+                df[col] = self.data.array[:, j].copy()
+        return df
+
+
+class _NullContext:
+    spec = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
@@ -0,0 +1,103 @@
+import os
+import pandas as pd
+from utils.metrics import Trace
+from utils.plan import CleaningPlan
+from utils.storage import write_processed
+from utils.summary import summarize_dataframe, write_summary, resolve_design, design_log, load_summary
+from utils.weights import design_from_params
+from utils.streaming import should_stream, process_csv_streaming
+from utils.violations import ViolationIndexBuilder
+
+
+def read_input(filepath):
+    """Load an uploaded CSV/Excel file and coerce numeric-like text columns."""
+    if filepath.lower().endswith(".csv"):
+        df = pd.read_csv(filepath)
+    else:
+        df = pd.read_excel(filepath)
+
+    # Coerce numeric-like columns to numeric to avoid downstream errors
+    for column_name in df.columns:
+        if df[column_name].dtype == object:
+            try:
+                df[column_name] = pd.to_numeric(df[column_name])
+            except (ValueError, TypeError):
+                pass
+    return df
+
+
+def process_dataframe(df, params, violations=None, trace=None):
+    """Run the cleaning pipeline configured by `params` (the process form fields).
+    `df` is modified in place where possible. Returns (processed_df, workflow_logs).
+    """
+    return CleaningPlan.from_params(params).run(df, violations, trace)
+
+
+def run_processing_job(payload):
+    """Background entry point for a queued `/process-form` submission.
+
+    payload keys: job_id, filepath, output_path, summary_path, violations_path,
+    params, persisted. Writes the processed output (see utils.storage), its
+    summary artifact (see utils.summary) and violation index (see
+    utils.violations), updates the job record and returns the result dict
+    stored on the queue entry. Its "metrics" are the stage spans (see
+    utils.metrics), also stored on the job record.
+    """
+    filepath = payload["filepath"]
+    output_path = payload["output_path"]
+    summary_path = payload.get("summary_path")
+    violations_path = payload.get("violations_path")
+    params = payload.get("params", {})
+
+    # A previous artifact no longer describes this job's output
+    if summary_path and os.path.exists(summary_path):
+        os.remove(summary_path)
+    violations = ViolationIndexBuilder()
+    trace = Trace()
+
+    if should_stream(filepath, params):
+        # Large CSVs: chunked passes keep memory bounded by the chunk size
+        rows_before, rows_after, workflow_logs = process_csv_streaming(
+            filepath, output_path, params, summary_path=summary_path, violations=violations, trace=trace
+        )
+    else:
+        with trace.span("read_input") as span:
+            df = read_input(filepath)
+            span.rows_out = len(df)
+        rows_before = len(df)
+
+        df, workflow_logs = process_dataframe(df, params, violations, trace)
+        rows_after = len(df)
+        with trace.span("write_processed", rows_after):
+            write_processed(df, output_path)
+        if summary_path:
+            with trace.span("summary", rows_after):
+                design, warnings = resolve_design(design_from_params(params), df.columns)
+                workflow_logs.extend(warnings)
+                write_summary(summary_path, summarize_dataframe(df, design=design), output_path)
+
+    if summary_path:
+        summary = load_summary(summary_path, output_path)
+        line = design_log(summary) if summary else None
+        if line:
+            workflow_logs.append(line)
+
+    if violations_path:
+        with trace.span("violation_index"):
+            violations.write(violations_path)
+    # Total (row, rule) violations; the index has them row by row
+    violations_count = violations.total
+
+    if payload.get("persisted"):
+        from utils.db_mysql import update_job_results
+
+        update_job_results(payload["job_id"], rows_before, rows_after, violations_count, trace.to_json())
+
+    return {
+        "job_id": payload["job_id"],
+        "rows_before": rows_before,
+        "rows_after": rows_after,
+        "violations_count": violations_count,
+        "workflow_logs": workflow_logs,
+        "metrics": trace.as_list(),
+    }
@@ -0,0 +1,275 @@
+"""Fused cleaning plan.
+
+A CleaningPlan is built from the process-form parameters, fitted once on the
+column statistics (utils.colstats) and then applied column by column on NumPy
+arrays: imputation, outlier flagging, clipping and weight assignment modify
+the frame in place instead of each stage returning a new DataFrame copy.
+The streaming pipeline applies the same fitted plan to every chunk. Large
+frames can fit and clean their columns on a process pool (utils.parallel).
+"""
+import json
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from utils.colstats import ColumnStats, QUANTILES, compute_column_stats
+from utils.knn import knn_impute_frame, knn_log
+from utils.metrics import Trace
+from utils.parallel import CLEAN_WORKERS, ParallelColumns, use_parallel
+from utils.rules import compile_rules
+from utils.weights import rake_dataframe, rake_log
+
+
+class CleaningPlan:
+    def __init__(self, impute_method="Mean", outlier_method="IQR", outlier_action="winsorize",
+                 weight_col="", rules: Optional[Dict] = None, rules_error: bool = False,
+                 weight_method="column", rake_margins: Optional[Dict] = None, rake_error: bool = False,
+                 trim: Tuple[Optional[float], Optional[float]] = (None, None)):
+        self.impute_method = impute_method or "None"
+        self.outlier_method = outlier_method or "None"
+        self.outlier_action = outlier_action or "winsorize"
+        self.weight_col = weight_col or ""
+        self.rules = rules or {}
+        self.rules_error = rules_error
+        # Compiled once, evaluated per frame or chunk
+        self.rule_set = compile_rules(self.rules) if self.rules else None
+        self.weight_method = weight_method or "column"
+        self.rake_margins = rake_margins or {}
+        self.rake_error = rake_error
+        self.trim = trim
+        self.columns: List[str] = []
+        self.fills: Dict[str, float] = {}
+        self.bounds: Dict[str, Tuple[float, float]] = {}
+        self.clip_limits: Dict[str, Tuple[float, float]] = {}
+
+    @classmethod
+    def from_params(cls, params: Dict) -> "CleaningPlan":
+        rules_json = params.get("rules_json", "{}")
+        try:
+            rules, rules_error = (json.loads(rules_json) if rules_json else {}), False
+        except json.JSONDecodeError:
+            rules, rules_error = {}, True
+        margins_json = params.get("rake_margins", "")
+        try:
+            rake_margins, rake_error = (json.loads(margins_json) if margins_json else {}), False
+        except json.JSONDecodeError:
+            rake_margins, rake_error = {}, True
+
+        def bound(key):
+            try:
+                return float(params[key]) if params.get(key) not in (None, "") else None
+            except (TypeError, ValueError):
+                return None
+
+        return cls(
+            impute_method=params.get("impute_method", "Mean"),
+            outlier_method=params.get("outlier_method", "IQR"),
+            outlier_action=params.get("outlier_action", "winsorize"),
+            weight_col=params.get("weight_col", ""),
+            rules=rules,
+            rules_error=rules_error,
+            weight_method=params.get("weight_method", "column"),
+            rake_margins=rake_margins,
+            rake_error=rake_error,
+            trim=(bound("trim_lower"), bound("trim_upper")),
+        )
+
+    @property
+    def imputes(self) -> bool:
+        return self.impute_method != "None"
+
+    @property
+    def detects_outliers(self) -> bool:
+        return self.outlier_method != "None"
+
+    @property
+    def removes_outliers(self) -> bool:
+        return self.detects_outliers and self.outlier_action == "remove"
+
+    @property
+    def rakes(self) -> bool:
+        return self.weight_method == "rake" and bool(self.rake_margins)
+
+    def fit(self, stats: Dict[str, ColumnStats]) -> "CleaningPlan":
+        """Derive fill values, outlier bounds and clip limits from raw-column
+        statistics. Bounds describe the imputed data, as imputation runs first.
+        """
+        self.columns = list(stats)
+        if self.impute_method == "Mean":
+            self.fills = {col: st.mean for col, st in stats.items()}
+        elif self.impute_method == "Median":
+            self.fills = {col: st.quantiles([0.5])[0.5] for col, st in stats.items()}
+        self.fills = {col: v for col, v in self.fills.items() if not np.isnan(v)}
+
+        self.bounds, self.clip_limits = {}, {}
+        if not self.detects_outliers:
+            return self
+        q = {col: st.quantiles(QUANTILES, self.fills.get(col)) for col, st in stats.items()}
+        for col, st in stats.items():
+            if self.outlier_method == "IQR":
+                iqr = q[col][0.75] - q[col][0.25]
+                self.bounds[col] = (q[col][0.25] - 1.5 * iqr, q[col][0.75] + 1.5 * iqr)
+            elif self.outlier_method == "Z-score":
+                # |z| > 3  <=>  value outside mean +/- 3 std (population std)
+                _, mean, std = st.filled(self.fills.get(col))
+                if std and not np.isnan(std):
+                    self.bounds[col] = (mean - 3 * std, mean + 3 * std)
+            elif self.outlier_method == "Winsorize":
+                self.bounds[col] = (q[col][0.01], q[col][0.99])
+            self.clip_limits[col] = (q[col][0.01], q[col][0.99])
+        return self
+
+    def impute(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Fill missing values column by column, in place."""
+        for col, value in self.fills.items():
+            values = df[col].to_numpy()
+            if not np.issubdtype(values.dtype, np.floating):
+                continue  # integer columns cannot hold missing values
+            missing = np.isnan(values)
+            if missing.any():
+                values = values.copy()
+                values[missing] = value
+                df[col] = values
+        return df
+
+    def outlier_mask(self, df: pd.DataFrame) -> np.ndarray:
+        """Rows with any value strictly outside its column's bounds."""
+        mask = np.zeros(len(df), dtype=bool)
+        for col, (lower, upper) in self.bounds.items():
+            values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            with np.errstate(invalid="ignore"):
+                mask |= (values < lower) | (values > upper)
+        return mask
+
+    def clip(self, df: pd.DataFrame, columns=None) -> pd.DataFrame:
+        """Clamp every numeric column (or just `columns`) to its winsorize
+        limits, in place.
+        """
+        for col, (lower, upper) in self.clip_limits.items():
+            if columns is not None and col not in columns:
+                continue
+            if pd.api.types.is_float_dtype(df[col].dtype):
+                values = df[col].to_numpy(copy=True)
+                np.clip(values, lower, upper, out=values)
+                df[col] = values
+            else:
+                # pandas decides whether integer columns stay integral
+                df[col] = df[col].clip(lower=lower, upper=upper)
+        return df
+
+    def _run_parallel(self, df: pd.DataFrame, numeric_cols):
+        """Fit, impute, flag and (when winsorizing) clip the numeric columns
+        across the utils.parallel process pool. Returns (df, outlier mask).
+        """
+        with ParallelColumns(df, numeric_cols) as columns:
+            self.fit(columns.column_stats(df))
+            fills = self.fills if self.impute_method != "KNN" else {}
+            mask = columns.clean(fills, self.bounds, {}, self.detects_outliers)
+            if mask is not None and mask.any() and not self.removes_outliers:
+                # Integer columns are clipped below, where pandas picks the dtype
+                limits = {col: v for col, v in self.clip_limits.items() if pd.api.types.is_float_dtype(df[col].dtype)}
+                columns.clean({}, {}, limits, False)
+                self.clip(df, [col for col in self.clip_limits if col not in limits])
+            columns.write_back(df)
+        return df, mask
+
+    def apply_weights(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.weight_col and self.weight_col in df.columns:
+            df["weight"] = df[self.weight_col]
+        return df
+
+    def rake(self, df: pd.DataFrame):
+        """Calibrate weights to the raking margins, starting from the weight
+        column if one is set. Sets df["weight"]; returns the log lines.
+        """
+        base_col = self.weight_col if self.weight_col in df.columns else None
+        weights, info = rake_dataframe(df, self.rake_margins, base_col, self.trim)
+        df["weight"] = weights
+        return rake_log(self.rake_margins, info)
+
+    def rule_warnings(self) -> List[str]:
+        warnings = ["Warning: Invalid JSON in rules configuration"] if self.rules_error else []
+        if self.rule_set is not None:
+            warnings.extend(f"Warning: invalid rule {error}" for error in self.rule_set.errors)
+        return warnings
+
+    def rule_counts(self, df: pd.DataFrame, violations=None, offset: int = 0):
+        """(column, count, description) per rule check. With `violations`
+        (a violations.ViolationIndexBuilder) the violating rows are recorded,
+        `offset` being the position of df's first row in the output.
+        """
+        if not self.rule_set:
+            return []
+        result = self.rule_set.evaluate(df, bitmap=violations is not None)
+        if violations is not None:
+            violations.add(result, offset)
+        return result.count_list()
+
+    def run(self, df: pd.DataFrame, violations=None, trace: Optional[Trace] = None):
+        """In-memory execution. Returns (processed_df, workflow_logs).
+        Rule violations are recorded in `violations` and stage spans in
+        `trace` (a metrics.Trace), if given.
+        """
+        trace = trace if trace is not None else Trace()
+        workflow_logs = [f"Data loaded: {len(df)} rows, {len(df.columns)} columns"]
+        numeric_cols = df.select_dtypes(include=np.number).columns
+
+        if self.impute_method == "KNN":
+            # KNN fills are row-specific: impute the numeric block first and
+            # fit the remaining steps on the imputed data.
+            with trace.span("knn_impute", len(df)) as span:
+                df = df.copy()
+                knn_info = knn_impute_frame(df, numeric_cols)
+                span.rows_out = len(df)
+
+        if use_parallel(df, numeric_cols):
+            with trace.span("clean_parallel", len(df)) as span:
+                df, mask = self._run_parallel(df, numeric_cols)
+                span.rows_out = len(df)
+            workers = f" ({CLEAN_WORKERS} worker processes)"
+        else:
+            with trace.span("column_stats", len(df)):
+                self.fit(compute_column_stats(df, numeric_cols))
+            if self.impute_method != "KNN":
+                with trace.span("impute", len(df)) as span:
+                    self.impute(df)
+                    span.rows_out = len(df)
+            mask = None
+            if self.detects_outliers:
+                with trace.span("outlier_detection", len(df)):
+                    mask = self.outlier_mask(df)
+            workers = ""
+        if self.imputes:
+            workflow_logs.append(f"Applied {self.impute_method} imputation{workers}")
+        if self.impute_method == "KNN":
+            workflow_logs.append(knn_log(knn_info))
+
+        if mask is not None:
+            outlier_count = int(mask.sum())
+            if outlier_count > 0:
+                with trace.span("outlier_handling", len(df)) as span:
+                    if self.removes_outliers:
+                        # take() returns an independent frame, so later in-place steps are safe
+                        df = df.take(np.flatnonzero(~mask))
+                        workflow_logs.append(f"Removed {outlier_count} outliers using {self.outlier_method}")
+                    else:
+                        if not workers:
+                            self.clip(df)
+                        workflow_logs.append(f"Winsorized {outlier_count} outliers using {self.outlier_method}")
+                    span.rows_out = len(df)
+
+        if self.rake_error:
+            workflow_logs.append("Warning: Invalid JSON in raking margins")
+        if self.rakes:
+            with trace.span("raking", len(df)):
+                workflow_logs.extend(self.rake(df))
+        elif self.weight_col and self.weight_col in df.columns:
+            self.apply_weights(df)
+            workflow_logs.append(f"Applied weights from column: {self.weight_col}")
+
+        workflow_logs.extend(self.rule_warnings())
+        if self.rule_set:
+            with trace.span("rules", len(df)):
+                counts = self.rule_counts(df, violations)
+            workflow_logs.extend(f"{col}: {count} {text}" for col, count, text in counts if count)
+        workflow_logs.append(f"Final dataset: {len(df)} rows")
+        return df, workflow_logs
@@ -1,4 +1,25 @@
+"""Report rendering: histogram images, the HTML report and its PDF.
+
+Histograms are drawn from bin counts (the job summary's, or binned here for
+plot_histograms) with a Gaussian KDE overlay computed on a fixed grid, so
+drawing costs the same whatever the number of rows. With a cache_dir the
+PNGs are stored under it keyed by column, bin data and style, and repeat
+views only read the files. Missing images are rendered on a process pool
+when HIST_WORKERS > 1 (default 1: in this process).
+
+Reports are built by run_report_job on the job runner. Their files are
+named by report_key, a hash of everything that goes into them, so an
+unchanged job, template and renderer reuse the files of the last build.
+"""
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.util
 import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
 import pandas as pd
 import matplotlib
 matplotlib.use('Agg')
@@ -7,54 +28,268 @@ try:
     from weasyprint import HTML  # type: ignore
 except Exception:  # pragma: no cover
     HTML = None
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 import base64
+import glob
+from datetime import datetime
 from io import BytesIO
-import seaborn as sns
+from utils.metrics import job_spans
+from utils.summary import MAX_HIST_BINS, ensure_summary, summary_table, histogram_columns
+from utils.tables import render_table
+
+HIST_WORKERS = int(os.getenv("HIST_WORKERS", "1"))
+KDE_GRID = 256
+# Bump when the drawing code changes so cached images are redrawn
+HIST_STYLE_VERSION = 1
+DEFAULT_HIST_STYLE = {"width": 6.4, "height": 4.8, "dpi": 100, "color": "C0"}
+# Bump when report_context or the HTML/PDF rendering changes
+REPORT_VERSION = 1
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+REPORT_TEMPLATE = "report_template.html"
+# Compiled templates are cached here across processes (default: a per-user
+# directory under the system temp dir)
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR") or None
+# Job fields a report is built from
+REPORT_JOB_FIELDS = (
+    "id", "uploaded_filename", "rows_before", "rows_after", "violations_count",
+    "impute_method", "outlier_method", "weight_col", "metrics", "metrics_json",
+)
+# The subset a report is keyed on: the job's parameters. Results such as the
+# counts and stage metrics change only with the processed output (keyed by
+# its stamp), and may differ between web workers' cached job records.
+REPORT_KEY_FIELDS = ("id", "uploaded_filename", "impute_method", "outlier_method", "weight_col")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, like utils.parallel: workers do not inherit the web worker's threads/locks
+        _pool = ProcessPoolExecutor(max_workers=HIST_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+
 
-def plot_histograms(df, columns):
+multiprocessing.util.Finalize(None, _shutdown_pool, exitpriority=100)
+
+
+def histogram_dir(upload_folder: str, job_id) -> str:
+    return os.path.join(upload_folder, f"histograms_{job_id}")
+
+
+def delete_histograms(upload_folder: str, job_id):
+    shutil.rmtree(histogram_dir(upload_folder, job_id), ignore_errors=True)
+
+
+def _binned_kde(edges, counts, std, grid_size: int = KDE_GRID):
+    """Gaussian KDE (Scott's bandwidth) of histogram bins, scaled to counts
+    like seaborn's kde=True overlay. The bin counts are linearly binned onto a
+    fixed grid and convolved with the kernel by FFT: O(bins + grid log grid).
+    """
+    n = counts.sum()
+    if n < 2 or not std or len(counts) < 2:
+        return None
+    bandwidth = std * n ** (-1.0 / 5.0)
+    grid = np.linspace(edges[0], edges[-1], grid_size)
+    delta = grid[1] - grid[0]
+    # Linear binning: split each bin centre's count between its two grid points
+    pos = ((edges[:-1] + edges[1:]) / 2 - grid[0]) / delta
+    left = np.clip(np.floor(pos).astype(int), 0, grid_size - 2)
+    frac = np.clip(pos - left, 0.0, 1.0)
+    weights = np.bincount(left, counts * (1 - frac), minlength=grid_size)
+    weights += np.bincount(left + 1, counts * frac, minlength=grid_size)
+    # Kernel on the grid spacing, truncated at 4 bandwidths (and the grid width)
+    half = int(min(np.ceil(4 * bandwidth / delta), grid_size - 1))
+    offsets = np.arange(-half, half + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+    size = grid_size + 2 * half
+    density = np.fft.irfft(np.fft.rfft(weights, size) * np.fft.rfft(kernel, size), size)[half:half + grid_size] / n
+    return grid, np.maximum(density, 0.0) * n * np.diff(edges).mean()
+
+
+def _render_histogram(column: str, edges: List[float], counts: List[float], std, style: Dict) -> bytes:
+    """PNG of one histogram. Runs in the histogram pool, so it takes plain data."""
+    edges = np.asarray(edges, dtype=float)
+    counts = np.asarray(counts, dtype=float)
+    fig, ax = plt.subplots(figsize=(style["width"], style["height"]), dpi=style["dpi"])
+    try:
+        ax.bar(edges[:-1], counts, width=np.diff(edges), align="edge", color=style["color"], alpha=0.75,
+               edgecolor="white")
+        kde = _binned_kde(edges, counts, std)
+        if kde is not None:
+            ax.plot(kde[0], kde[1], color=style["color"])
+        ax.set_xlabel(column)
+        ax.set_ylabel("Count")
+        ax.set_title(f"Histogram of {column}")
+        buf = BytesIO()
+        fig.savefig(buf, format='png', bbox_inches='tight')
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def _cache_key(spec: Dict, style: Dict) -> str:
+    payload = json.dumps([HIST_STYLE_VERSION, spec, style], sort_keys=True, default=float)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _render_all(specs: List[Dict], cache_dir: Optional[str] = None, style: Optional[Dict] = None) -> Dict[str, str]:
+    """{column: base64 PNG} for histogram specs (column, edges, counts, std)."""
+    style = dict(DEFAULT_HIST_STYLE, **(style or {}))
+    images: Dict[str, bytes] = {}
+    missing = []
+    for spec in specs:
+        path = os.path.join(cache_dir, _cache_key(spec, style) + ".png") if cache_dir else None
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                images[spec["column"]] = f.read()
+        else:
+            missing.append((spec, path))
+
+    args = [(spec["column"], spec["edges"], spec["counts"], spec["std"], style) for spec, _ in missing]
+    if HIST_WORKERS > 1 and len(missing) > 1:
+        rendered = list(_get_pool().map(_render_histogram, *zip(*args)))
+    else:
+        rendered = [_render_histogram(*a) for a in args]
+
+    for (spec, path), png in zip(missing, rendered):
+        images[spec["column"]] = png
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.part"
+            with open(tmp_path, "wb") as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+
+    return {
+        spec["column"]: base64.b64encode(images[spec["column"]]).decode('utf-8')
+        for spec in specs
+    }
+
+
+def plot_histograms(df, columns, cache_dir=None, style=None):
     """
     Plots histograms for the specified columns in the dataframe.
     Returns a dict: {column_name: base64_png_string}
     """
-    images_b64 = {}
+    specs = []
     for col in columns:
-        plt.figure()
-        sns.histplot(df[col].dropna(), kde=True)
-        plt.title(f"Histogram of {col}")
-        buf = BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight')
-        plt.close()
-        buf.seek(0)
-        images_b64[col] = base64.b64encode(buf.read()).decode('utf-8')
-    return images_b64
+        values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            continue
+        edges = np.histogram_bin_edges(values, bins="auto")
+        if len(edges) > MAX_HIST_BINS + 1:
+            edges = np.linspace(edges[0], edges[-1], MAX_HIST_BINS + 1)
+        counts = np.histogram(values, bins=edges)[0]
+        std = float(values.std(ddof=1)) if len(values) > 1 else None
+        specs.append({"column": col, "edges": edges.tolist(), "counts": counts.tolist(), "std": std})
+    return _render_all(specs, cache_dir, style)
+
+
+def plot_summary_histograms(summary, columns, cache_dir=None, style=None):
+    """
+    Plots histograms from the bin counts stored in a job summary artifact
+    (see utils.summary), so the dataset does not have to be loaded.
+    Pass the job's histogram_dir as cache_dir to reuse rendered images.
+    Returns a dict: {column_name: base64_png_string}
+    """
+    variables = {var["name"]: var for var in summary["variables"]}
+    specs = []
+    for col in columns:
+        var = variables.get(col)
+        if not var or not var.get("hist"):
+            continue
+        specs.append({"column": col, "edges": var["hist"]["edges"], "counts": var["hist"]["counts"],
+                      "std": var.get("std")})
+    return _render_all(specs, cache_dir, style)
+
+def _round(values, digits: int = 6) -> List[float]:
+    return [float(f"{v:.{digits}g}") for v in values]
+
+
+def histogram_data(summary, columns=None, kde_points: int = 0) -> List[Dict]:
+    """Bin edges and counts of a job summary for client-side charts, with
+    edges rounded to 6 significant digits. With kde_points > 0 each column
+    also gets the KDE overlay sampled at that many points. `columns`
+    defaults to every numeric column with a histogram.
+    """
+    variables = summary["variables"]
+    if columns is not None:
+        wanted = set(columns)
+        variables = [var for var in variables if var["name"] in wanted]
+    data = []
+    for var in variables:
+        if not var.get("hist"):
+            continue
+        entry = {
+            "name": var["name"],
+            "count": var.get("count"),
+            "mean": var.get("mean"),
+            "std": var.get("std"),
+            "edges": _round(var["hist"]["edges"]),
+            "counts": var["hist"]["counts"],
+        }
+        if kde_points > 0:
+            kde = _binned_kde(np.asarray(var["hist"]["edges"], dtype=float),
+                              np.asarray(var["hist"]["counts"], dtype=float), var.get("std"), KDE_GRID)
+            if kde is not None:
+                # Sample the fixed grid rather than re-evaluating the KDE
+                idx = np.unique(np.linspace(0, KDE_GRID - 1, min(kde_points, KDE_GRID)).round().astype(int))
+                entry["kde"] = {"x": _round(kde[0][idx]), "y": _round(kde[1][idx], 4)}
+        data.append(entry)
+    return data
+
+
+_env: Optional[Environment] = None
+
+
+def report_env() -> Environment:
+    """The report Jinja environment, created once per process. Parsed
+    templates stay in memory and their compiled code in the bytecode cache,
+    so a fresh worker skips the compile too.
+    """
+    global _env
+    if _env is None:
+        if JINJA_CACHE_DIR:
+            os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        _env = Environment(
+            loader=FileSystemLoader(searchpath=TEMPLATE_DIR),
+            bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR),
+        )
+    return _env
+
 
 def generate_report_html(summary_df, hist_images, workflow_logs, output_path='report.html', report_title='Survey Data Processing Report', metadata=None):
-    env = Environment(loader=FileSystemLoader(searchpath="./templates"))
-    template = env.get_template("report_template.html")
+    """Render the report to output_path, streaming it to the file rather than
+    building the whole document in memory. Returns output_path.
+    """
+    template = report_env().get_template(REPORT_TEMPLATE)
 
     if isinstance(summary_df, pd.DataFrame) and not summary_df.empty:
-        summary_html = summary_df.style.format({
+        summary_html = render_table(summary_df, formatters={
             'Weighted Mean': '{:.4f}',
             'Margin of Error (95% CI)': '{:.4f}'
-        }).to_html()
+        })
     else:
         summary_html = '<em>No summary metrics computed.</em>'
 
-    html_out = template.render(
+    chunks = template.generate(
         title=report_title,
         summary_table=summary_html,
         histograms=hist_images,
         workflow_logs=workflow_logs,
         meta=metadata or {}
     )
-
-    # Save to file for PDF generation
     with open(output_path, "w", encoding="utf-8") as f:
-        f.write(html_out)
+        f.writelines(chunks)
 
-    # Return both the file path and the raw HTML content
-    return output_path, html_out
+    return output_path
 
 
 def generate_pdf_report(html_path, pdf_path='report.pdf'):
@@ -75,3 +310,103 @@ def get_pdf_download_link(pdf_path):
     b64 = base64.b64encode(pdf_data).decode()
     href = f'<a href="data:application/octet-stream;base64,{b64}" download="{os.path.basename(pdf_path)}">Download PDF Report</a>'
     return href
+
+
+# -- report builds ------------------------------------------------------------
+
+def report_paths(upload_folder: str, job_id, key: str) -> Tuple[str, str]:
+    """HTML and PDF paths of a job's report build."""
+    base = os.path.join(upload_folder, f"report_{job_id}_{key[:16]}")
+    return f"{base}.html", f"{base}.pdf"
+
+
+def delete_reports(upload_folder: str, job_id, keep: Optional[str] = None):
+    """Remove a job's report files, except those of build `keep`."""
+    kept = set(report_paths(upload_folder, job_id, keep)) if keep else set()
+    for pattern in (f"report_{job_id}_*.html", f"report_{job_id}_*.pdf", f"report_{job_id}.html", f"report_{job_id}.pdf"):
+        for path in glob.glob(os.path.join(upload_folder, pattern)):
+            if path not in kept:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def report_job(job: Dict) -> Dict:
+    """The JSON-serialisable part of a job record a report uses."""
+    return {field: job.get(field) for field in REPORT_JOB_FIELDS}
+
+
+def report_key(job: Dict, prepared_by: str, processed_filepath: str) -> str:
+    """Content hash of a report: the job parameters, the processed output it
+    is summarised from, the template and the renderer versions.
+    """
+    st = os.stat(processed_filepath)
+    with open(os.path.join(TEMPLATE_DIR, REPORT_TEMPLATE), "rb") as f:
+        template_digest = hashlib.sha1(f.read()).hexdigest()
+    payload = json.dumps(
+        [REPORT_VERSION, HIST_STYLE_VERSION, {field: job.get(field) for field in REPORT_KEY_FIELDS}, prepared_by,
+         [st.st_size, st.st_mtime_ns], template_digest],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def report_context(job: Dict, summary: Dict, prepared_by: str) -> Tuple[str, Dict, List[str]]:
+    """Title, metadata and workflow log lines of a job's report."""
+    metadata = {
+        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "prepared_by": prepared_by,
+        "rows_before": job["rows_before"],
+        "rows_after": job["rows_after"],
+        "violations_count": job.get("violations_count"),
+        "params": {
+            "impute_method": job.get("impute_method"),
+            "outlier_method": job.get("outlier_method"),
+            "weight_col": job.get("weight_col"),
+        },
+        "stages": job_spans(job),
+    }
+    workflow_logs = [
+        f"Data loaded: {job['rows_before']} rows, {summary['columns']} columns",
+        f"Applied {job['impute_method']} imputation" if job.get("impute_method") != "None" else "No imputation applied",
+        f"Applied {job['outlier_method']} outlier detection" if job.get("outlier_method") != "None" else "No outlier detection applied",
+        f"Applied weights from column: {job.get('weight_col')}" if job.get("weight_col") else "No weights applied",
+        f"Final dataset: {job['rows_after']} rows",
+        f"Data quality violations: {job.get('violations_count') or 0}",
+    ]
+    title = f"Survey Data Processing Report - {job['uploaded_filename']}"
+    return title, metadata, workflow_logs
+
+
+def run_report_job(payload):
+    """Background entry point for a queued report build.
+
+    payload keys: job (report_job), prepared_by, upload_folder,
+    processed_path, key. Writes the HTML report and, when WeasyPrint is
+    available, the PDF to report_paths(), then removes the job's older
+    builds. Returns {"key", "html_path", "pdf_path"}; pdf_path is None
+    without a PDF.
+    """
+    job = payload["job"]
+    job_id = job["id"]
+    upload_folder = payload["upload_folder"]
+    key = payload["key"]
+    html_path, pdf_path = report_paths(upload_folder, job_id, key)
+
+    summary = ensure_summary(upload_folder, job_id, payload["processed_path"])
+    hist_images = plot_summary_histograms(
+        summary, histogram_columns(summary), cache_dir=histogram_dir(upload_folder, job_id)
+    )
+    title, metadata, workflow_logs = report_context(job, summary, payload["prepared_by"])
+
+    # Written under temporary names: a file at its final path is complete
+    tmp_html = f"{html_path}.{os.getpid()}.part"
+    generate_report_html(summary_table(summary), hist_images, workflow_logs, output_path=tmp_html,
+                         report_title=title, metadata=metadata)
+    tmp_pdf = generate_pdf_report(tmp_html, f"{pdf_path}.{os.getpid()}.part")
+    if tmp_pdf:
+        os.replace(tmp_pdf, pdf_path)
+    os.replace(tmp_html, html_path)
+    delete_reports(upload_folder, job_id, keep=key)
+    return {"key": key, "html_path": html_path, "pdf_path": pdf_path if tmp_pdf else None}
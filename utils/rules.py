@@ -0,0 +1,383 @@
+"""Compiled validation rules.
+
+compile_rules parses the rules JSON once into a DAG of vectorized
+predicates. Identical predicates, such as the same condition shared by many
+skip rules, become one node and are evaluated once per frame. Each node's
+mask is released after its last consumer. Evaluating a RuleSet returns a
+RuleResult: per-check violation counts and, optionally, a violation bitmap
+with one packed row per check (bit r set when data row r violates it).
+
+Rules format (the first two forms are the original validate_rules ones):
+
+    {
+      "age": {"min": 0, "max": 120},
+      "region": {"in": ["North", "South"], "required": true},
+      "age_started": {"le": {"col": "age"}},
+      "skip_if": [{"if": {"has_tv": 0, "region": ["North"]}, "then_blank": ["tv_brand"]}],
+      "checks": [{"if": {"employed": 1}, "then": {"income": {"min": 1}}, "name": "income required"}]
+    }
+
+Column specs accept min/max (range), in/not_in (sets), required, and
+lt/le/gt/ge/eq/ne against a value or {"col": other} (cross-column; checked
+where both values are present). Conditions ("if", "then") map columns to a
+scalar (equality), a list (membership), null (blank) or an operator dict
+like the column specs, plus "all"/"any"/"not" for compound logic. Every
+condition part must hold. A predicate on a missing value is false, except
+"blank". Checks that reference columns absent from the frame are skipped.
+"""
+import json
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+COMPARE_OPS = {"lt": "<", "le": "<=", "gt": ">", "ge": ">=", "eq": "==", "ne": "!="}
+_NUMPY_OPS = {"lt": np.less, "le": np.less_equal, "gt": np.greater, "ge": np.greater_equal,
+              "eq": np.equal, "ne": np.not_equal}
+_NEGATED = {"lt": "ge", "le": "gt", "gt": "le", "ge": "lt", "eq": "ne", "ne": "eq"}
+
+
+class RuleError(ValueError):
+    pass
+
+
+class _Columns:
+    """Per-evaluation cache of column arrays."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._numeric: Dict[str, np.ndarray] = {}
+        self._present: Dict[str, np.ndarray] = {}
+
+    def __contains__(self, col):
+        return col in self.df.columns
+
+    def numeric(self, col) -> np.ndarray:
+        if col not in self._numeric:
+            series = self.df[col]
+            if not pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+                series = pd.to_numeric(series, errors="coerce")
+            self._numeric[col] = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        return self._numeric[col]
+
+    def present(self, col) -> np.ndarray:
+        if col not in self._present:
+            self._present[col] = self.df[col].notna().to_numpy()
+        return self._present[col]
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class RuleSet:
+    """Compiled rules. Build with compile_rules(rules)."""
+
+    def __init__(self):
+        # nodes[i] = (kind, args, columns); children always precede parents
+        self.nodes: List[Tuple] = []
+        self._ids: Dict[Tuple, int] = {}
+        self.checks: List[Tuple[str, str, int]] = []  # (column, description, node)
+        self.errors: List[str] = []
+
+    # -- construction --------------------------------------------------------
+
+    def _node(self, kind, args, columns) -> int:
+        key = (kind, args)
+        if key not in self._ids:
+            self._ids[key] = len(self.nodes)
+            self.nodes.append((kind, args, frozenset(columns)))
+        return self._ids[key]
+
+    def _children_columns(self, children):
+        return set().union(*(self.nodes[c][2] for c in children)) if children else set()
+
+    def present(self, col) -> int:
+        return self._node("present", (col,), [col])
+
+    def compare(self, col, op, value) -> int:
+        if isinstance(value, dict) and "col" in value:
+            return self._node("compare_col", (col, op, value["col"]), [col, value["col"]])
+        if op in ("eq", "ne") and not _is_number(value):
+            node = self._node("equals", (col, json.dumps(value)), [col])
+            return node if op == "eq" else self.all_of([self.present(col), self.negate(node)])
+        if not _is_number(value):
+            raise RuleError(f"'{col}': {op} needs a number or {{\"col\": name}}, got {value!r}")
+        return self._node("compare", (col, op, float(value)), [col])
+
+    def member(self, col, values) -> int:
+        return self._node("member", (col, json.dumps(list(values))), [col])
+
+    def negate(self, child) -> int:
+        kind, args, columns = self.nodes[child]
+        if kind == "not":
+            return args[0]
+        return self._node("not", (child,), columns)
+
+    def all_of(self, children) -> int:
+        children = tuple(dict.fromkeys(children))
+        if len(children) == 1:
+            return children[0]
+        return self._node("and", children, self._children_columns(children))
+
+    def any_of(self, children) -> int:
+        children = tuple(dict.fromkeys(children))
+        if len(children) == 1:
+            return children[0]
+        return self._node("or", children, self._children_columns(children))
+
+    def condition(self, cond) -> int:
+        """Node that is true where `cond` (see module docstring) holds."""
+        if not isinstance(cond, dict) or not cond:
+            raise RuleError(f"condition must be a non-empty object, got {cond!r}")
+        parts = []
+        for key, spec in cond.items():
+            if key in ("all", "any"):
+                if not isinstance(spec, list) or not spec:
+                    raise RuleError(f"'{key}' needs a non-empty list of conditions")
+                children = [self.condition(c) for c in spec]
+                parts.append(self.all_of(children) if key == "all" else self.any_of(children))
+            elif key == "not":
+                parts.append(self.negate(self.condition(spec)))
+            else:
+                parts.append(self.column_condition(key, spec))
+        return self.all_of(parts)
+
+    def column_condition(self, col, spec) -> int:
+        if spec is None:
+            return self.negate(self.present(col))
+        if isinstance(spec, list):
+            return self.member(col, spec)
+        if not isinstance(spec, dict):
+            return self.compare(col, "eq", spec)
+        parts = []
+        for op, value in spec.items():
+            if op == "min":
+                parts.append(self.compare(col, "ge", value))
+            elif op == "max":
+                parts.append(self.compare(col, "le", value))
+            elif op in COMPARE_OPS:
+                parts.append(self.compare(col, op, value))
+            elif op == "in":
+                parts.append(self.member(col, value))
+            elif op == "not_in":
+                parts.append(self.all_of([self.present(col), self.negate(self.member(col, value))]))
+            elif op == "blank":
+                node = self.present(col)
+                parts.append(self.negate(node) if value else node)
+            else:
+                raise RuleError(f"'{col}': unknown operator '{op}'")
+        if not parts:
+            raise RuleError(f"'{col}': empty condition")
+        return self.all_of(parts)
+
+    def add_check(self, column, description, node):
+        self.checks.append((column, description, node))
+
+    # -- description ----------------------------------------------------------
+
+    def describe(self, node) -> str:
+        kind, args, _ = self.nodes[node]
+        if kind == "present":
+            return f"{args[0]} is not blank"
+        if kind == "compare":
+            value = int(args[2]) if float(args[2]).is_integer() else args[2]
+            return f"{args[0]} {COMPARE_OPS[args[1]]} {value}"
+        if kind == "compare_col":
+            return f"{args[0]} {COMPARE_OPS[args[1]]} {args[2]}"
+        if kind == "equals":
+            return f"{args[0]} == {json.loads(args[1])}"
+        if kind == "member":
+            return f"{args[0]} in {json.loads(args[1])}"
+        if kind == "not":
+            child_kind, child_args, _ = self.nodes[args[0]]
+            if child_kind == "present":
+                return f"{child_args[0]} is blank"
+            return f"not ({self.describe(args[0])})"
+        joiner = " and " if kind == "and" else " or "
+        text = joiner.join(self.describe(c) for c in args)
+        return text if kind == "and" else f"({text})"
+
+    # -- evaluation -------------------------------------------------------------
+
+    def _evaluate_node(self, kind, args, cols: _Columns, masks):
+        if kind == "present":
+            return cols.present(args[0])
+        if kind == "compare":
+            with np.errstate(invalid="ignore"):
+                return _NUMPY_OPS[args[1]](cols.numeric(args[0]), args[2])
+        if kind == "compare_col":
+            with np.errstate(invalid="ignore"):
+                return _NUMPY_OPS[args[1]](cols.numeric(args[0]), cols.numeric(args[2]))
+        if kind == "equals":
+            value = json.loads(args[1])
+            return cols.df[args[0]].eq(value).to_numpy(dtype=bool, na_value=False)
+        if kind == "member":
+            return cols.df[args[0]].isin(json.loads(args[1])).to_numpy(dtype=bool, na_value=False)
+        if kind == "not":
+            return ~masks[args[0]]
+        reduce = np.logical_and if kind == "and" else np.logical_or
+        out = reduce(masks[args[0]], masks[args[1]])
+        for child in args[2:]:
+            reduce(out, masks[child], out=out)
+        return out
+
+    def evaluate(self, df: pd.DataFrame, bitmap: bool = True) -> "RuleResult":
+        """Violation counts for every check whose columns exist in `df`, and
+        the per-row violation bitmap unless `bitmap` is False.
+        """
+        cols = _Columns(df)
+        checks = [check for check in self.checks if all(c in cols for c in self.nodes[check[2]][2])]
+        needed = set()
+        remaining: Dict[int, int] = {}
+        stack = [node for _, _, node in checks]
+        for node in stack:
+            remaining[node] = remaining.get(node, 0) + 1
+        while stack:
+            node = stack.pop()
+            if node in needed:
+                continue
+            needed.add(node)
+            kind, args, _ = self.nodes[node]
+            if kind in ("not", "and", "or"):
+                for child in args:
+                    remaining[child] = remaining.get(child, 0) + 1
+                    stack.append(child)
+
+        n = len(df)
+        counts = np.zeros(len(checks), dtype=np.int64)
+        bits = np.zeros((len(checks), (n + 7) // 8), dtype=np.uint8) if bitmap else None
+        check_index: Dict[int, List[int]] = {}
+        for i, (_, _, node) in enumerate(checks):
+            check_index.setdefault(node, []).append(i)
+
+        masks: Dict[int, np.ndarray] = {}
+        for node in sorted(needed):
+            kind, args, _ = self.nodes[node]
+            mask = masks[node] = self._evaluate_node(kind, args, cols, masks)
+            released = list(args) if kind in ("not", "and", "or") else []
+            for i in check_index.get(node, ()):
+                counts[i] = np.count_nonzero(mask)
+                if bits is not None and counts[i]:
+                    bits[i] = np.packbits(mask, bitorder="little")
+                released.append(node)
+            for used in released:
+                remaining[used] -= 1
+                if remaining[used] == 0:
+                    del masks[used]
+        return RuleResult([(col, text) for col, text, _ in checks], counts, bits, n)
+
+
+class RuleResult:
+    """Outcome of RuleSet.evaluate on one frame."""
+
+    def __init__(self, checks: List[Tuple[str, str]], counts: np.ndarray, bitmap: Optional[np.ndarray], rows: int):
+        self.checks = checks
+        self._rows = rows
+        self.counts = counts
+        self.bitmap = bitmap
+
+    def count_list(self) -> List[Tuple[str, int, str]]:
+        """(column, count, description) per check, as rule_violation_counts."""
+        return [(col, int(count), text) for (col, text), count in zip(self.checks, self.counts)]
+
+    @property
+    def rows(self) -> int:
+        return self._rows
+
+    def check_mask(self, i: int) -> np.ndarray:
+        return np.unpackbits(self.bitmap[i], count=self._rows, bitorder="little").astype(bool)
+
+    def row_mask(self) -> np.ndarray:
+        """Rows violating at least one check."""
+        packed = np.bitwise_or.reduce(self.bitmap, axis=0) if len(self.checks) else np.zeros(0, np.uint8)
+        return np.unpackbits(packed, count=self._rows, bitorder="little").astype(bool)
+
+    def row_checks(self, row: int) -> List[int]:
+        """Indices of the checks violated by `row`."""
+        return np.flatnonzero((self.bitmap[:, row >> 3] >> (row & 7)) & 1).tolist()
+
+
+def compile_rules(rules) -> RuleSet:
+    """Compile the rules JSON (see module docstring). Malformed rules are
+    skipped and reported in RuleSet.errors.
+    """
+    rs = RuleSet()
+    if not isinstance(rules, dict):
+        rs.errors.append("rules must be a JSON object")
+        return rs
+
+    def guarded(label, build):
+        try:
+            build()
+        except RuleError as e:
+            rs.errors.append(f"{label}: {e}")
+
+    # range and column checks
+    for col, spec in rules.items():
+        if col in ("skip_if", "checks") or not isinstance(spec, dict):
+            continue
+
+        def column_checks(col=col, spec=spec):
+            for op, value in spec.items():
+                if op == "min":
+                    rs.add_check(col, f"values below {value}", rs.compare(col, "lt", value))
+                elif op == "max":
+                    rs.add_check(col, f"values above {value}", rs.compare(col, "gt", value))
+                elif op == "in":
+                    node = rs.all_of([rs.present(col), rs.negate(rs.member(col, value))])
+                    rs.add_check(col, f"values not in {value}", node)
+                elif op == "not_in":
+                    rs.add_check(col, f"values in {value}", rs.member(col, value))
+                elif op == "required":
+                    if value:
+                        rs.add_check(col, "missing values", rs.negate(rs.present(col)))
+                elif op in COMPARE_OPS:
+                    if isinstance(value, dict) and "col" in value:
+                        other = value["col"]
+                        node = rs.all_of([rs.present(col), rs.present(other),
+                                          rs.negate(rs.compare(col, op, value))])
+                        text = f"values not {COMPARE_OPS[op]} {other}"
+                    else:
+                        node = rs.compare(col, _NEGATED[op], value)
+                        text = f"values not {COMPARE_OPS[op]} {value}"
+                    rs.add_check(col, text, node)
+                else:
+                    raise RuleError(f"unknown rule '{op}'")
+
+        guarded(col, column_checks)
+
+    # skip pattern checks
+    for i, spec in enumerate(rules.get("skip_if", []) or []):
+        def skip_checks(spec=spec):
+            if not isinstance(spec, dict):
+                raise RuleError("must be an object")
+            cond, then_blank = spec.get("if", {}), spec.get("then_blank", [])
+            if not cond or not then_blank:
+                return
+            when = rs.condition(cond)
+            text = f"should be blank when {rs.describe(when)}"
+            for target in then_blank:
+                rs.add_check(target, text, rs.all_of([when, rs.present(target)]))
+
+        guarded(f"skip_if[{i}]", skip_checks)
+
+    # compound if/then checks
+    for i, spec in enumerate(rules.get("checks", []) or []):
+        def compound_check(spec=spec):
+            if not isinstance(spec, dict) or "then" not in spec:
+                raise RuleError("needs a 'then' condition")
+            then = rs.condition(spec["then"])
+            node = rs.negate(then)
+            when = None
+            if spec.get("if"):
+                when = rs.condition(spec["if"])
+                node = rs.all_of([when, node])
+            column = spec.get("column") or next(
+                (k for k in spec["then"] if k not in ("all", "any", "not")), "")
+            text = spec.get("name") or f"fails {rs.describe(then)}"
+            if when is not None and not spec.get("name"):
+                text += f" when {rs.describe(when)}"
+            rs.add_check(column, text, node)
+
+        guarded(f"checks[{i}]", compound_check)
+    return rs
@@ -0,0 +1,199 @@
+"""Storage for processed job outputs.
+
+Outputs are written as uncompressed Arrow IPC files (Feather v2), which keeps
+dtypes and can be memory-mapped and projected to just the columns a route
+needs. CSV/XLSX are only produced when a user downloads the data. Without
+pyarrow installed, and for jobs processed before this format existed, plain
+CSV files are used.
+"""
+import os
+import numpy as np
+import pandas as pd
+from typing import List, Optional
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.feather as feather  # type: ignore
+except Exception:  # pragma: no cover
+    pa = None
+    feather = None
+
+ARROW_EXT = ".arrow"
+CSV_EXT = ".csv"
+
+
+def processed_path(upload_folder: str, job_id) -> str:
+    """Path a new processed output for `job_id` should be written to."""
+    ext = ARROW_EXT if pa is not None else CSV_EXT
+    return os.path.join(upload_folder, f"processed_{job_id}{ext}")
+
+
+def find_processed(upload_folder: str, job_id) -> Optional[str]:
+    """Existing processed output for `job_id` (Arrow preferred, legacy CSV), or None."""
+    for ext in (ARROW_EXT, CSV_EXT):
+        path = os.path.join(upload_folder, f"processed_{job_id}{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def delete_processed(upload_folder: str, job_id):
+    for ext in (ARROW_EXT, CSV_EXT):
+        path = os.path.join(upload_folder, f"processed_{job_id}{ext}")
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _is_arrow(path: str) -> bool:
+    return path.endswith(ARROW_EXT)
+
+
+def _to_arrow_table(df: pd.DataFrame, schema=None):
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        # Object columns mixing Python types (common from Excel): store as text
+        df = df.copy()
+        for col in df.columns:
+            if df[col].dtype == object:
+                df[col] = df[col].map(lambda v: v if v is None or (isinstance(v, float) and np.isnan(v)) else str(v))
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    if schema is not None and not table.schema.equals(schema):
+        table = table.cast(schema)
+    return table.replace_schema_metadata(None)
+
+
+def write_processed(df: pd.DataFrame, path: str):
+    """Write `df` atomically to `path` in the format implied by its extension."""
+    tmp_path = f"{path}.part"
+    if _is_arrow(path):
+        feather.write_feather(_to_arrow_table(df), tmp_path, compression="uncompressed")
+    else:
+        df.to_csv(tmp_path, index=False)
+    # Publish atomically so readers never see a half-written output
+    os.replace(tmp_path, path)
+
+
+class ProcessedWriter:
+    """Appends DataFrame chunks to a processed output (used by streaming mode).
+    Every chunk is cast to the schema of the first one.
+    """
+
+    def __init__(self, path: str, columns: List[str]):
+        self.path = path
+        self.columns = columns
+        self.tmp_path = f"{path}.part"
+        self._writer = None
+        self._schema = None
+        self._first = True
+
+    def write(self, chunk: pd.DataFrame):
+        if _is_arrow(self.path):
+            table = _to_arrow_table(chunk, self._schema)
+            if self._writer is None:
+                self._schema = table.schema
+                options = pa.ipc.IpcWriteOptions(compression=None)
+                self._writer = pa.ipc.new_file(self.tmp_path, self._schema, options=options)
+            self._writer.write_table(table)
+        else:
+            chunk.to_csv(self.tmp_path, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._first:
+            self.write(pd.DataFrame(columns=self.columns))
+        if self._writer is not None:
+            self._writer.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def _coerce_numeric_like(df: pd.DataFrame) -> pd.DataFrame:
+    for column_name in df.columns:
+        if df[column_name].dtype == object:
+            try:
+                df[column_name] = pd.to_numeric(df[column_name])
+            except (ValueError, TypeError):
+                pass
+    return df
+
+
+def processed_columns(path: str) -> List[str]:
+    """Column names of a processed output, read from the header/schema only."""
+    if _is_arrow(path):
+        with pa.memory_map(path, "r") as source:
+            return list(pa.ipc.open_file(source).schema.names)
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def read_processed(path: str, columns: Optional[List[str]] = None, numeric_only: bool = False) -> pd.DataFrame:
+    """Load a processed output, memory-mapped and projected to `columns`
+    (or to the numeric columns with `numeric_only`) when stored as Arrow.
+    """
+    if _is_arrow(path):
+        if numeric_only:
+            with pa.memory_map(path, "r") as source:
+                schema = pa.ipc.open_file(source).schema
+            columns = [
+                f.name for f in schema
+                if (pa.types.is_integer(f.type) or pa.types.is_floating(f.type))
+                and (columns is None or f.name in columns)
+            ]
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        return table.to_pandas()
+    df = _coerce_numeric_like(pd.read_csv(path, usecols=columns))
+    if numeric_only:
+        df = df.select_dtypes(include=["number"])
+    return df
+
+
+def read_rows(path: str, rows, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Only the given row positions of a processed output, in the given
+    order and indexed by position. Arrow outputs are memory-mapped, so just
+    the pages holding those rows are touched.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    if _is_arrow(path):
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        df = table.take(pa.array(rows)).to_pandas()
+    else:
+        wanted = set((rows + 1).tolist())
+        df = pd.read_csv(path, usecols=columns, skiprows=lambda i: i > 0 and i not in wanted)
+        df = _coerce_numeric_like(df).set_axis(np.unique(rows)).loc[rows]
+    df.index = rows
+    return df
+
+
+def iter_csv(path: str, bom: bool = True, chunk_bytes: int = 1 << 20):
+    """A processed output as CSV bytes, yielded batch by batch so large
+    outputs are never fully materialised (e.g. for a streamed download).
+    """
+    if bom:
+        yield b"\xef\xbb\xbf"
+    if not _is_arrow(path):
+        with open(path, "rb") as f:
+            chunk = f.read(chunk_bytes)
+            yield chunk[3:] if chunk.startswith(b"\xef\xbb\xbf") else chunk
+            for chunk in iter(lambda: f.read(chunk_bytes), b""):
+                yield chunk
+        return
+    with pa.memory_map(path, "r") as source:
+        reader = pa.ipc.open_file(source)
+        header = True
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i).to_pandas()
+            yield batch.to_csv(index=False, header=header).encode("utf-8")
+            header = False
+        if header:
+            yield pd.DataFrame(columns=reader.schema.names).to_csv(index=False).encode("utf-8")
+
+
+def export_csv(path: str, out, bom: bool = True):
+    """Write a processed output as CSV to the binary file object `out`
+    (see iter_csv).
+    """
+    for chunk in iter_csv(path, bom=bom):
+        out.write(chunk)
+
+
+def export_xlsx(path: str, out_path: str):
+    read_processed(path).to_excel(out_path, index=False, engine="openpyxl")
@@ -0,0 +1,230 @@
+"""Chunked multi-pass processing for large CSV uploads.
+
+The first pass reads the file in chunks and collects per-column statistics
+(moments, min/max and a KLL quantile sketch, see utils.colstats). A fitted
+CleaningPlan (utils.plan) then applies imputation, outlier handling, weights
+and rule checks chunk by chunk and appends to the processed output, so peak
+memory is bounded by the chunk size rather than the dataset size. Raking
+adds one pass that keeps only the integer category codes of each row.
+"""
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+from utils.colstats import ColumnStats
+from utils.metrics import Trace
+from utils.plan import CleaningPlan
+from utils.storage import ProcessedWriter
+from utils.summary import (
+    SummaryAccumulator,
+    WEIGHT_COL,
+    auto_bin_edges,
+    streaming_bin_edges,
+    write_summary,
+    resolve_design,
+)
+from utils.weights import MarginEncoder, design_from_params, rake_log, rake_weights
+
+CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "100000"))
+STREAM_THRESHOLD_BYTES = int(os.getenv("STREAM_THRESHOLD_MB", "200")) * 1024 * 1024
+
+
+def should_stream(filepath: str, params: Dict) -> bool:
+    """Large CSV uploads are processed in streaming mode. KNN imputation needs
+    the whole matrix, so it always runs in memory.
+    """
+    if not filepath.lower().endswith(".csv") or params.get("impute_method") == "KNN":
+        return False
+    try:
+        return os.path.getsize(filepath) >= STREAM_THRESHOLD_BYTES
+    except OSError:
+        return False
+
+
+def _iter_chunks(filepath: str, chunksize: int, usecols=None):
+    return pd.read_csv(filepath, chunksize=chunksize, usecols=usecols)
+
+
+def scan_csv(filepath: str, chunksize: int = CHUNK_ROWS) -> Dict:
+    """First pass: column list, row count and ColumnStats for every column
+    that parses as numeric in all chunks.
+    """
+    columns: List[str] = []
+    stats: Dict[str, ColumnStats] = {}
+    non_numeric = set()
+    rows = 0
+    for chunk in _iter_chunks(filepath, chunksize):
+        if not columns:
+            columns = list(chunk.columns)
+        rows += len(chunk)
+        for column_name in chunk.columns:
+            if column_name in non_numeric:
+                continue
+            series = chunk[column_name]
+            if series.dtype == object:
+                try:
+                    series = pd.to_numeric(series)
+                except (ValueError, TypeError):
+                    pass
+            if not pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+                non_numeric.add(column_name)
+                stats.pop(column_name, None)
+                continue
+            stats.setdefault(column_name, ColumnStats(mode="approx")).update(series)
+    numeric = {c: stats[c] for c in columns if c in stats}
+    return {"columns": columns, "rows": rows, "numeric": numeric}
+
+
+def _coerce_chunk(chunk: pd.DataFrame, numeric: Dict[str, ColumnStats]) -> pd.DataFrame:
+    # Keep dtypes identical across chunks: integers only if the whole column
+    # is integral and complete, otherwise float64 (as a full read would give).
+    # Everything else is text, so every chunk shares one output schema.
+    for col in chunk.columns:
+        st = numeric.get(col)
+        if st is None:
+            chunk[col] = chunk[col].astype("string")
+            continue
+        series = pd.to_numeric(chunk[col], errors="coerce")
+        if st.is_integer and not st.missing:
+            chunk[col] = series.astype(np.int64)
+        else:
+            chunk[col] = series.astype(np.float64)
+    return chunk
+
+
+def process_csv_streaming(filepath: str, output_path: str, params: Dict, chunksize: int = CHUNK_ROWS,
+                          summary_path: str = None, violations=None, trace: Trace = None):
+    """Streaming equivalent of pipeline.process_dataframe for large CSV files.
+    Writes the processed data to `output_path` (and the job summary artifact
+    to `summary_path`, if given), records rule violations in `violations`
+    (a violations.ViolationIndexBuilder, if given) and one span per pass in
+    `trace` (a metrics.Trace, if given), and returns
+    (rows_before, rows_after, workflow_logs).
+    """
+    plan = CleaningPlan.from_params(params)
+    trace = trace if trace is not None else Trace()
+
+    # Pass 1: statistics
+    with trace.span("scan") as span:
+        scan = scan_csv(filepath, chunksize)
+        span.rows_out = scan["rows"]
+    columns, numeric, rows_before = scan["columns"], scan["numeric"], scan["rows"]
+    workflow_logs = [
+        f"Data loaded: {rows_before} rows, {len(columns)} columns",
+        f"Streaming mode: processed in chunks of {chunksize} rows",
+    ]
+    if plan.impute_method == "KNN":
+        workflow_logs.append("Warning: KNN imputation is not available in streaming mode")
+        plan.impute_method = "None"
+    plan.fit(numeric)
+    if plan.imputes:
+        workflow_logs.append(f"Applied {plan.impute_method} imputation")
+
+    def prepare(chunk):
+        return plan.impute(_coerce_chunk(chunk, numeric))
+
+    # Pass 2 (winsorize only): count outliers so we know whether to clip at all
+    outlier_count = 0
+    if plan.bounds and not plan.removes_outliers:
+        with trace.span("outlier_detection", rows_before):
+            for chunk in _iter_chunks(filepath, chunksize, usecols=list(plan.bounds)):
+                outlier_count += int(plan.outlier_mask(prepare(chunk)).sum())
+
+    def transform(chunk):
+        """Imputation and outlier handling; returns (chunk, rows removed)."""
+        chunk = prepare(chunk)
+        if plan.bounds:
+            if plan.removes_outliers:
+                mask = plan.outlier_mask(chunk)
+                return chunk.take(np.flatnonzero(~mask)), int(mask.sum())
+            if outlier_count > 0:
+                plan.clip(chunk)
+        return chunk, 0
+
+    # Raking pass: calibration needs the category codes of every kept row,
+    # so they are collected (a few bytes per row) and raked before writing
+    raked, rake_logs = None, []
+    if plan.rakes:
+        with trace.span("raking", rows_before) as span:
+            encoder = MarginEncoder(plan.rake_margins)
+            code_parts, base_parts = [[] for _ in encoder.columns], []
+            base_col = plan.weight_col if plan.weight_col in columns else None
+            for chunk in _iter_chunks(filepath, chunksize):
+                chunk, _ = transform(chunk)
+                for part, codes in zip(code_parts, encoder.encode(chunk)):
+                    part.append(codes)
+                if base_col:
+                    base_parts.append(chunk[base_col].to_numpy(dtype=np.float64, na_value=np.nan))
+            raked, info = rake_weights(
+                [np.concatenate(part) for part in code_parts],
+                encoder.targets,
+                np.concatenate(base_parts) if base_col else None,
+                plan.trim,
+            )
+            rake_logs = rake_log(plan.rake_margins, info)
+            span.rows_out = len(raked)
+
+    # Final pass: transform and append to the output
+    summary = None
+    weights_applied = raked is not None or (bool(plan.weight_col) and plan.weight_col in columns)
+    output_columns = columns + ([WEIGHT_COL] if weights_applied and WEIGHT_COL not in columns else [])
+    if summary_path:
+        # Kept values lie within the removal bounds or the clip limits
+        if plan.removes_outliers:
+            limits = plan.bounds
+        else:
+            limits = plan.clip_limits if outlier_count > 0 else {}
+        edges, shifts = streaming_bin_edges(numeric, plan.fills, limits)
+        if raked is not None:
+            finite = raked[np.isfinite(raked)]
+            if len(finite):
+                q1, q3 = np.percentile(finite, [25, 75])
+                edges[WEIGHT_COL] = auto_bin_edges(float(finite.min()), float(finite.max()), len(finite), float(q3 - q1))
+                shifts[WEIGHT_COL] = float(finite.mean())
+        elif weights_applied:
+            # "weight" becomes a copy of the processed weight column
+            source = edges.get(plan.weight_col), shifts.get(plan.weight_col)
+            edges.pop(WEIGHT_COL, None)
+            if plan.weight_col in numeric:
+                edges[WEIGHT_COL], shifts[WEIGHT_COL] = source
+        design, warnings = resolve_design(design_from_params(params), output_columns)
+        workflow_logs.extend(warnings)
+        summary = SummaryAccumulator([c for c in output_columns if c in edges], edges, shifts, design)
+    rule_totals: Dict[Tuple[str, str], int] = {}
+    rows_after = 0
+    # Chunks interleave the remaining stages, so the final pass is one span
+    with trace.span("transform_write", rows_before) as span:
+        writer = ProcessedWriter(output_path, output_columns)
+        for chunk in _iter_chunks(filepath, chunksize):
+            chunk, removed = transform(chunk)
+            if plan.removes_outliers:
+                outlier_count += removed
+            if raked is not None:
+                chunk["weight"] = raked[rows_after:rows_after + len(chunk)]
+            else:
+                plan.apply_weights(chunk)
+            for col, count, text in plan.rule_counts(chunk, violations, rows_after):
+                rule_totals[(col, text)] = rule_totals.get((col, text), 0) + count
+            if summary is not None:
+                summary.update(chunk)
+            writer.write(chunk)
+            rows_after += len(chunk)
+        writer.close()
+        span.rows_out = rows_after
+    if summary is not None:
+        with trace.span("summary", rows_after):
+            write_summary(summary_path, summary.result(len(output_columns)), output_path)
+
+    if outlier_count > 0:
+        action = "Removed" if plan.removes_outliers else "Winsorized"
+        workflow_logs.append(f"{action} {outlier_count} outliers using {plan.outlier_method}")
+    if plan.rake_error:
+        workflow_logs.append("Warning: Invalid JSON in raking margins")
+    if raked is not None:
+        workflow_logs.extend(rake_logs)
+    elif weights_applied:
+        workflow_logs.append(f"Applied weights from column: {plan.weight_col}")
+    workflow_logs.extend(plan.rule_warnings())
+    workflow_logs.extend(f"{col}: {count} {text}" for (col, text), count in rule_totals.items() if count)
+    workflow_logs.append(f"Final dataset: {rows_after} rows")
+    return rows_before, rows_after, workflow_logs
@@ -0,0 +1,287 @@
+"""Per-job summary artifact.
+
+Processing writes summary_{job_id}.json next to the processed output. For
+every numeric column it holds the count, mean, std, min/max, weighted mean,
+margin of error and histogram bin counts. view_details and generate_report
+render from it without loading the dataset. The artifact records the size
+and mtime of the output it describes, and a stale or missing artifact is
+rebuilt from the processed data.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from utils.storage import read_processed, processed_columns
+from utils.weights import weighted_moments, summaries_from_moments, DesignAggregator, VARIANCE_WORKERS
+
+SUMMARY_VERSION = 1
+MAX_HIST_BINS = 200
+WEIGHT_COL = "weight"
+
+
+def summary_path(upload_folder: str, job_id) -> str:
+    return os.path.join(upload_folder, f"summary_{job_id}.json")
+
+
+def delete_summary(upload_folder: str, job_id):
+    path = summary_path(upload_folder, job_id)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def auto_bin_edges(lo: float, hi: float, n: int, iqr: float, max_bins: int = MAX_HIST_BINS) -> Optional[np.ndarray]:
+    """Histogram edges by numpy's 'auto' rule (the narrower of the Sturges and
+    Freedman-Diaconis widths) computed from summary statistics, so chunked
+    runs can fix the bins before seeing the data.
+    """
+    if not n or not np.isfinite(lo) or not np.isfinite(hi):
+        return None
+    if hi <= lo:
+        return np.array([lo - 0.5, hi + 0.5])
+    sturges = (hi - lo) / (np.log2(n) + 1.0)
+    fd = 2.0 * iqr * n ** (-1.0 / 3.0) if np.isfinite(iqr) else 0.0
+    width = min(fd, sturges) if fd > 0 else sturges
+    bins = int(min(max(np.ceil((hi - lo) / width), 1), max_bins))
+    return np.linspace(lo, hi, bins + 1)
+
+
+def _num(value) -> Optional[float]:
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+class SummaryAccumulator:
+    """One-pass sufficient statistics for the summary artifact, fed with the
+    processed frame (in memory) or with each processed chunk (streaming).
+    Moments for all columns come from the batched reductions in
+    utils.weights, taken about a per-column shift to keep variances accurate.
+    """
+
+    def __init__(self, columns: List[str], edges: Dict[str, Optional[np.ndarray]],
+                 shifts: Optional[Dict[str, float]] = None, design: Optional[Dict] = None):
+        self.columns = list(columns)
+        self.weighted = WEIGHT_COL in self.columns
+        self.rows = 0
+        p = len(self.columns)
+        self.shift = np.array([float((shifts or {}).get(col, 0.0) or 0.0) for col in self.columns])
+        self.min = np.full(p, np.inf)
+        self.max = np.full(p, -np.inf)
+        self.moments = None
+        self.weighted_moments = None
+        self.edges = [edges.get(col) for col in self.columns]
+        self.hist = [np.zeros(len(e) - 1, dtype=np.int64) if e is not None else None for e in self.edges]
+        # Optional design-based variance (see utils.weights.design_from_params)
+        self.design = design
+        self.design_agg = None
+        if design:
+            self.design_agg = DesignAggregator(
+                design["method"], p, self.shift, design["replicates"], has_psu=bool(design["cluster_col"])
+            )
+
+    @staticmethod
+    def _add(total, part):
+        if total is None:
+            return part
+        return {key: total[key] + part[key] if key != "shift" else total[key] for key in total}
+
+    def update(self, df: pd.DataFrame):
+        self.rows += len(df)
+        if not self.columns:
+            return self
+        X = df[self.columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        self.moments = self._add(self.moments, weighted_moments(X, None, self.shift))
+        if self.weighted:
+            weights = df[WEIGHT_COL].to_numpy(dtype=np.float64, na_value=np.nan)
+            self.weighted_moments = self._add(self.weighted_moments, weighted_moments(X, weights, self.shift))
+        if self.design_agg is not None:
+            self.design_agg.update(
+                X,
+                df[WEIGHT_COL].to_numpy(dtype=np.float64, na_value=np.nan) if self.weighted else None,
+                df[self.design["strata_col"]].to_numpy() if self.design["strata_col"] else None,
+                df[self.design["cluster_col"]].to_numpy() if self.design["cluster_col"] else None,
+            )
+        if len(X):
+            self.min = np.fmin(self.min, np.where(np.isnan(X), np.inf, X).min(axis=0))
+            self.max = np.fmax(self.max, np.where(np.isnan(X), -np.inf, X).max(axis=0))
+        for i, col_edges in enumerate(self.edges):
+            if col_edges is None:
+                continue
+            values = X[:, i]
+            values = np.clip(values[np.isfinite(values)], col_edges[0], col_edges[-1])
+            self.hist[i] += np.histogram(values, bins=col_edges)[0]
+        return self
+
+    def result(self, column_count: int) -> Dict:
+        p = len(self.columns)
+        moments = self.moments or weighted_moments(np.empty((0, p)), None, self.shift)
+        n = moments["n"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(n > 0, self.shift + moments["sum_wx"] / n, np.nan)
+            var = (moments["sum_wx2"] - moments["sum_wx"] ** 2 / n) / (n - 1)
+            std = np.where(n > 1, np.sqrt(np.maximum(var, 0.0)), np.nan)
+        # Same figures the routes used to compute: weighted mean and MOE
+        # when a usable weight column exists, else mean and std * 1.96 / rows
+        weighted_mean, moe = mean, std * 1.96 / max(self.rows, 1)
+        if self.weighted and self.weighted_moments is not None:
+            stats = summaries_from_moments(self.weighted_moments)
+            usable = ~np.isnan(stats["weighted_mean"])
+            weighted_mean = np.where(usable, stats["weighted_mean"], mean)
+            moe = np.where(usable, stats["margin_of_error"], moe)
+        variance = None
+        design_se = np.full(p, np.nan)
+        if self.design_agg is not None:
+            variance = {k: self.design[k] for k in ("method", "strata_col", "cluster_col")}
+            try:
+                est = self.design_agg.estimate(VARIANCE_WORKERS)
+            except ValueError as e:
+                variance["error"] = str(e)
+            else:
+                variance.update({k: int(est[k]) for k in ("strata", "psus", "replicates")})
+                design_se = est["se"]
+                usable = np.isfinite(design_se)
+                weighted_mean = np.where(usable, est["mean"], weighted_mean)
+                moe = np.where(usable, est["margin_of_error"], moe)
+        variables = []
+        for i, col in enumerate(self.columns):
+            variables.append({
+                "name": col,
+                "count": int(n[i]),
+                "mean": _num(mean[i]),
+                "std": _num(std[i]),
+                "min": _num(self.min[i]),
+                "max": _num(self.max[i]),
+                "weighted_mean": _num(weighted_mean[i]),
+                "margin_of_error": _num(moe[i]),
+                "design_se": _num(design_se[i]),
+                "hist": None if self.edges[i] is None else {
+                    "edges": [float(e) for e in self.edges[i]],
+                    "counts": [int(c) for c in self.hist[i]],
+                },
+            })
+        return {
+            "version": SUMMARY_VERSION,
+            "rows": int(self.rows),
+            "columns": int(column_count),
+            "weighted": self.weighted,
+            "variance": variance,
+            "variables": variables,
+        }
+
+
+def resolve_design(design: Optional[Dict], columns) -> Tuple[Optional[Dict], List[str]]:
+    """Drop design columns missing from the data. Returns (design, warnings)."""
+    if not design:
+        return None, []
+    design, warnings = dict(design), []
+    for key in ("strata_col", "cluster_col"):
+        if design[key] and design[key] not in columns:
+            warnings.append(f"Warning: design column '{design[key]}' not found; ignored")
+            design[key] = ""
+    return design, warnings
+
+
+def design_log(summary: Dict) -> Optional[str]:
+    variance = summary.get("variance")
+    if not variance:
+        return None
+    if variance.get("error"):
+        return f"Warning: {variance['method']} variance failed ({variance['error']}); naive MOE used"
+    detail = f"{variance['strata']} strata, {variance['psus']} PSUs"
+    if variance["replicates"]:
+        detail += f", {variance['replicates']} replicates"
+    return f"Design-based variance: {variance['method']} ({detail})"
+
+
+def summarize_dataframe(df: pd.DataFrame, column_count: Optional[int] = None, design: Optional[Dict] = None) -> Dict:
+    """Summary artifact for an in-memory processed frame."""
+    numeric_cols = list(df.select_dtypes(include=["number"]).columns)
+    edges, shifts = {}, {}
+    for col in numeric_cols:
+        values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            edges[col] = None
+            continue
+        q1, q3 = np.percentile(values, [25, 75])
+        edges[col] = auto_bin_edges(float(values.min()), float(values.max()), len(values), float(q3 - q1))
+        shifts[col] = float(values.mean())
+    acc = SummaryAccumulator(numeric_cols, edges, shifts, design).update(df)
+    return acc.result(len(df.columns) if column_count is None else column_count)
+
+
+def _source_stamp(processed_filepath: str) -> Dict:
+    st = os.stat(processed_filepath)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def write_summary(path: str, summary: Dict, processed_filepath: str):
+    summary = dict(summary, source=_source_stamp(processed_filepath))
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f)
+    os.replace(tmp_path, path)
+
+
+def load_summary(path: str, processed_filepath: str) -> Optional[Dict]:
+    """The artifact at `path`, or None if it is missing or describes a
+    different version of the processed output.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if summary.get("version") != SUMMARY_VERSION or summary.get("source") != _source_stamp(processed_filepath):
+        return None
+    return summary
+
+
+def ensure_summary(upload_folder: str, job_id, processed_filepath: str) -> Dict:
+    """Load the job's summary, rebuilding it from the processed output when
+    needed (jobs processed before artifacts existed, or after reprocessing).
+    """
+    path = summary_path(upload_folder, job_id)
+    summary = load_summary(path, processed_filepath)
+    if summary is None:
+        df = read_processed(processed_filepath, numeric_only=True)
+        summary = summarize_dataframe(df, len(processed_columns(processed_filepath)))
+        write_summary(path, summary, processed_filepath)
+    return summary
+
+
+def summary_table(summary: Dict) -> pd.DataFrame:
+    """The Variable / Weighted Mean / Margin of Error table shown to users."""
+    rows = [
+        {
+            "Variable": var["name"],
+            "Weighted Mean": np.nan if var["weighted_mean"] is None else var["weighted_mean"],
+            "Margin of Error (95% CI)": np.nan if var["margin_of_error"] is None else var["margin_of_error"],
+        }
+        for var in summary["variables"]
+        if var["name"] != WEIGHT_COL
+    ]
+    return pd.DataFrame(rows)
+
+
+def histogram_columns(summary: Dict, limit: int = 5) -> List[str]:
+    return [var["name"] for var in summary["variables"]][:limit]
+
+
+def streaming_bin_edges(stats, fills: Dict[str, float], limits: Dict[str, Tuple[float, float]]):
+    """Bin edges and shifts for the processed columns of a streaming run,
+    predicted from the first-pass ColumnStats, the imputation fills and the
+    (lower, upper) range outlier handling leaves each column in.
+    """
+    edges, shifts = {}, {}
+    for col, st in stats.items():
+        fill = fills.get(col)
+        n = st.count + (st.missing if fill is not None else 0)
+        lo, hi = st.min, st.max
+        if col in limits:
+            lo, hi = max(lo, limits[col][0]), min(hi, limits[col][1])
+        q = st.quantiles([0.25, 0.75], fill)
+        edges[col] = auto_bin_edges(lo, hi, n, q[0.75] - q[0.25])
+        _, mean, _ = st.filled(fill)
+        shifts[col] = 0.0 if np.isnan(mean) else mean
+    return edges, shifts
@@ -0,0 +1,96 @@
+"""HTML tables without pandas Styler or DataFrame.to_html.
+
+render_table() produces the markup of DataFrame.to_html (a "dataframe"
+table with a thead and tbody, cells escaped) from a string builder. Each
+column is formatted once up front: floats like pandas' default display (6
+decimals with the common trailing zeros trimmed, or scientific notation
+for very large/small values), datetimes as dates when every time is
+midnight and otherwise at the finest resolution the column needs, or with
+a per-column format such as "{:.4f}". The app registers it as the
+`html_table` template filter.
+"""
+from html import escape
+from typing import Callable, Dict, List, Optional, Union
+import numpy as np
+import pandas as pd
+
+Formatter = Union[str, Callable]
+
+PRECISION = 6
+
+
+def _float_strings(values: np.ndarray, na_rep: str) -> List[str]:
+    out = [f"{v:.{PRECISION}f}" for v in values]
+    # Trim trailing zeros common to the column, keeping one decimal
+    fixed = [s for s, v in zip(out, values) if np.isfinite(v)]
+    trim = min(min((len(s) - len(s.rstrip("0")) for s in fixed), default=0), PRECISION - 1)
+    if trim:
+        out = [s[:-trim] if np.isfinite(v) else s for s, v in zip(out, values)]
+        fixed = [s[:-trim] for s in fixed]
+    # Scientific notation for tiny values, or large ones that got too long
+    finite = np.abs(values[np.isfinite(values)])
+    too_long = max(map(len, fixed), default=0) > PRECISION + 6
+    if ((finite > 0) & (finite < 10 ** -PRECISION)).any() or (too_long and (finite > 1e6).any()):
+        out = [f"{v:.{PRECISION}e}" if np.isfinite(v) else str(v) for v in values]
+    return [na_rep if np.isnan(v) else s for s, v in zip(out, values)]
+
+
+def _datetime_strings(values: np.ndarray) -> List[str]:
+    """datetime64 values as pandas displays them; NaT is always "NaT"."""
+    nat = np.isnat(values)
+    valid = values[~nat]
+    if (valid == valid.astype("datetime64[D]")).all():
+        unit = "D"
+    else:
+        unit = next((u for u in ("s", "ms", "us") if (valid == valid.astype(f"datetime64[{u}]")).all()), "ns")
+    strings = np.datetime_as_string(values, unit=unit)
+    return ["NaT" if missing else s.replace("T", " ") for s, missing in zip(strings, nat)]
+
+
+def format_column(series: pd.Series, formatter: Optional[Formatter] = None, na_rep: str = "NaN") -> List[str]:
+    """Display strings of a column (not yet escaped)."""
+    if formatter is not None:
+        fmt = formatter.format if isinstance(formatter, str) else formatter
+        return [na_rep if pd.isna(v) else fmt(v) for v in series.tolist()]
+    if pd.api.types.is_float_dtype(series.dtype):
+        return _float_strings(series.to_numpy(dtype=float), na_rep)
+    if pd.api.types.is_datetime64_dtype(series.dtype):
+        return _datetime_strings(series.to_numpy())
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        return [str(v) for v in series.tolist()]
+    if pd.api.types.is_integer_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+        return [str(v) for v in series.tolist()]
+    return [na_rep if isinstance(v, float) and np.isnan(v) else str(v) for v in series.tolist()]
+
+
+def render_table(df: pd.DataFrame, classes: Union[str, List[str], None] = None,
+                 formatters: Optional[Dict[str, Formatter]] = None, index: bool = False,
+                 na_rep: str = "NaN", border: int = 1) -> str:
+    """HTML table of `df`; `formatters` maps columns to a format string or
+    callable applied to non-missing values.
+    """
+    formatters = formatters or {}
+    if isinstance(classes, (list, tuple)):
+        classes = " ".join(classes)
+    css = "dataframe" + (f" {classes}" if classes else "")
+
+    columns = [
+        [escape(s, quote=False) for s in format_column(df.iloc[:, i], formatters.get(name), na_rep)]
+        for i, name in enumerate(df.columns)
+    ]
+    if index:
+        columns.insert(0, [escape(str(v), quote=False) for v in df.index.tolist()])
+
+    out = [f'<table border="{border}" class="{escape(css)}">', "  <thead>", '    <tr style="text-align: right;">']
+    if index:
+        out.append("      <th></th>")
+    out.extend(f"      <th>{escape(str(name), quote=False)}</th>" for name in df.columns)
+    out.extend(["    </tr>", "  </thead>", "  <tbody>"])
+    first = "th" if index else "td"
+    for row in zip(*columns):
+        out.append("    <tr>")
+        out.append(f"      <{first}>{row[0]}</{first}>")
+        out.extend(f"      <td>{cell}</td>" for cell in row[1:])
+        out.append("    </tr>")
+    out.extend(["  </tbody>", "</table>"])
+    return "\n".join(out)
@@ -0,0 +1,72 @@
+"""Materialized usage aggregates.
+
+usage_daily holds per-user, per-day counters (runs, rows processed, rule
+violations, bytes uploaded) and usage_users the same counters per user.
+They are kept up to date in the same transaction as the processing_jobs
+change: save_job adds a run, update_job_results adds the difference in
+rows and violations, and delete_job_by_id subtracts the job. A job counts
+on the day it was created. Rows processed are input rows (rows_before).
+
+rebuild_usage() recomputes both tables from processing_jobs. Run it with
+`python setup_db.py --backfill-usage` after bulk changes that bypass these
+functions, e.g. users deleted with their jobs by the foreign-key cascade.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ("runs", "rows_processed", "violations", "bytes_uploaded")
+
+_UPSERT = """
+    INSERT INTO {table} ({keys}, runs, rows_processed, violations, bytes_uploaded)
+    VALUES ({placeholders}, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        runs = runs + VALUES(runs),
+        rows_processed = rows_processed + VALUES(rows_processed),
+        violations = violations + VALUES(violations),
+        bytes_uploaded = bytes_uploaded + VALUES(bytes_uploaded)
+"""
+
+
+def bump_usage(cursor, username, day, runs=0, rows=0, violations=0, bytes_uploaded=0):
+    """Add (or, with negative values, subtract) to a user's counters.
+    `day` is a date, or None for the current date.
+    """
+    counts = (int(runs), int(rows or 0), int(violations or 0), int(bytes_uploaded or 0))
+    if not any(counts):
+        return
+    if day is None:
+        cursor.execute(
+            _UPSERT.format(table="usage_daily", keys="username, day", placeholders="%s, CURDATE()"),
+            (username, *counts),
+        )
+    else:
+        cursor.execute(
+            _UPSERT.format(table="usage_daily", keys="username, day", placeholders="%s, %s"),
+            (username, day, *counts),
+        )
+    cursor.execute(_UPSERT.format(table="usage_users", keys="username", placeholders="%s"), (username, *counts))
+
+
+def rebuild_usage(cursor):
+    """Recompute usage_daily and usage_users from processing_jobs. Run in a
+    transaction; the caller commits.
+    """
+    cursor.execute("DELETE FROM usage_daily")
+    cursor.execute("""
+        INSERT INTO usage_daily (username, day, runs, rows_processed, violations, bytes_uploaded)
+        SELECT username, DATE(created_at), COUNT(*), COALESCE(SUM(rows_before), 0),
+               COALESCE(SUM(violations_count), 0), COALESCE(SUM(bytes_uploaded), 0)
+        FROM processing_jobs
+        WHERE username IS NOT NULL
+        GROUP BY username, DATE(created_at)
+    """)
+    days = cursor.rowcount
+    cursor.execute("DELETE FROM usage_users")
+    cursor.execute("""
+        INSERT INTO usage_users (username, runs, rows_processed, violations, bytes_uploaded)
+        SELECT username, SUM(runs), SUM(rows_processed), SUM(violations), SUM(bytes_uploaded)
+        FROM usage_daily
+        GROUP BY username
+    """)
+    logger.info("Rebuilt usage aggregates: %s user-days, %s users", days, cursor.rowcount)
@@ -0,0 +1,161 @@
+"""Per-job violation index.
+
+Rule violations (see utils.rules) are stored as a sparse check x row
+matrix in CSR form. violations_{job_id}.npy holds the violating row
+positions of the processed output, sorted within each check; the matching
+.json holds the checks, their offsets into the row array and the totals.
+The row array is memory-mapped on load, so paging through one check reads
+only that slice, and the rows themselves are read from the processed
+output with storage.read_rows.
+"""
+import json
+import os
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from utils.storage import read_rows
+
+VIOLATIONS_VERSION = 1
+
+
+def violations_path(upload_folder: str, job_id) -> str:
+    """Path of the index metadata; the row array sits next to it (.npy)."""
+    return os.path.join(upload_folder, f"violations_{job_id}.json")
+
+
+def _rows_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".npy"
+
+
+def delete_violations(upload_folder: str, job_id):
+    path = violations_path(upload_folder, job_id)
+    for p in (path, _rows_path(path)):
+        if os.path.exists(p):
+            os.remove(p)
+
+
+class ViolationIndexBuilder:
+    """Collects violating rows from RuleResults of the whole frame or of
+    consecutive chunks (`offset` = position of the chunk's first row).
+    """
+
+    def __init__(self):
+        self.checks: List[Tuple[str, str]] = []
+        self._ids: Dict[Tuple[str, str], int] = {}
+        self._rows: List[List[np.ndarray]] = []
+        self.rows = 0
+
+    def add(self, result, offset: int = 0):
+        for i, check in enumerate(result.checks):
+            if check not in self._ids:
+                self._ids[check] = len(self.checks)
+                self.checks.append(check)
+                self._rows.append([])
+            if result.counts[i]:
+                self._rows[self._ids[check]].append(np.flatnonzero(result.check_mask(i)) + offset)
+        self.rows = max(self.rows, offset + result.rows)
+        return self
+
+    @property
+    def total(self) -> int:
+        return int(sum(len(part) for parts in self._rows for part in parts))
+
+    def write(self, path: str):
+        counts = [sum(len(part) for part in parts) for parts in self._rows]
+        indptr = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+        dtype = np.uint32 if self.rows < 2 ** 32 else np.int64
+        rows = np.concatenate([part for parts in self._rows for part in parts] or [np.zeros(0)]).astype(dtype)
+        failing_rows = int(len(np.unique(rows)))
+        meta = {
+            "version": VIOLATIONS_VERSION,
+            "rows": int(self.rows),
+            "total": int(indptr[-1]),
+            "failing_rows": failing_rows,
+            "checks": [
+                {"id": i, "column": col, "description": text, "count": int(counts[i])}
+                for i, (col, text) in enumerate(self.checks)
+            ],
+            "indptr": indptr.tolist(),
+        }
+        # Row array first: a reader that finds the metadata finds its rows
+        rows_tmp = f"{_rows_path(path)}.part"
+        with open(rows_tmp, "wb") as f:
+            np.save(f, rows)
+        os.replace(rows_tmp, _rows_path(path))
+        tmp_path = f"{path}.part"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+
+class ViolationIndex:
+    """Read side of a job's violation index."""
+
+    def __init__(self, meta: Dict, rows: np.ndarray):
+        self.meta = meta
+        self.indptr = np.asarray(meta["indptr"], dtype=np.int64)
+        self.rows = rows
+
+    @classmethod
+    def load(cls, path: str) -> Optional["ViolationIndex"]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                meta = json.load(f)
+            rows = np.load(_rows_path(path), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != VIOLATIONS_VERSION:
+            return None
+        return cls(meta, rows)
+
+    @property
+    def checks(self) -> List[Dict]:
+        return self.meta["checks"]
+
+    def check_rows(self, check: int) -> np.ndarray:
+        return self.rows[self.indptr[check]:self.indptr[check + 1]]
+
+    def failing_rows(self) -> np.ndarray:
+        """Rows violating any check, ascending."""
+        return np.unique(np.asarray(self.rows))
+
+    def checks_for_rows(self, rows: np.ndarray) -> List[List[int]]:
+        """For each row, the ids of the checks it violates."""
+        found: List[List[int]] = [[] for _ in rows]
+        for check in range(len(self.checks)):
+            segment = self.check_rows(check)
+            if not len(segment):
+                continue
+            pos = np.searchsorted(segment, rows)
+            hit = (pos < len(segment)) & (segment[np.minimum(pos, len(segment) - 1)] == rows)
+            for i in np.flatnonzero(hit):
+                found[i].append(check)
+        return found
+
+    def page(self, processed_filepath: str, check: Optional[int] = None, page: int = 1,
+             per_page: int = 50, columns: Optional[List[str]] = None) -> Dict:
+        """One page of violating rows (of `check`, or of any check), read
+        from the processed output.
+        """
+        if check is not None and not 0 <= check < len(self.checks):
+            raise ValueError(f"Unknown rule id {check}")
+        candidates = self.check_rows(check) if check is not None else self.failing_rows()
+        total = int(len(candidates))
+        page = max(int(page), 1)
+        start = (page - 1) * per_page
+        rows = np.asarray(candidates[start:start + per_page], dtype=np.int64)
+        records, names = [], []
+        if len(rows):
+            df = read_rows(processed_filepath, rows, columns)
+            names = [str(c) for c in df.columns]
+            df = df.astype(object).where(df.notna(), None)
+            for row, violated, record in zip(rows.tolist(), self.checks_for_rows(rows), df.to_dict(orient="records")):
+                records.append({"row": row, "rules": violated, "values": record})
+        return {
+            "rule": check,
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+            "pages": (total + per_page - 1) // per_page,
+            "columns": names,
+            "rows": records,
+        }
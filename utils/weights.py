@@ -1,6 +1,10 @@
+import os
 import pandas as pd
 import numpy as np
 
+# Rows per block for the batched reductions; bounds the size of temporaries
+BLOCK_ROWS = 65536
+
 def apply_weights(df, weight_col):
     if weight_col not in df.columns:
         raise ValueError(f"Weight column '{weight_col}' not found in data.")
@@ -26,3 +30,453 @@ def compute_weighted_summary(df, value_col, weight_col='weight'):
         'weighted_mean': weighted_mean,
         'margin_of_error': margin_of_error
     }
+
+def weighted_moments(matrix, weights=None, shift=None):
+    """
+    Per-column sums over the rows where both the value and the weight are
+    present: n, sum_w, sum_wx and sum_wx2, with x taken about `shift`.
+    With weights=None every weight is 1. Columns are reduced together with
+    masked NumPy operations, in blocks of BLOCK_ROWS rows.
+    """
+    X = np.asarray(matrix, dtype=np.float64)
+    if X.ndim == 1:
+        X = X[:, None]
+    p = X.shape[1]
+    w = None if weights is None else np.asarray(weights, dtype=np.float64)
+    shift = np.zeros(p) if shift is None else np.asarray(shift, dtype=np.float64)
+    n = np.zeros(p, dtype=np.int64)
+    sum_w, sum_wx, sum_wx2 = np.zeros(p), np.zeros(p), np.zeros(p)
+    for start in range(0, X.shape[0], BLOCK_ROWS):
+        block = X[start:start + BLOCK_ROWS]
+        mask = ~np.isnan(block)
+        if w is None:
+            wb = mask.astype(np.float64)
+        else:
+            wblock = w[start:start + BLOCK_ROWS]
+            mask &= ~np.isnan(wblock)[:, None]
+            wb = np.where(mask, wblock[:, None], 0.0)
+        xb = np.where(mask, block - shift, 0.0)
+        wx = wb * xb
+        n += mask.sum(axis=0)
+        sum_w += wb.sum(axis=0)
+        sum_wx += wx.sum(axis=0)
+        sum_wx2 += (wx * xb).sum(axis=0)
+    return {'n': n, 'sum_w': sum_w, 'sum_wx': sum_wx, 'sum_wx2': sum_wx2, 'shift': shift}
+
+def summaries_from_moments(moments):
+    """Weighted mean, variance, SE and MOE per column from weighted_moments()
+    output (same definitions as compute_weighted_summary). Columns with no
+    usable rows or zero total weight get NaN.
+    """
+    n, sum_w = moments['n'], moments['sum_w']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ok = (n > 0) & (sum_w != 0)
+        rel_mean = np.where(ok, moments['sum_wx'] / sum_w, np.nan)
+        weighted_var = np.maximum(moments['sum_wx2'] / sum_w - rel_mean ** 2, 0.0)
+        weighted_var = np.where(ok, weighted_var, np.nan)
+        weighted_se = np.sqrt(weighted_var) / np.sqrt(n)
+    return {
+        'n': n,
+        'weighted_mean': moments['shift'] + rel_mean,
+        'weighted_var': weighted_var,
+        'weighted_se': weighted_se,
+        'margin_of_error': 1.96 * weighted_se,
+    }
+
+def compute_weighted_summaries(matrix, weights, columns=None):
+    """
+    Batched compute_weighted_summary: weighted mean, variance, SE and MOE for
+    every column of `matrix` (a DataFrame or 2-D array) in one pass, with
+    per-column missingness. Returns a DataFrame indexed by column.
+    """
+    if isinstance(matrix, pd.DataFrame):
+        columns = list(matrix.columns) if columns is None else columns
+        matrix = matrix.to_numpy(dtype=np.float64, na_value=np.nan)
+    X = np.asarray(matrix, dtype=np.float64)
+    if X.ndim == 1:
+        X = X[:, None]
+    # Sums are taken about each column's first observed value for accuracy
+    first = np.argmax(~np.isnan(X), axis=0) if len(X) else np.zeros(X.shape[1], dtype=np.int64)
+    shift = np.nan_to_num(X[first, np.arange(X.shape[1])]) if len(X) else None
+    if isinstance(weights, pd.Series):
+        weights = weights.to_numpy(dtype=np.float64, na_value=np.nan)
+    stats = summaries_from_moments(weighted_moments(X, weights, shift))
+    return pd.DataFrame(stats, index=columns if columns is not None else range(X.shape[1]))
+
+# ----------------------------------------------------------------------------
+# Design-based variance estimation
+# ----------------------------------------------------------------------------
+VARIANCE_METHODS = ("Naive", "Linearization", "Jackknife", "BRR", "Bootstrap")
+REPLICATE_METHODS = ("Jackknife", "BRR", "Bootstrap")
+DEFAULT_REPLICATES = 200
+# Processes used for bootstrap replicates (1 = in-process)
+VARIANCE_WORKERS = int(os.getenv("VARIANCE_WORKERS", "1"))
+# Bootstrap replicates are generated (and optionally farmed out) in blocks
+REPLICATE_BLOCK = 25
+
+def design_from_params(params):
+    """Variance design from the process-form fields, or None for the naive SE."""
+    method = params.get("variance_method") or "Naive"
+    if method not in VARIANCE_METHODS or method == "Naive":
+        return None
+    try:
+        replicates = int(params.get("replicates") or DEFAULT_REPLICATES)
+    except (TypeError, ValueError):
+        replicates = DEFAULT_REPLICATES
+    return {
+        "method": method,
+        "strata_col": params.get("strata_col") or "",
+        "cluster_col": params.get("cluster_col") or "",
+        "replicates": max(2, replicates),
+    }
+
+def _sylvester_hadamard(size):
+    H = np.ones((1, 1))
+    while len(H) < size:
+        H = np.block([[H, H], [H, -H]])
+    return H
+
+def _bootstrap_block(args):
+    """Replicate estimates (ratio numerators and denominators) for one block of
+    Rao-Wu bootstrap replicates. Top-level so a process pool can run it.
+    """
+    A, B, unit_stratum, sizes, starts, n_reps, seed = args
+    rng = np.random.default_rng(seed)
+    draws_stratum = np.repeat(np.arange(len(sizes)), np.maximum(sizes - 1, 0))
+    scale = np.where(sizes > 1, sizes / np.maximum(sizes - 1, 1), 1.0)[unit_stratum]
+    singleton = (sizes == 1)[unit_stratum]
+    F = np.empty((n_reps, len(unit_stratum)))
+    for r in range(n_reps):
+        picks = starts[draws_stratum] + (rng.random(len(draws_stratum)) * sizes[draws_stratum]).astype(np.int64)
+        counts = np.bincount(picks, minlength=len(unit_stratum))
+        F[r] = np.where(singleton, 1.0, counts * scale)
+    return F @ A, F @ B
+
+class DesignAggregator:
+    """
+    Sufficient statistics for design-based variance of weighted means,
+    accumulated chunk by chunk. Rows are reduced to per-PSU totals of
+    a = w * (y - shift) and b = w over observed values. Every estimator then
+    works on these small matrices: Taylor linearization, or replicate
+    estimates as (replicate factors @ PSU totals) matrix products. Without a
+    cluster column each row is its own PSU. Linearization then keeps
+    per-stratum moments, and the replicate methods use random groups of rows.
+    """
+
+    def __init__(self, method, n_columns, shift=None, replicates=DEFAULT_REPLICATES, has_psu=False, seed=0):
+        self.method = method
+        self.p = n_columns
+        self.shift = np.zeros(n_columns) if shift is None else np.asarray(shift, dtype=np.float64)
+        self.replicates = int(replicates)
+        self.has_psu = has_psu
+        self.row_psus = not has_psu and method == "Linearization"
+        self._rng = np.random.default_rng(seed)
+        self._strata = {}
+        self._psus = {}
+        self._units = {}
+        self._A = np.zeros((0, n_columns))
+        self._B = np.zeros((0, n_columns))
+        # rows-as-PSUs linearization: per-stratum n, sums and cross-products
+        self._row_moments = {}
+
+    @staticmethod
+    def _codes(values, table):
+        """Map arbitrary labels to stable integer codes across chunks."""
+        local, uniques = pd.factorize(pd.Series(values), use_na_sentinel=False)
+        mapping = np.array(
+            [table.setdefault(None if pd.isna(u) else u, len(table)) for u in uniques], dtype=np.int64
+        )
+        return mapping[local]
+
+    def update(self, matrix, weights=None, strata=None, psu=None):
+        X = np.asarray(matrix, dtype=np.float64).reshape(len(matrix), self.p)
+        n = len(X)
+        w = np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64)
+        keep = ~np.isnan(w)
+        h = np.zeros(n, dtype=np.int64) if strata is None else self._codes(strata, self._strata)
+        X, w, h = X[keep], w[keep], h[keep]
+        mask = ~np.isnan(X)
+        a = np.where(mask, (X - self.shift) * w[:, None], 0.0)
+        b = np.where(mask, w[:, None], 0.0)
+        if self.row_psus:
+            for code in np.unique(h):
+                rows = h == code
+                ah, bh = a[rows], b[rows]
+                m = self._row_moments.setdefault(int(code), [0, 0.0, 0.0, 0.0, 0.0, 0.0])
+                m[0] += int(rows.sum())
+                m[1] = m[1] + ah.sum(axis=0)
+                m[2] = m[2] + bh.sum(axis=0)
+                m[3] = m[3] + (ah * ah).sum(axis=0)
+                m[4] = m[4] + (ah * bh).sum(axis=0)
+                m[5] = m[5] + (bh * bh).sum(axis=0)
+            return self
+        if self.has_psu:
+            g = self._codes(psu, self._psus)[keep]
+        else:
+            # Random groups of rows stand in for PSUs (delete-a-group designs)
+            g = self._rng.integers(0, self.replicates, len(h))
+        keys = (h << 32) | g
+        local, uniques = pd.factorize(keys)
+        new = [int(key) for key in uniques if int(key) not in self._units]
+        for key in new:
+            self._units[key] = len(self._units)
+        if new:
+            grow = np.zeros((len(new), self.p))
+            self._A, self._B = np.vstack([self._A, grow]), np.vstack([self._B, grow])
+        codes = np.array([self._units[int(key)] for key in uniques], dtype=np.int64)[local]
+        if len(codes):
+            order = np.argsort(codes, kind="stable")
+            sorted_codes = codes[order]
+            starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+            targets = sorted_codes[starts]
+            self._A[targets] += np.add.reduceat(a[order], starts, axis=0)
+            self._B[targets] += np.add.reduceat(b[order], starts, axis=0)
+        return self
+
+    def _unit_totals(self):
+        """PSU totals sorted by stratum, with pseudo-PSUs merged to the group
+        count each replicate method needs.
+        """
+        A, B = self._A, self._B
+        keys = np.fromiter(self._units, dtype=np.int64, count=len(self._units))
+        unit_stratum = keys >> 32
+        if not self.has_psu and len(keys):
+            n_strata = len(np.unique(unit_stratum))
+            groups = 2 if self.method == "BRR" else max(2, self.replicates // n_strata)
+            local, uniques = pd.factorize((unit_stratum << 32) | ((keys & 0xFFFFFFFF) % groups))
+            A = np.zeros((len(uniques), self.p)); np.add.at(A, local, self._A)
+            B = np.zeros((len(uniques), self.p)); np.add.at(B, local, self._B)
+            unit_stratum = np.asarray(uniques, dtype=np.int64) >> 32
+        order = np.argsort(unit_stratum, kind="stable")
+        return A[order], B[order], unit_stratum[order]
+
+    def estimate(self, workers=1):
+        """Weighted means and their design-based variances for every column.
+        Returns a dict of arrays (mean, var, se, margin_of_error) plus the
+        number of strata, PSUs and replicates used.
+        """
+        if self.row_psus:
+            moments = [self._row_moments[k] for k in sorted(self._row_moments)]
+            n_h = np.array([m[0] for m in moments], dtype=np.float64)
+            SA, SB, SAA, SAB, SBB = (np.array([m[i] for m in moments]).reshape(len(moments), self.p) for i in range(1, 6))
+            total_a, total_b = SA.sum(axis=0), SB.sum(axis=0)
+            info = {"strata": len(moments), "psus": int(n_h.sum()), "replicates": 0}
+            return self._linearization(total_a, total_b, n_h, SA, SB, SAA, SAB, SBB, info)
+
+        A, B, unit_stratum = self._unit_totals()
+        strata, sizes = np.unique(unit_stratum, return_counts=True)
+        stratum_index = np.searchsorted(strata, unit_stratum)
+        total_a, total_b = A.sum(axis=0), B.sum(axis=0)
+        info = {"strata": len(strata), "psus": len(unit_stratum), "replicates": 0}
+        if self.method == "Linearization":
+            def per_stratum(M):
+                out = np.zeros((len(strata), self.p)); np.add.at(out, stratum_index, M)
+                return out
+            return self._linearization(total_a, total_b, sizes.astype(np.float64), per_stratum(A), per_stratum(B),
+                                       per_stratum(A * A), per_stratum(A * B), per_stratum(B * B), info)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            theta = total_a / total_b
+        if self.method == "Jackknife":
+            # Delete one PSU, reweight the rest of its stratum by n_h / (n_h - 1)
+            n_h = sizes[stratum_index].astype(np.float64)
+            Ah = np.zeros((len(strata), self.p)); np.add.at(Ah, stratum_index, A)
+            Bh = np.zeros((len(strata), self.p)); np.add.at(Bh, stratum_index, B)
+            usable = n_h > 1
+            factor = np.where(usable, n_h / np.maximum(n_h - 1, 1), 1.0)[:, None]
+            rep_a = total_a - Ah[stratum_index] + factor * (Ah[stratum_index] - A)
+            rep_b = total_b - Bh[stratum_index] + factor * (Bh[stratum_index] - B)
+            coef = np.where(usable, (n_h - 1) / n_h, 0.0)
+        elif self.method == "BRR":
+            if np.any(sizes != 2):
+                raise ValueError("BRR needs exactly two PSUs in every stratum")
+            H = _sylvester_hadamard(len(strata) + 1)[:, 1:len(strata) + 1]
+            F = np.empty((len(H), len(unit_stratum)))
+            F[:, 0::2] = 1.0 + H
+            F[:, 1::2] = 1.0 - H
+            rep_a, rep_b = F @ A, F @ B
+            coef = np.full(len(H), 1.0 / len(H))
+        else:
+            starts = np.r_[0, np.cumsum(sizes)[:-1]]
+            n_blocks = -(-self.replicates // REPLICATE_BLOCK)
+            seeds = np.random.SeedSequence(int(self._rng.integers(2 ** 32))).spawn(n_blocks)
+            jobs = [
+                (A, B, stratum_index, sizes, starts, min(REPLICATE_BLOCK, self.replicates - i * REPLICATE_BLOCK), seeds[i])
+                for i in range(n_blocks)
+            ]
+            if workers > 1 and n_blocks > 1:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    parts = list(pool.map(_bootstrap_block, jobs))
+            else:
+                parts = [_bootstrap_block(job) for job in jobs]
+            rep_a = np.vstack([pa for pa, _ in parts])
+            rep_b = np.vstack([pb for _, pb in parts])
+            coef = np.full(self.replicates, 1.0 / self.replicates)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            reps = rep_a / rep_b
+            var = (coef[:, None] * (reps - theta) ** 2).sum(axis=0)
+        info["replicates"] = len(coef)
+        return self._result(theta, var, info)
+
+    def _linearization(self, total_a, total_b, n_h, SA, SB, SAA, SAB, SBB, info):
+        # Linearized PSU totals t = (A - theta * B) / W, summed per stratum:
+        # var = sum_h n_h / (n_h - 1) * (sum t^2 - (sum t)^2 / n_h)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            theta = total_a / total_b
+            st = SA - theta * SB
+            stt = SAA - 2 * theta * SAB + theta ** 2 * SBB
+            n = n_h[:, None]
+            per_stratum = np.where(n > 1, n / np.maximum(n - 1, 1) * (stt - st ** 2 / n), 0.0)
+            var = np.maximum(per_stratum.sum(axis=0), 0.0) / total_b ** 2
+        return self._result(theta, var, info)
+
+    def _result(self, theta, var, info):
+        se = np.sqrt(var)
+        return dict(info, mean=self.shift + theta, var=var, se=se, margin_of_error=1.96 * se)
+
+def design_summaries(matrix, weights=None, strata=None, psu=None, method="Linearization",
+                     replicates=DEFAULT_REPLICATES, columns=None, workers=1, seed=0):
+    """
+    Design-based weighted means, variances, SEs and MOEs for every column of
+    `matrix`, with optional strata and cluster (PSU) arrays. `method` is
+    Linearization (Taylor series), Jackknife, BRR or Bootstrap. Returns a
+    DataFrame indexed by column.
+    """
+    if isinstance(matrix, pd.DataFrame):
+        columns = list(matrix.columns) if columns is None else columns
+        matrix = matrix.to_numpy(dtype=np.float64, na_value=np.nan)
+    X = np.asarray(matrix, dtype=np.float64)
+    if X.ndim == 1:
+        X = X[:, None]
+    if isinstance(weights, pd.Series):
+        weights = weights.to_numpy(dtype=np.float64, na_value=np.nan)
+    observed = ~np.isnan(X)
+    shift = np.where(observed, X, 0.0).sum(axis=0) / np.maximum(observed.sum(axis=0), 1)
+    agg = DesignAggregator(method, X.shape[1], shift, replicates, has_psu=psu is not None, seed=seed)
+    est = agg.update(X, weights, strata, psu).estimate(workers)
+    return pd.DataFrame(
+        {k: est[k] for k in ("mean", "var", "se", "margin_of_error")},
+        index=columns if columns is not None else range(X.shape[1]),
+    )
+
+# ----------------------------------------------------------------------------
+# Raking (iterative proportional fitting to marginal control totals)
+# ----------------------------------------------------------------------------
+RAKE_MAX_ITER = int(os.getenv("RAKE_MAX_ITER", "100"))
+RAKE_TOLERANCE = 1e-6
+
+def _category_label(value):
+    """Control totals are keyed by strings; 1, 1.0 and "1" all match "1"."""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+class MarginEncoder:
+    """
+    Integer-codes the raking variables against their control totals, chunk by
+    chunk. For each margin, category k of the targets gets code k. Missing
+    values get code K (one past the last category), and their weights are
+    left unchanged by that margin.
+    """
+
+    def __init__(self, margins):
+        self.columns = list(margins)
+        self.labels = [[str(k) for k in margins[col]] for col in self.columns]
+        self.targets = [np.array([float(v) for v in margins[col].values()]) for col in self.columns]
+        self._index = [{label: k for k, label in enumerate(labels)} for labels in self.labels]
+
+    def encode(self, df):
+        codes = []
+        for col, index in zip(self.columns, self._index):
+            if col not in df.columns:
+                raise ValueError(f"Raking column '{col}' not found.")
+            local, uniques = pd.factorize(df[col])
+            mapping = np.empty(len(uniques) + 1, dtype=np.int64)
+            for i, value in enumerate(uniques):
+                label = _category_label(value)
+                if label not in index:
+                    raise ValueError(f"Raking: value '{label}' of '{col}' has no control total.")
+                mapping[i] = index[label]
+            mapping[-1] = len(index)  # factorize's -1 (missing) indexes the last slot
+            codes.append(mapping[local].astype(np.int32))
+        return codes
+
+def rake_weights(codes, targets, base_weights=None, trim=(None, None), max_iter=RAKE_MAX_ITER, tol=RAKE_TOLERANCE):
+    """
+    Iterative proportional fitting. `codes` holds one integer array per
+    margin (from MarginEncoder) and `targets` the matching control totals.
+    Targets that sum to 1 are taken as proportions of the total base weight.
+    Group sums use np.bincount. Trimming bounds, given as multiples of the
+    mean weight, are applied after every sweep.
+
+    Returns (weights, info) where info has iterations, converged, max_error,
+    trimmed and seconds.
+    """
+    import time
+
+    started = time.perf_counter()
+    n = len(codes[0]) if codes else len(base_weights)
+    w = np.ones(n) if base_weights is None else np.asarray(base_weights, dtype=np.float64).copy()
+    w = np.where(np.isnan(w), 0.0, w)
+    totals = []
+    for code, target in zip(codes, targets):
+        target = np.asarray(target, dtype=np.float64)
+        if np.isclose(target.sum(), 1.0):
+            covered = np.bincount(code, weights=w, minlength=len(target) + 1)[:len(target)].sum()
+            target = target * covered
+        totals.append(target)
+    lower, upper = trim
+
+    def margin_error():
+        worst = 0.0
+        for code, target in zip(codes, totals):
+            sums = np.bincount(code, weights=w, minlength=len(target) + 1)[:len(target)]
+            present = target > 0
+            worst = max(worst, float(np.max(np.abs(sums[present] / target[present] - 1.0), initial=0.0)))
+        return worst
+
+    iterations, converged, error, trimmed = 0, False, np.inf, 0
+    for iterations in range(1, max_iter + 1):
+        for code, target in zip(codes, totals):
+            sums = np.bincount(code, weights=w, minlength=len(target) + 1)
+            factor = np.ones(len(target) + 1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                factor[:-1] = np.where(sums[:-1] > 0, target / sums[:-1], 1.0)
+            w *= factor[code]
+        if lower is not None or upper is not None:
+            mean = w.mean()
+            lo = -np.inf if lower is None else lower * mean
+            hi = np.inf if upper is None else upper * mean
+            trimmed = int(((w < lo) | (w > hi)).sum())
+            np.clip(w, lo, hi, out=w)
+        error = margin_error()
+        if error < tol:
+            converged = True
+            break
+    return w, {
+        "iterations": iterations,
+        "converged": converged,
+        "max_error": error,
+        "trimmed": trimmed,
+        "seconds": time.perf_counter() - started,
+    }
+
+def rake_dataframe(df, margins, base_col=None, trim=(None, None), max_iter=RAKE_MAX_ITER, tol=RAKE_TOLERANCE):
+    """Raked weights for `df` (see rake_weights), starting from `base_col`
+    or from 1 when no base weight column is given.
+    """
+    encoder = MarginEncoder(margins)
+    base = df[base_col].to_numpy(dtype=np.float64, na_value=np.nan) if base_col else None
+    return rake_weights(encoder.encode(df), encoder.targets, base, trim, max_iter, tol)
+
+def rake_log(margins, info):
+    """Workflow log lines describing a raking run."""
+    status = "converged" if info["converged"] else "did not converge"
+    lines = [
+        f"Raked weights to {len(margins)} margins: {status} after {info['iterations']} iterations "
+        f"(max margin error {info['max_error']:.2e}, {info['seconds']:.2f}s)"
+    ]
+    if info["trimmed"]:
+        lines.append(f"Trimmed {info['trimmed']} weights to the configured bounds")
+    return lines